@@ -2,122 +2,807 @@
 """
 Module checking incoming dataframes
 """
+import os
+import numpy as np
 import pandas as pd
-from sklearn.preprocessing import MinMaxScaler
+import scipy.sparse
+from sklearn.feature_extraction import FeatureHasher
+from sklearn.preprocessing import MinMaxScaler, MaxAbsScaler
 from sklearn.preprocessing import StandardScaler
-from sklearn.preprocessing import OneHotEncoder
+from app.datasets import DatasetStore
 
-def data_check(redis_client, dataframe,tasks, task_id):
+# Feature matrices with at most this share of non-zero values are kept sparse (CSR)
+SPARSE_MAX_DENSITY = float(os.environ.get('SPARSE_MAX_DENSITY', '0.1'))
+# Categorical columns with more distinct values are not One-Hot encoded
+CATEGORY_LIMIT = int(os.environ.get('CATEGORY_LIMIT', '1000'))
+# Encoding of the columns above CATEGORY_LIMIT: "frequency", "hashing" or "one-hot"
+HIGH_CARDINALITY_ENCODING = os.environ.get('HIGH_CARDINALITY_ENCODING', 'frequency')
+# Number of columns a column with hashing encoding is hashed to
+HASH_FEATURES = int(os.environ.get('HASH_FEATURES', '256'))
+# Share of the non-empty values of a text column which have to be numbers (or datetimes)
+# for it to be parsed as numeric (datetime) column, the other values count as invalid
+NUMERIC_MIN_SHARE = float(os.environ.get('NUMERIC_MIN_SHARE', '0.95'))
+# Columns with a different value in at least this many rows are dropped as IDs
+ID_MIN_ROWS = int(os.environ.get('ID_MIN_ROWS', '50'))
+# Number of distinct values of a text column its type is inferred from
+INFER_VALUES = int(os.environ.get('INFER_VALUES', '10000'))
+
+def data_check(task_store, dataframe, task_id):
     """
-    Checks a dataframe and clears it for clustering
+    Checks a dataframe and clears it for clustering: the columns are typed
+    and coerced by clean_columns, rows with null or invalid values removed
+    and a report of the columns is appended to the task message. The column
+    report is kept in the attrs of the cleaned dataframe as "types".
 
     Args:
+        task_store (TaskStore): The state of the tasks
         dataframe (pd.DataFrame): The uploaded CSV data.
-        cleaned_df (pd.DataFrame): The cleaned CSV data.
-        
+
     Returns:
         cleaned_df (pd.DataFrame): The cleaned CSV data.
     """
 
     try:
-        tasks[task_id]["status"] = "Data Preparation"
-        redis_client.hset(task_id,'status',"Data Preparation")
-        # Löscht alle Zeilen mit null-Werten
-        cleaned_df = dataframe.dropna()
-        tasks[task_id]["message"] += "Removed rows with null values. "
-        redis_client.hset(task_id,'message',tasks[task_id]["message"])
-
-        # Löscht alle Zeilen mit nicht alphanumerischen Werten
-        #for column in cleaned_df.columns:
-         #   #cleaned_df = cleaned_df[cleaned_df[column].apply(lambda x: str(x).isalnum())]
-         #   cleaned_df = cleaned_df[cleaned_df[column].apply(lambda x: isinstance(x, (int, float)) or str(x).isalnum())]
-         #   tasks[task_id]["message"] += "Removed rows with non-alphanumeric values. "
-         #   redis_client.hset(task_id,'message',tasks[task_id]["message"])
-
-        #löscht alle Zeilen, die Buchstaben UND Zanhlen enthalten
-        # Iteriert über die Spalten und erstellt eine Liste der zu löschenden Spalten
-        #columns_to_drop = [col for col in cleaned_df.columns if contains_numbers_and_letters(cleaned_df[col])]
-        # Löscht die ausgewählten Spalten
-        #cleaned_df = cleaned_df.drop(columns=columns_to_drop)
-        #if columns_to_drop:
-         #   tasks[task_id]["message"] += "Removed columns with inconsistent data(letters and numbers). "
-         #   redis_client.hset(task_id,'message',tasks[task_id]["message"])
-
-        cleaned_df = cleaned_df.reset_index(drop=True)
+        cleaned_df, report = clean_columns(dataframe)
+        if cleaned_df.shape[1] == 0:
+            raise ValueError("No columns left for clustering. " + column_report(report))
+        message = column_report(report) + f"Removed {len(dataframe) - len(cleaned_df)} rows with null values. "
+        task_store.append_message(task_id, message, status="Data Preparation")
+        # Gespeicherte, bereinigte Daten behalten die Typen der hochgeladenen Spalten
+        cleaned_df.attrs["types"] = dataframe.attrs.get("types", report)
         return cleaned_df
     except Exception as exception:
-        # Wenn ein Fehler auftritt, wird die Nachricht an `tasks[task_id]` angehangen.
-        tasks[task_id]["status"] = "Bad Request"
-        tasks[task_id]["message"] += str("data_check: " + str(exception))
-        redis_client.hset(task_id,'status',"Bad Request")
-        redis_client.hset(task_id,'message',tasks[task_id]["message"])
+        # Wenn ein Fehler auftritt, wird die Nachricht an die Task angehangen.
+        task_store.fail(task_id, "data_check: " + str(exception))
         return None
 
-def ohe(redis_client, cleaned_df,tasks, task_id):
+
+def _seconds(datetimes):
     """
-    Filtern der kategorischen Spalten und Durchführung von OHE
+    Returns datetimes as Unix seconds, NaN for missing values
     """
-    # Filter columns by data type (categorical)
-    try:
-        categorical_columns = cleaned_df.select_dtypes(include=['object']).columns.tolist()
+    datetimes = pd.to_datetime(datetimes, utc=True)
+    return np.asarray((datetimes - pd.Timestamp(0, tz="UTC")) / pd.Timedelta(seconds=1), dtype=float)
 
-        # One-Hot-Encoding for categorical columns
-        encoder = OneHotEncoder(sparse_output=False, drop='first')
-        encoded_columns = encoder.fit_transform(cleaned_df[categorical_columns])
-        encoded_feature_names = encoder.get_feature_names_out(input_features=categorical_columns)
-        encoded_df = pd.DataFrame(encoded_columns, columns=encoded_feature_names)
 
-        # Drop original categorical columns
-        cleaned_df = cleaned_df.drop(columns=categorical_columns)
+def _parse_numbers(text, locale):
+    """
+    Parses strings as numbers
+
+    Args:
+        text (pd.Series): The stripped strings
+        locale (str): "point" for 1,234.5 or "comma" for 1.234,5
+
+    Returns:
+        np.ndarray: The numbers, NaN for strings which are no finite numbers
+    """
+    if locale == "comma":
+        text = text.where(text.str.fullmatch(r"[+-]?(\d{1,3}(\.\d{3})+|\d+)(,\d+)?"))
+        text = text.str.replace(".", "", regex=False).str.replace(",", ".", regex=False)
+    else:
+        grouped = text.str.fullmatch(r"[+-]?\d{1,3}(,\d{3})+(\.\d+)?")
+        text = text.where(~grouped, text.str.replace(",", "", regex=False))
+    numbers = pd.to_numeric(text, errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+    return np.where(np.isfinite(numbers), numbers, np.nan)
+
+
+def _parse_datetimes(text, dayfirst):
+    """
+    Parses strings as datetimes, ISO 8601 or with the day first (01.02.2020) or last (02/01/2020)
+
+    Returns:
+        np.ndarray: Unix seconds, NaN for strings which are no datetimes
+    """
+    iso = text.str.match(r"\d{4}-\d{1,2}-\d{1,2}")
+    datetimes = pd.to_datetime(text.where(iso), errors="coerce", utc=True, format="ISO8601")
+    others = ~iso & text.str.match(r"\d{1,2}[./]\d{1,2}[./]\d{2,4}")
+    if others.any():
+        parsed = pd.to_datetime(text.where(others), errors="coerce", utc=True, format="mixed", dayfirst=dayfirst)
+        datetimes = datetimes.where(iso, parsed)
+    return _seconds(datetimes)
+
+
+def _infer_text(text, counts):
+    """
+    Infers the type of a text column from its distinct values
+
+    Args:
+        text (pd.Series): The distinct stripped strings
+        counts (np.ndarray): The number of rows of every string, 0 for empty strings
+
+    Returns:
+        dict: The entry of the column report, without the counts
+    """
+    rows = counts.sum()
+    if rows == 0:
+        return {"type": "categorical"}
+    # Die Variante, die mehr Zeilen als Zahl liest, gewinnt; bei Gleichstand Tausenderkommas
+    parsed = {locale: counts[~np.isnan(_parse_numbers(text, locale))].sum() for locale in ("point", "comma")}
+    locale = max(parsed, key=parsed.get)
+    if parsed[locale] >= NUMERIC_MIN_SHARE * rows:
+        return {"type": "numeric", "locale": locale}
+
+    if counts[text.str.match(r"\d{1,4}[-./]\d{1,2}[-./]\d{1,4}").to_numpy()].sum() >= NUMERIC_MIN_SHARE * rows:
+        dayfirst = bool(counts[text.str.match(r"\d{1,2}\.").to_numpy()].sum() > rows / 2)
+        if dayfirst or text.str.match(r"\d{2}/").any():
+            # 13/01/2020 ist nur mit dem Tag zuerst gültig
+            dayfirst = dayfirst or bool(text.str.extract(r"^(\d{1,2})/", expand=False).astype(float).gt(12).any())
+        if counts[~np.isnan(_parse_datetimes(text, dayfirst))].sum() >= NUMERIC_MIN_SHARE * rows:
+            return {"type": "datetime", "dayfirst": dayfirst}
+    return {"type": "categorical"}
+
+
+def clean_column(series, entry=None):
+    """
+    Infers the type of a column and coerces its values in one vectorised pass.
+
+    Numeric, boolean and datetime columns become numbers (datetimes Unix seconds),
+    text columns are parsed on their distinct values only: as numbers with point
+    or comma decimals and thousands separators, as datetimes or otherwise as
+    categorical column with the stripped strings as categories.
+
+    Args:
+        series (pd.Series): The column
+        entry (dict): The entry of a column report inferred before, e.g. from the
+            first chunk of a file, None to infer the type
+
+    Returns:
+        tuple: (np.ndarray with NaN or pd.Categorical with -1 codes for missing values,
+                entry of the column report with "type" and the number of "invalid" values)
+    """
+    text_column = not (pd.api.types.is_numeric_dtype(series.dtype) or pd.api.types.is_datetime64_any_dtype(series.dtype)
+                       or pd.api.types.is_timedelta64_dtype(series.dtype))
+    if text_column or (entry is not None and entry["type"] == "categorical"):
+        return _clean_text(series, entry)
+
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        return _seconds(series), {"type": "datetime", "invalid": 0}
+    if pd.api.types.is_timedelta64_dtype(series.dtype):
+        return series.dt.total_seconds().to_numpy(dtype=float, na_value=np.nan), {"type": "numeric", "invalid": 0}
+    if isinstance(series.dtype, np.dtype) and series.dtype.kind in "iu":
+        # Ganzzahlen haben keine fehlenden Werte und bleiben Ganzzahlen
+        values = series.to_numpy()
+    else:
+        values = series.to_numpy(dtype=float, na_value=np.nan)
+    invalid = int(np.isinf(values).sum()) if values.dtype.kind == "f" else 0
+    if invalid:
+        values = np.where(np.isinf(values), np.nan, values)
+    return values, {"type": "numeric", "invalid": invalid}
 
-        # Concatenate encoded DataFrame with the original DataFrame
-        ohe_df = pd.concat([cleaned_df, encoded_df], axis=1)
 
-        tasks[task_id]["message"] += "One-Hot encoded. "
-        redis_client.hset(task_id,'message',tasks[task_id]["message"])
+def _clean_text(series, entry):
+    """
+    Types and coerces a text column on its distinct values, see clean_column
+    """
+    codes, uniques = pd.factorize(series)
+    text = pd.Series(uniques, dtype=object).astype(str).str.strip()
+    counts = np.bincount(codes[codes >= 0], minlength=len(text))
+    empty = (text == "").to_numpy()
+    counts[empty] = 0
+    inferred = entry is None
+    if inferred:
+        # Der Typ wird an den ersten INFER_VALUES verschiedenen Werten erkannt
+        entry = _infer_text(text[:INFER_VALUES], counts[:INFER_VALUES])
+    entry = dict(entry)
+
+    if entry["type"] != "categorical":
+        if entry["type"] == "numeric":
+            parsed = _parse_numbers(text, entry.get("locale", "point"))
+        else:
+            parsed = _parse_datetimes(text, entry.get("dayfirst", False))
+        invalid = int(counts[np.isnan(parsed)].sum())
+        if not inferred or invalid <= (1 - NUMERIC_MIN_SHARE) * counts.sum():
+            entry["invalid"] = invalid
+            return np.append(parsed, np.nan)[codes], entry
+        # Die übrigen Werte sind zu oft keine Zahlen
+        entry = {"type": "categorical"}
+
+    text_codes, categories = pd.factorize(text.where(~empty))
+    values = pd.Categorical.from_codes(np.append(text_codes, -1)[codes],
+                                       categories=pd.Index(categories, dtype=object).astype(str))
+    entry["invalid"] = 0
+    return values, entry
+
+
+def _drop_reason(values):
+    """
+    Returns why an inferred column is useless for clustering, None if it is not
+
+    Constant columns and ID-like columns are dropped: categorical columns with a
+    different value in every row and integer columns counting up by one
+    """
+    if isinstance(values, pd.Categorical):
+        present = np.count_nonzero(values.codes >= 0)
+        if len(values.categories) <= 1:
+            return "constant"
+        if len(values.categories) == present >= ID_MIN_ROWS:
+            return "ID-like"
+        return None
+    finite = values[~np.isnan(values)] if values.dtype.kind == "f" else values
+    if len(finite) == 0 or finite.min() == finite.max():
+        return "constant"
+    if values.dtype.kind in "iu" and len(values) >= ID_MIN_ROWS and np.all(np.diff(values) == 1):
+        return "ID-like"
+    return None
+
+
+# pylint: disable=too-many-instance-attributes
+class ColumnStatistics:
+    """
+    Statistics of one column over all chunks of a file, which decide the
+    drop rules of _drop_reason like on the whole column: the first two
+    categories and, while every value may still be distinct, the hashes of
+    the categories; the range of the numbers and whether the integers
+    count up by one across the chunk borders
+    """
+
+    def __init__(self, categorical):
+        self.categorical = categorical
+        self.rows = 0
+        self.categories = set()
+        self.hashes = []
+        self.id_like = True
+        self.minimum = np.inf
+        self.maximum = -np.inf
+        self.last = None
+
+    def observe(self, values):
+        """
+        Adds the cleaned values of a chunk, as returned by clean_column
+        """
+        if self.categorical:
+            present = np.count_nonzero(values.codes >= 0)
+            self.rows += present
+            if len(self.categories) < 2:
+                self.categories.update(values.categories[:2])
+            if self.id_like and len(values.categories) != present:
+                self.id_like, self.hashes = False, []
+            elif self.id_like:
+                self.hashes.append(pd.util.hash_array(np.asarray(values.categories, dtype=object)))
+            return
+        self.rows += len(values)
+        finite = values[~np.isnan(values)] if values.dtype.kind == "f" else values
+        if len(finite) > 0:
+            self.minimum = min(self.minimum, finite.min())
+            self.maximum = max(self.maximum, finite.max())
+        if self.id_like and len(values) > 0:
+            follows = self.last is None or values[0] == self.last + 1
+            self.id_like = values.dtype.kind in "iu" and follows and bool(np.all(np.diff(values) == 1))
+            self.last = values[-1]
+
+    def drop_reason(self):
+        """
+        Returns why the column is useless for clustering, None if it is not
+        """
+        if self.categorical:
+            if len(self.categories) <= 1:
+                return "constant"
+            if self.id_like and len(np.unique(np.concatenate(self.hashes))) == self.rows >= ID_MIN_ROWS:
+                return "ID-like"
+            return None
+        if self.minimum >= self.maximum:
+            return "constant"
+        if self.id_like and self.rows >= ID_MIN_ROWS:
+            return "ID-like"
+        return None
+
 
-        return ohe_df
+def clean_columns(dataframe, types=None, keep_index=False):
+    """
+    Types and coerces all columns of a dataframe (see clean_column), drops
+    useless columns and removes the rows with null or invalid values. Every
+    column is copied once, the categorical columns are stored with their codes.
+
+    Args:
+        dataframe (pd.DataFrame): The uploaded data
+        types (dict): Column -> entry of a report returned before, to clean further
+            chunks of a file like the first one; None to infer the types
+        keep_index (bool): Keeps the index of the remaining rows instead of numbering them from 0
+
+    Returns:
+        tuple: (cleaned dataframe, column report: column -> {"type": "numeric", "datetime",
+                "categorical" or "dropped", "invalid": number of values which could not be
+                coerced, "missing": number of null or invalid values, ...})
+    """
+    columns, report = {}, {}
+    for column in dataframe.columns:
+        entry = None if types is None else types.get(column)
+        if entry is not None and entry["type"] == "dropped":
+            report[column] = entry
+            continue
+        values, report[column] = clean_column(dataframe[column], entry)
+        reason = _drop_reason(values) if types is None else None
+        if reason is not None:
+            report[column] = {"type": "dropped", "reason": reason}
+        else:
+            columns[column] = values
+
+    keep = np.ones(len(dataframe), dtype=bool)
+    for column, values in columns.items():
+        missing = values.codes < 0 if isinstance(values, pd.Categorical) else np.isnan(values)
+        report[column]["missing"] = int(np.count_nonzero(missing))
+        keep &= ~missing
+    if not keep.all():
+        columns = {column: values[keep] for column, values in columns.items()}
+    index = dataframe.index[keep] if keep_index else pd.RangeIndex(np.count_nonzero(keep))
+    return pd.DataFrame(columns, index=index), report
+
+
+def column_report(report):
+    """
+    Returns the message describing the inferred columns
+
+    Args:
+        report (dict): The column report of clean_columns
+    """
+    parts = []
+    for column, entry in report.items():
+        if entry["type"] == "dropped":
+            parts.append(f"{column} dropped ({entry['reason']})")
+            continue
+        details = []
+        if entry.get("locale") == "comma":
+            details.append("comma decimals")
+        if entry["type"] == "datetime":
+            details.append("Unix seconds")
+        if entry.get("invalid"):
+            details.append(f"{entry['invalid']} invalid values")
+        parts.append(f"{column} {entry['type']}" + (f" ({', '.join(details)})" if details else ""))
+    return "Columns: " + ", ".join(parts) + ". "
+
+
+def category_counts(series):
+    """
+    Returns the number of rows of every value of a column
+
+    Returns:
+        dict: value (str) -> number of rows
+    """
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        series = series.astype(str)
+    counts = series.value_counts()
+    return {str(value): int(count) for value, count in counts[counts > 0].items()}
+
+
+def category_codes(series, categories):
+    """
+    Returns the codes of the values of a column in the given categories, -1 for other values.
+    Categorical columns are recoded without converting every value to a string.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.cat.set_categories(categories).cat.codes.to_numpy()
+    return pd.Index(categories).get_indexer(series.astype(str))
+
+
+class CategoricalEncoder:
+    """
+    Encodes the categorical columns into a sparse CSR matrix.
+
+    Columns with up to CATEGORY_LIMIT values are One-Hot encoded without
+    their first category; columns above it with HIGH_CARDINALITY_ENCODING:
+    "frequency" gives one numeric column with the share of rows having
+    the value, "hashing" HASH_FEATURES hashed indicator columns.
+    """
+
+    def __init__(self, counts, encoding=HIGH_CARDINALITY_ENCODING, limit=CATEGORY_LIMIT):
+        """
+        Args:
+            counts (dict): Column -> {value (str): number of rows}
+        """
+        if encoding not in ("frequency", "hashing", "one-hot"):
+            raise ValueError(f"Unknown encoding of high-cardinality columns: {encoding}")
+        self.columns = list(counts)
+        self.categories = {}
+        self.frequencies = {}
+        self.hashed = []
+        for column, values in counts.items():
+            if len(values) <= limit or encoding == "one-hot":
+                self.categories[column] = sorted(values)
+            elif encoding == "frequency":
+                total = sum(values.values())
+                self.frequencies[column] = {value: count / total for value, count in values.items()}
+            else:
+                self.hashed.append(column)
+        self.hasher = FeatureHasher(n_features=HASH_FEATURES, input_type="string", alternate_sign=False)
+
+    def frequency_columns(self, frame):
+        """
+        Returns the frequency encoded columns of a frame as numeric dataframe
+        """
+        # Werte, die nicht gezählt wurden, haben den Code -1 und die Häufigkeit 0
+        return pd.DataFrame({f"{column}_frequency": np.append(np.fromiter(frequencies.values(), dtype=float), 0.0)[
+            category_codes(frame[column], list(frequencies))] for column, frequencies in self.frequencies.items()},
+                            index=frame.index)
+
+    def transform(self, frame):
+        """
+        Encodes the One-Hot and the hashed columns of a frame
+
+        Returns:
+            tuple: (CSR matrix, names of its columns)
+        """
+        blocks, names = [], []
+        for column, categories in self.categories.items():
+            codes = category_codes(frame[column], categories)
+            # Die erste Kategorie entfällt wie bei drop='first'
+            rows = np.flatnonzero(codes > 0)
+            blocks.append(scipy.sparse.csr_matrix((np.ones(len(rows)), (rows, codes[rows] - 1)),
+                                                  shape=(len(frame), len(categories) - 1)))
+            names += [f"{column}_{value}" for value in categories[1:]]
+        for column in self.hashed:
+            blocks.append(self.hasher.transform([[value] for value in frame[column].astype(str)]))
+            names += [f"{column}_hash{index}" for index in range(HASH_FEATURES)]
+        if not blocks:
+            return scipy.sparse.csr_matrix((len(frame), 0)), names
+        return scipy.sparse.hstack(blocks, format="csr", dtype=float), names
+
+    def unknown(self, frame):
+        """
+        Returns a mask of the rows with a value which was not seen during the fit in a
+        One-Hot or frequency encoded column; One-Hot would encode it like the dropped first category
+        """
+        mask = np.zeros(len(frame), dtype=bool)
+        for column, categories in [*self.categories.items(), *self.frequencies.items()]:
+            mask |= category_codes(frame[column], list(categories)) < 0
+        return mask
+
+    def message(self):
+        """
+        Returns the message describing the encoding
+        """
+        message = "One-Hot encoded. "
+        for column in self.frequencies:
+            message += f"Column {column} has more than {CATEGORY_LIMIT} categories, frequency encoded. "
+        for column in self.hashed:
+            message += f"Column {column} has more than {CATEGORY_LIMIT} categories, hashed. "
+        return message
+
+
+def combine_features(numeric, encoded):
+    """
+    Joins the numeric and the encoded columns
+
+    Args:
+        numeric (np.ndarray): The numeric columns
+        encoded (scipy.sparse.csr_matrix): The encoded categorical columns
+
+    Returns:
+        CSR matrix if at most SPARSE_MAX_DENSITY of its values are non-zero, otherwise np.ndarray
+    """
+    rows, columns = len(numeric), numeric.shape[1] + encoded.shape[1]
+    nonzero = np.count_nonzero(numeric) + encoded.nnz
+    if encoded.shape[1] > 0 and nonzero <= SPARSE_MAX_DENSITY * rows * columns:
+        return scipy.sparse.hstack([scipy.sparse.csr_matrix(numeric), encoded], format="csr")
+    matrix = np.empty((rows, columns))
+    matrix[:, :numeric.shape[1]] = numeric
+    matrix[:, numeric.shape[1]:] = encoded.toarray()
+    return matrix
+
+
+def ohe(task_store, cleaned_df, task_id):
+    """
+    Filtern der kategorischen Spalten und Durchführung von OHE
+
+    Returns:
+        tuple: (numeric dataframe incl. frequency encoded columns, encoded CSR matrix,
+                names of the encoded columns, the CategoricalEncoder), None on errors
+    """
+    try:
+        categorical_columns = cleaned_df.select_dtypes(include=['category']).columns.tolist()
+        counts = {column: category_counts(cleaned_df[column]) for column in categorical_columns}
+        encoder = CategoricalEncoder(counts)
+        encoded, names = encoder.transform(cleaned_df)
+
+        # Drop original categorical columns
+        numeric_df = pd.concat([cleaned_df.drop(columns=categorical_columns),
+                                encoder.frequency_columns(cleaned_df)], axis=1)
+
+        task_store.append_message(task_id, encoder.message())
+        return numeric_df, encoded, names, encoder
     except Exception as exception:
-        # Wenn ein Fehler auftritt, wird die Nachricht an `tasks[task_id]` angehangen.
-        tasks[task_id]["status"] = "Bad Request"
-        tasks[task_id]["message"] += str("OHE: " + str(exception))
-        redis_client.hset(task_id,'status',"Bad Request")
-        redis_client.hset(task_id,'message',tasks[task_id]["message"])
+        # Wenn ein Fehler auftritt, wird die Nachricht an die Task angehangen.
+        task_store.fail(task_id, "OHE: " + str(exception))
         return None
 
-def run_normalization(redis_client, dataframe,tasks, task_id, normalization):
+def run_normalization(task_store, dataframe, task_id, normalization, scaler=None):
     """
     Normalisierung der Daten
+
+    Args:
+        scaler: The scaler which is fitted, a new one of the normalization if None
     """
     try:
+        # Alle Spalten sind numerisch, auch float32 und kleinere Ganzzahlen werden skaliert
+        numerical_columns = dataframe.select_dtypes(include=['number']).columns
+        if len(numerical_columns) == 0:
+            # Nur kategorische Spalten, sie werden mit encoded_scaler skaliert
+            normalization = None
         if normalization == 'z':
             # Skalierung der numerischen Spalten (Standardisierung - Z-Transformation)
-            numerical_columns = dataframe.select_dtypes(include=['int', 'float']).columns
-            scaler = StandardScaler()
-            dataframe[numerical_columns] = scaler.fit_transform(dataframe[numerical_columns])
+            scaler = scaler or StandardScaler()
+            dataframe[numerical_columns] = scaler.fit_transform(dataframe[numerical_columns].to_numpy(dtype=float))
 
         if normalization == 'min-max':
             # Skalierung der numerischen Spalten (Min-Max-Skalierung)
-            numerical_columns = dataframe.select_dtypes(include=['int', 'float']).columns
-            scaler = MinMaxScaler()  # Min-Max-Skalierung anstelle von Standardisierung
-            dataframe[numerical_columns] = scaler.fit_transform(dataframe[numerical_columns])
-            tasks[task_id]["message"] += "Min-Max scaled). "
-            tasks[task_id]["status"] = "Data prepared. Processing"
-            redis_client.hset(task_id,'status',"Data prepared. Processing")
-            redis_client.hset(task_id,'message',tasks[task_id]["message"])
+            scaler = scaler or MinMaxScaler()  # Min-Max-Skalierung anstelle von Standardisierung
+            dataframe[numerical_columns] = scaler.fit_transform(dataframe[numerical_columns].to_numpy(dtype=float))
+            task_store.append_message(task_id, "Min-Max scaled). ", status="Data prepared. Processing")
 
         return dataframe
     except Exception as exception:
-        # Wenn ein Fehler auftritt, wird die Nachricht an `tasks[task_id]` angehangen.
-        tasks[task_id]["status"] = "Bad Request"
-        tasks[task_id]["message"] += str("Normalization: " + str(exception))
-        redis_client.hset(task_id,'status',"Bad Request")
-        redis_client.hset(task_id,'message',tasks[task_id]["message"])
+        # Wenn ein Fehler auftritt, wird die Nachricht an die Task angehangen.
+        task_store.fail(task_id, "Normalization: " + str(exception))
         return None
 
 
-#def contains_numbers_and_letters(column):
-#    """
-#    Checks if a column contains numbers and letters
-#    """
-#    return any(str(c).isalpha() for c in column) and any(str(c).isdigit() for c in column)
+def encoded_scaler(normalization):
+    """
+    Returns the scaler of the encoded columns, which keeps them sparse: z divides
+    by the standard deviation without centring (the clusters do not change by a
+    shift), min-max divides by the maximum, as the minimum of the columns is 0
+
+    Returns:
+        StandardScaler, MaxAbsScaler or None without normalization
+    """
+    if normalization == 'z':
+        return StandardScaler(with_mean=False)
+    if normalization == 'min-max':
+        return MaxAbsScaler()
+    return None
+
+
+# pylint: disable=too-many-return-statements
+def prepare_data(task_store, dataframe, task_id, normalization, dataset_id=None, store=None):
+    """
+    Runs data_check, ohe and run_normalization, or loads their result
+    from the dataset store if the same dataset was prepared before.
+    With a dataset_id the fitted column types, encoder and scalers are
+    stored as well (see DatasetStore.load_preparation), so new rows can
+    be prepared like the dataset.
+
+    Args:
+        dataframe (pd.DataFrame): The uploaded data, None if only dataset_id is given
+        normalization (str): The normalization method
+        dataset_id (str): The ID under which the prepared data is stored
+        store (DatasetStore): The dataset store, the default directory if None
+
+    Returns:
+        tuple: (cleaned dataframe, prepared feature matrix), (None, None) on errors
+    """
+    store = store or DatasetStore()
+    if dataset_id is not None:
+        matrix, _ = store.load_prepared(dataset_id, normalization)
+        cleaned_df = store.load_cleaned(dataset_id)
+        if matrix is not None and cleaned_df is not None:
+            task_store.append_message(task_id, "Loaded prepared data of dataset " + dataset_id + ". ")
+            return cleaned_df, matrix
+        if dataframe is None:
+            dataframe = cleaned_df
+
+    if dataframe is None:
+        task_store.fail(task_id, "Dataset not found. ")
+        return None, None
+
+    cleaned_df = data_check(task_store, dataframe, task_id)
+    if cleaned_df is None:
+        return None, None
+    encoded = ohe(task_store, cleaned_df, task_id)
+    if encoded is None:
+        return None, None
+    prepared_df, encoded, encoded_names, encoder = encoded
+    preparation = StreamingPreparation(normalization)
+    if normalization is not None:
+        prepared_df = run_normalization(task_store, prepared_df, task_id, normalization, preparation.scaler)
+    if prepared_df is None:
+        return None, None
+
+    try:
+        scaler = preparation.encoded_scaler
+        if scaler is not None and encoded.shape[1] > 0:
+            encoded = scaler.fit_transform(encoded)
+        matrix = combine_features(prepared_df.to_numpy(dtype=float), encoded)
+    except (ValueError, TypeError) as exception:
+        task_store.fail(task_id, "Preparation: " + str(exception))
+        return None, None
+
+    if dataset_id is not None:
+        categorical_columns = cleaned_df.select_dtypes(include=['category']).columns.tolist()
+        metadata = {
+            "columns": [str(column) for column in prepared_df.columns] + encoded_names,
+            "categorical_columns": categorical_columns,
+            "categories": {column: sorted(category_counts(cleaned_df[column])) for column in categorical_columns},
+            "normalization": normalization,
+        }
+        if not store.exists(dataset_id):
+            store.save_cleaned(dataset_id, cleaned_df)
+        store.save_prepared(dataset_id, normalization, matrix, metadata)
+        store.save_preparation(dataset_id, normalization,
+                               preparation.fitted(cleaned_df.attrs["types"], encoder, cleaned_df.columns))
+    return cleaned_df, matrix
+
+
+# pylint: disable=too-many-instance-attributes
+class StreamingPreparation:
+    """
+    Incremental version of data_check, ohe and run_normalization
+    for data which is read in chunks.
+
+    The chunks have to be passed four times: observe() infers the column
+    types and collects the statistics of the drop rules, count() the
+    remaining rows and the categories, fit_scaler() the normalization
+    statistics and transform() returns the prepared matrix of a chunk,
+    sparse or dense like the matrix of prepare_data. Constant and ID-like
+    columns are dropped only once the whole file was observed, a column
+    constant within the first chunk is kept if other chunks differ.
+    prepare_data hands its fitted state to fitted(), so both preparations
+    can transform new rows.
+    """
+
+    def __init__(self, normalization=None):
+        self.normalization = normalization
+        self.numeric_columns = None
+        self.categorical_columns = None
+        self.types = None
+        self.column_statistics = None
+        self.invalid = {}
+        self.counts = {}
+        self.encoder = None
+        self.scaler = None
+        if normalization == 'z':
+            self.scaler = StandardScaler()
+        elif normalization == 'min-max':
+            self.scaler = MinMaxScaler()
+        self.encoded_scaler = encoded_scaler(normalization)
+        # Varianz der vorbereiteten Daten, für die Toleranz des k-means
+        self.statistics = StandardScaler()
+        self.encoded_statistics = StandardScaler(with_mean=False)
+        self.rows = 0
+        self.dropped_rows = 0
+
+    def observe(self, chunk):
+        """
+        First pass: infers the column types from the first chunk and collects
+        the statistics of the drop rules over all chunks
+        """
+        if self.types is None:
+            self.types, self.column_statistics = {}, {}
+            for column in chunk.columns:
+                values, self.types[column] = clean_column(chunk[column])
+                self.column_statistics[column] = ColumnStatistics(self.types[column]["type"] == "categorical")
+                self.column_statistics[column].observe(values)
+            return
+        for column, statistics in self.column_statistics.items():
+            statistics.observe(clean_column(chunk[column], self.types[column])[0])
+
+    def count(self, chunk):
+        """
+        Second pass: drops the constant and ID-like columns of the whole file
+        before the first chunk, counts the remaining rows and the frequencies of the categories
+        """
+        if self.column_statistics is not None:
+            for column, statistics in self.column_statistics.items():
+                reason = statistics.drop_reason()
+                if reason is not None:
+                    self.types[column] = {"type": "dropped", "reason": reason}
+            self.column_statistics = None
+        cleaned, report = clean_columns(chunk, self.types)
+        self.rows += len(cleaned)
+        self.dropped_rows += len(chunk) - len(cleaned)
+        for column, entry in report.items():
+            self.invalid[column] = self.invalid.get(column, 0) + entry.get("invalid", 0)
+
+        self.categorical_columns = [column for column, entry in self.types.items() if entry["type"] == "categorical"]
+        for column in self.categorical_columns:
+            counts = self.counts.setdefault(column, {})
+            for value, count in category_counts(cleaned[column]).items():
+                counts[value] = counts.get(value, 0) + count
+
+    def build_encoder(self):
+        """
+        Creates the encoder from the collected categories
+
+        Raises:
+            ValueError: If all columns were dropped
+        """
+        if all(entry["type"] == "dropped" for entry in self.types.values()):
+            raise ValueError("No columns left for clustering. " + column_report(self.types))
+        self.numeric_columns = None
+        self.encoder = CategoricalEncoder({column: self.counts[column] for column in self.categorical_columns or []})
+
+    def fitted(self, types, encoder, columns):
+        """
+        Takes over the state fitted by prepare_data; the scalers are the ones
+        passed to run_normalization
+
+        Args:
+            types (dict): The column report of data_check
+            encoder (CategoricalEncoder): The encoder of ohe
+            columns (list): The columns of the cleaned dataframe
+
+        Returns:
+            StreamingPreparation: self
+        """
+        self.types = types
+        self.encoder = encoder
+        self.categorical_columns = list(encoder.columns)
+        self.numeric_columns = [column for column in columns if column not in self.categorical_columns]
+        # Die Statistiken für die Toleranz werden nur beim Einlesen in Teilen gebraucht
+        self.statistics = self.encoded_statistics = None
+        return self
+
+    def encode(self, chunk):
+        """
+        Cleans and encodes a chunk; the cleaned chunk keeps the index of its remaining rows
+
+        Returns:
+            tuple: (cleaned chunk, numeric matrix incl. frequency encoded columns, encoded CSR matrix)
+        """
+        cleaned, _ = clean_columns(chunk, self.types, keep_index=True)
+        if self.numeric_columns is None:
+            self.numeric_columns = [column for column in cleaned.columns
+                                    if column not in self.categorical_columns]
+        numeric = pd.concat([cleaned[self.numeric_columns], self.encoder.frequency_columns(cleaned)], axis=1)
+        encoded, _ = self.encoder.transform(cleaned)
+        return cleaned, numeric.to_numpy(dtype=float), encoded
+
+    def fit_scaler(self, chunk):
+        """
+        Second pass: collects the statistics for the normalization
+        """
+        _, numeric, encoded = self.encode(chunk)
+        if len(numeric) == 0:
+            return
+        # Die Scaler brauchen mindestens eine Spalte
+        for matrix, statistics, scaler in ((numeric, self.statistics, self.scaler),
+                                           (encoded, self.encoded_statistics, self.encoded_scaler)):
+            if matrix.shape[1] > 0:
+                statistics.partial_fit(matrix)
+                if scaler is not None:
+                    scaler.partial_fit(matrix)
+
+    def transform(self, chunk):
+        """
+        Third pass: cleans, encodes and normalizes a chunk
+
+        Returns:
+            tuple: (cleaned chunk, prepared matrix)
+        """
+        cleaned, numeric, encoded = self.encode(chunk)
+        if len(numeric) > 0:
+            if self.scaler is not None and numeric.shape[1] > 0:
+                numeric = self.scaler.transform(numeric)
+            if self.encoded_scaler is not None and encoded.shape[1] > 0:
+                encoded = self.encoded_scaler.transform(encoded)
+        return cleaned, combine_features(numeric, encoded)
+
+    def mean_variance(self):
+        """
+        Returns the mean variance of the prepared features
+        """
+        variances = []
+        for statistics, scaler in ((self.statistics, self.scaler), (self.encoded_statistics, self.encoded_scaler)):
+            if not hasattr(statistics, "var_"):
+                continue
+            variance = statistics.var_
+            if self.normalization == 'z':
+                variance = (variance > 0).astype(float)
+            elif self.normalization == 'min-max':
+                # Min-Max teilt durch die Spannweite, MaxAbs durch das Maximum
+                scale = getattr(scaler, "data_range_", None)
+                scale = scaler.max_abs_ if scale is None else scale
+                variance = np.divide(variance, scale ** 2, out=np.zeros_like(variance), where=scale > 0)
+            variances.append(variance)
+        return float(np.mean(np.concatenate(variances)))
+
+    def message(self):
+        """
+        Returns the message describing the preparation steps
+        """
+        report = {column: dict(entry, invalid=self.invalid.get(column, 0)) for column, entry in self.types.items()}
+        message = column_report(report) + f"Removed {self.dropped_rows} rows with null values. "
+        message += self.encoder.message()
+        if self.normalization == 'z':
+            message += "Z-transformed. "
+        elif self.normalization == 'min-max':
+            message += "Min-Max scaled. "
+        return message
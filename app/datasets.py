@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+"""
+Module storing cleaned and prepared datasets on local disk
+"""
+import os
+import json
+import time
+import pickle
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+import pyarrow
+import pyarrow.parquet
+import scipy.sparse
+
+DATASET_DIR = os.environ.get('DATASET_DIR', os.path.join(tempfile.gettempdir(), 'kmeans-datasets'))
+# Upper bound of the disk space of all datasets, the least recently used ones are removed first
+DATASET_MAX_BYTES = int(os.environ.get('DATASET_MAX_BYTES', str(4 * 1024 * 1024 * 1024)))
+# Seconds after which an unused dataset is removed
+DATASET_TTL = int(os.environ.get('DATASET_TTL', '86400'))
+
+
+class DatasetStore:
+    """
+    Datasets stored under their ID (the sha256 of the uploaded file).
+
+    Every dataset directory contains the cleaned dataframe (cleaned.pkl,
+    used for the results), its description (dataset.json) and per
+    normalization the prepared feature matrix as .npy file, which is
+    memory-mapped when it is loaded, or as sparse .npz file, plus its column
+    names and encoder metadata and the fitted preparation (.pkl) which
+    prepares new rows the same way. For workbooks it also keeps the parsed,
+    not yet cleaned upload as Parquet (upload.parquet), so the same file is
+    converted once; unlike a pickle, reading it never executes code.
+    A mini-batch job moves its spooled upload there (spooled.<suffix>) with
+    the column types of its preparation (spooled.pkl), its data points are
+    read from that file again instead of being stored in redis.
+
+    The modification time of the dataset directory is its last use;
+    datasets unused for ttl seconds are removed, and when all datasets
+    together grow beyond max_bytes, the least recently used ones.
+    """
+
+    def __init__(self, directory=DATASET_DIR, max_bytes=DATASET_MAX_BYTES, ttl=DATASET_TTL):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+    def path(self, dataset_id, name=""):
+        """
+        Returns the path of the dataset directory or of a file in it
+        """
+        if not dataset_id.isalnum():
+            raise ValueError("Invalid dataset ID")
+        return os.path.join(self.directory, dataset_id, name)
+
+    def exists(self, dataset_id, spooled=False):
+        """
+        Returns whether the cleaned data of a dataset is stored, with spooled its spooled upload
+        """
+        return os.path.exists(self.path(dataset_id, "spooled.pkl" if spooled else "cleaned.pkl"))
+
+    def _write(self, dataset_id, name, write):
+        """
+        Writes a file atomically, so concurrent jobs never read half-written files
+        """
+        os.makedirs(self.path(dataset_id), exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=self.path(dataset_id), delete=False) as tmp:
+            write(tmp)
+        os.replace(tmp.name, self.path(dataset_id, name))
+
+    def save_cleaned(self, dataset_id, cleaned_df):
+        """
+        Stores the cleaned dataframe and its description
+        """
+        info = {
+            "dataset_id": dataset_id,
+            "rows": len(cleaned_df),
+            "columns": [str(column) for column in cleaned_df.columns],
+            "dtypes": {str(column): str(dtype) for column, dtype in cleaned_df.dtypes.items()},
+        }
+        # cleaned.pkl zuletzt schreiben, exists() prüft auf diese Datei
+        self._write(dataset_id, "dataset.json", lambda file: file.write(json.dumps(info).encode("utf-8")))
+        self._write(dataset_id, "cleaned.pkl", cleaned_df.to_pickle)
+        self.evict(keep=dataset_id)
+
+    def load_cleaned(self, dataset_id):
+        """
+        Returns the cleaned dataframe, or None if the dataset is not stored
+        """
+        if not self.exists(dataset_id):
+            return None
+        self.touch(dataset_id)
+        return pd.read_pickle(self.path(dataset_id, "cleaned.pkl"))
+
+    def save_upload(self, dataset_id, dataframe):
+        """
+        Stores the parsed upload of a dataset, before it is cleaned.
+        Parquet only allows text as column names, so the columns are stored
+        under their position and the names of the workbook, which may be
+        numbers, as JSON in the metadata of the file. An upload Parquet cannot
+        represent, like a column of numbers and text, is not stored and
+        converted again by the next job
+        """
+        try:
+            names = json.dumps(dataframe.columns.tolist())
+            table = pyarrow.Table.from_pandas(dataframe.set_axis(
+                [str(position) for position in range(dataframe.shape[1])], axis=1))
+        except (pyarrow.ArrowException, TypeError, ValueError):
+            return
+        table = table.replace_schema_metadata({**table.schema.metadata, b"columns": names.encode("utf-8")})
+        self._write(dataset_id, "upload.parquet", lambda file: pyarrow.parquet.write_table(table, file))
+        self.evict(keep=dataset_id)
+
+    def load_upload(self, dataset_id):
+        """
+        Returns the parsed upload, or None if it is not stored
+        """
+        try:
+            table = pyarrow.parquet.read_table(self.path(dataset_id, "upload.parquet"))
+        except FileNotFoundError:
+            return None
+        dataframe = table.to_pandas()
+        dataframe.columns = pd.Index(json.loads(table.schema.metadata[b"columns"]))
+        self.touch(dataset_id)
+        return dataframe
+
+    def save_spooled(self, dataset_id, source, types):
+        """
+        Moves a spooled upload into a dataset together with the column types
+        its rows were cleaned with
+
+        Args:
+            source (dict): The spooled upload returned by utils.spool_upload
+            types (dict): The column report of the streamed preparation
+        """
+        name = "spooled" + os.path.splitext(source["filename"])[1]
+        os.makedirs(self.path(dataset_id), exist_ok=True)
+        # Erst unter temporärem Namen ablegen, andere Prozesse lesen nie halb verschobene Dateien
+        with tempfile.NamedTemporaryFile(dir=self.path(dataset_id), delete=False) as tmp:
+            pass
+        shutil.move(source["path"], tmp.name)
+        os.replace(tmp.name, self.path(dataset_id, name))
+        # spooled.pkl zuletzt schreiben, exists(spooled=True) prüft auf diese Datei
+        spooled = {"filename": source["filename"], "columns": source.get("columns"), "types": types}
+        self._write(dataset_id, "spooled.pkl",
+                    lambda file: pickle.dump(spooled, file, protocol=pickle.HIGHEST_PROTOCOL))
+        self.evict(keep=dataset_id)
+
+    def load_spooled(self, dataset_id):
+        """
+        Returns the spooled upload of a dataset, in the shape of utils.spool_upload,
+        and its column types, or (None, None) if it is not stored
+        """
+        try:
+            with open(self.path(dataset_id, "spooled.pkl"), "rb") as file:
+                spooled = pickle.load(file)
+        except FileNotFoundError:
+            return None, None
+        self.touch(dataset_id)
+        name = "spooled" + os.path.splitext(spooled["filename"])[1]
+        source = {"path": self.path(dataset_id, name), "filename": spooled["filename"],
+                  "columns": spooled["columns"], "dataset_id": dataset_id}
+        return source, spooled["types"]
+
+    def info(self, dataset_id):
+        """
+        Returns the description of a dataset, or None if it is not stored
+        """
+        if not self.exists(dataset_id):
+            return None
+        self.touch(dataset_id)
+        with open(self.path(dataset_id, "dataset.json"), encoding="utf-8") as file:
+            info = json.load(file)
+        info["bytes"] = self.size(dataset_id)
+        return info
+
+    def save_prepared(self, dataset_id, normalization, matrix, metadata):
+        """
+        Stores the encoded and normalized feature matrix of a dataset
+        """
+        name = f"prepared-{normalization or 'none'}"
+        metadata = {**metadata, "sparse": scipy.sparse.issparse(matrix)}
+        if metadata["sparse"]:
+            self._write(dataset_id, name + ".npz",
+                        lambda file: scipy.sparse.save_npz(file, matrix.tocsr(), compressed=False))
+        else:
+            self._write(dataset_id, name + ".npy", lambda file: np.save(file, np.ascontiguousarray(matrix)))
+        self._write(dataset_id, name + ".json", lambda file: file.write(json.dumps(metadata).encode("utf-8")))
+        self.evict(keep=dataset_id)
+
+    def load_prepared(self, dataset_id, normalization):
+        """
+        Returns the memory-mapped (or sparse) feature matrix and its metadata,
+        or (None, None) if it is not stored for this normalization
+        """
+        name = f"prepared-{normalization or 'none'}"
+        if not os.path.exists(self.path(dataset_id, name + ".json")):
+            return None, None
+        self.touch(dataset_id)
+        with open(self.path(dataset_id, name + ".json"), encoding="utf-8") as file:
+            metadata = json.load(file)
+        if metadata.get("sparse"):
+            return scipy.sparse.load_npz(self.path(dataset_id, name + ".npz")).tocsr(), metadata
+        return np.load(self.path(dataset_id, name + ".npy"), mmap_mode="r"), metadata
+
+    def save_preparation(self, dataset_id, normalization, preparation):
+        """
+        Stores the fitted column types, encoder and scalers of a prepared dataset
+        """
+        self._write(dataset_id, f"prepared-{normalization or 'none'}.pkl",
+                    lambda file: pickle.dump(preparation, file, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def load_preparation(self, dataset_id, normalization):
+        """
+        Returns the fitted StreamingPreparation of a dataset, or None if it is not stored for this normalization
+        """
+        try:
+            with open(self.path(dataset_id, f"prepared-{normalization or 'none'}.pkl"), "rb") as file:
+                return pickle.load(file)
+        except FileNotFoundError:
+            return None
+
+    def touch(self, dataset_id):
+        """
+        Marks a dataset as used now
+        """
+        try:
+            os.utime(self.path(dataset_id))
+        except FileNotFoundError:
+            pass
+
+    def size(self, dataset_id):
+        """
+        Returns the disk space of a dataset in bytes
+        """
+        with os.scandir(self.path(dataset_id)) as entries:
+            return sum(entry.stat().st_size for entry in entries if entry.is_file())
+
+    def delete(self, dataset_id):
+        """
+        Removes a dataset, returns whether it existed
+        """
+        if not os.path.isdir(self.path(dataset_id)):
+            return False
+        shutil.rmtree(self.path(dataset_id), ignore_errors=True)
+        return True
+
+    def evict(self, keep=None):
+        """
+        Removes expired datasets and the least recently used ones until
+        all datasets fit into max_bytes. The dataset keep is never removed.
+        """
+        if not os.path.isdir(self.directory):
+            return
+        datasets = []
+        for entry in os.scandir(self.directory):
+            if entry.is_dir() and entry.name.isalnum():
+                try:
+                    datasets.append((entry.stat().st_mtime, entry.name, self.size(entry.name)))
+                except FileNotFoundError:
+                    continue
+
+        # Älteste Datensätze zuerst
+        datasets.sort()
+        total = sum(size for _, _, size in datasets)
+        expired = time.time() - self.ttl
+        for last_used, dataset_id, size in datasets:
+            if dataset_id == keep:
+                continue
+            if last_used < expired or total > self.max_bytes:
+                self.delete(dataset_id)
+                total -= size
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Module admitting the clustering jobs to the bounded worker queue
+"""
+import os
+import time
+import pandas as pd
+from app.job_queue import JobQueue, QUEUE_PREFIX
+from app.utils import spool_dataframe
+from app.worker import WorkerPool, KMEANS_WORKERS, KMEANS_WORKER_THREADS, remove_job_data
+
+KMEANS_QUEUE_SIZE = int(os.environ.get('KMEANS_QUEUE_SIZE', '32'))
+KMEANS_RETRY_AFTER = int(os.environ.get('KMEANS_RETRY_AFTER', '5'))
+KMEANS_DRAIN_TIMEOUT = float(os.environ.get('KMEANS_DRAIN_TIMEOUT', '60'))
+
+
+class QueueFullError(Exception):
+    """
+    Raised when a job can not be admitted because the queue is full
+    or the executor is shutting down
+    """
+    def __init__(self, message, retry_after=KMEANS_RETRY_AFTER):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class JobExecutor:
+    """
+    Hands clustering jobs to the worker processes through the redis queue.
+
+    The queue is bounded, so a burst of uploads is turned into backpressure
+    instead of an unbounded backlog. The jobs are run by the embedded pool
+    of KMEANS_WORKERS processes and by any number of standalone workers
+    (python -m app.worker) on the same redis.
+    """
+
+    def __init__(self, redis_client, redis_host, redis_port,
+                 workers=KMEANS_WORKERS,
+                 queue_size=KMEANS_QUEUE_SIZE,
+                 threads=KMEANS_WORKER_THREADS,
+                 prefix=QUEUE_PREFIX):
+        self.job_queue = JobQueue(redis_client, prefix)
+        self.queue_size = max(queue_size, 0)
+        # Mit workers=0 laufen die Jobs nur in eigenständigen Worker-Prozessen
+        self.pool = WorkerPool(redis_host, redis_port, workers, threads, prefix)
+        self._closing = False
+
+    def submit(self, task_id, target, dataframe, *args):
+        """
+        Admits a job to the queue
+
+        Args:
+            task_id (str): The ID of the task
+            target (callable): run_kmeans_one_k, run_kmeans_elbow or run_kmeans_minibatch
+            dataframe (pd.DataFrame): The uploaded data, the path of the pickled upload,
+                                      the spooled upload of a streaming job or None for a stored dataset
+            args: The remaining positional arguments of target, JSON-serialisable
+
+        Raises:
+            QueueFullError: If the queue is full or the executor is shutting down
+        """
+        if self._closing:
+            raise QueueFullError("The server is shutting down, please retry later.")
+        if self.job_queue.length() >= self.queue_size:
+            raise QueueFullError("Too many clustering jobs are queued, please retry later.")
+
+        job = {"target": target.__name__, "args": list(args)}
+        if isinstance(dataframe, pd.DataFrame):
+            # Die Worker lesen die Daten vom gemeinsamen Upload-Verzeichnis
+            job["frame"] = spool_dataframe(dataframe)
+        elif isinstance(dataframe, str):
+            # Schon vom Ingestion-Prozess gepickelt
+            job["frame"] = dataframe
+        elif dataframe is not None:
+            job["source"] = dataframe
+        self.job_queue.push(task_id, job)
+        self.pool.start()
+
+    def cancel(self, task_id):
+        """
+        Removes a waiting job from the queue together with its data
+
+        Returns:
+            bool: Whether the job was waiting, False if it is already running or finished
+        """
+        job, _ = self.job_queue.job(task_id)
+        if not self.job_queue.remove(task_id):
+            return False
+        remove_job_data(job)
+        return True
+
+    def queue_position(self, task_id):
+        """
+        Returns the 1-based position of a task in the queue,
+        or None if the task is not waiting
+        """
+        return self.job_queue.position(task_id)
+
+    def stats(self):
+        """
+        Returns the number of running and queued jobs
+        """
+        return {"running": self.job_queue.running(), "queued": self.job_queue.length()}
+
+    def shutdown(self, timeout=KMEANS_DRAIN_TIMEOUT):
+        """
+        Stops admitting jobs and lets the embedded workers finish the queue.
+        Jobs which are still queued after the timeout stay in redis
+        for the next worker.
+        """
+        self._closing = True
+        deadline = time.monotonic() + timeout
+        if self.pool.processes > 0:
+            while time.monotonic() < deadline and (self.job_queue.length() or self.job_queue.running()):
+                time.sleep(0.1)
+        self.pool.stop(max(deadline - time.monotonic(), 0))
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+Module parsing uploads in a bounded pool of processes, off the event loop of the API
+
+Parsing a large csv or xlsx file (openpyxl is pure Python) would block the
+event loop, or hold the GIL of the API process if it ran in a thread, and
+stall every other request, e.g. the status polls. The uploads are therefore
+spooled to disk and parsed by INGEST_WORKERS processes; the parsed frame is
+pickled to UPLOAD_DIR by the parsing process and handed to the job queue by
+its path, so it never passes through the API process.
+"""
+import os
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import pandas as pd
+import redis
+from starlette.concurrency import run_in_threadpool
+from app.utils import read_spooled, read_first_chunk, spool_dataframe
+from app.executor import QueueFullError
+from app.task_store import TaskStore
+from app.datasets import DatasetStore
+from app.datacheck import prepare_data
+
+# Processes parsing uploads, 0 parses in the thread pool of the API
+INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS', '2'))
+# Uploads parsed or waiting at the same time, further uploads are answered with 503
+INGEST_QUEUE_SIZE = int(os.environ.get('INGEST_QUEUE_SIZE', '16'))
+INGEST_RETRY_AFTER = int(os.environ.get('INGEST_RETRY_AFTER', '2'))
+
+REDIS_HOST = os.environ.get('REDIS_HOST', 'localhost')
+REDIS_PORT = os.environ.get('REDIS_PORT', '6379')
+
+
+class IngestionPool:
+    """
+    Runs the parsing functions of this module in a pool of processes,
+    started on first use. At most queue_size uploads are admitted at once.
+    """
+
+    def __init__(self, workers=INGEST_WORKERS, queue_size=INGEST_QUEUE_SIZE):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._pool = None
+        # Nur vom Event-Loop verändert, daher ohne Lock
+        self._admitted = 0
+
+    def start(self):
+        """
+        Starts the processes, each imports this module and with it pandas once
+
+        Returns:
+            list: The futures of the warm-up calls
+        """
+        if self.workers <= 0:
+            return []
+        if self._pool is None:
+            # spawn: keine geerbten Threads und redis-Verbindungen des API-Prozesses
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return [self._pool.submit(warm_up) for _ in range(self.workers)]
+
+    async def run(self, function, *args):
+        """
+        Runs function(*args) in a parsing process and waits for it without blocking the event loop
+
+        Raises:
+            QueueFullError: If queue_size uploads are already being parsed or waiting,
+                            or a parsing process died; the next call starts a new pool
+        """
+        if self._admitted >= self.queue_size:
+            raise QueueFullError("Too many uploads are being read, please retry later.", INGEST_RETRY_AFTER)
+        self._admitted += 1
+        try:
+            if self.workers <= 0:
+                return await run_in_threadpool(function, *args)
+            if self._pool is None:
+                self.start()
+            pool = self._pool
+            try:
+                return await asyncio.wrap_future(pool.submit(function, *args))
+            except BrokenProcessPool as exception:
+                # Ein Prozess wurde beendet, z.B. vom OOM-Killer; ein defekter Pool nimmt nichts mehr an
+                if self._pool is pool:
+                    self._pool = None
+                    pool.shutdown(wait=False, cancel_futures=True)
+                raise QueueFullError("The process reading the upload died, please retry later.",
+                                     INGEST_RETRY_AFTER) from exception
+        finally:
+            self._admitted -= 1
+
+    def stats(self):
+        """
+        Returns the number of uploads being parsed or waiting
+        """
+        return {"admitted": self._admitted}
+
+    def shutdown(self):
+        """
+        Stops the parsing processes after the running uploads
+        """
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+
+def warm_up():
+    """
+    Does nothing, run once per process so the imports are done before the first upload
+    """
+    return os.getpid()
+
+
+def read_upload(source):
+    """
+    Parses a spooled upload
+
+    Args:
+        source (dict): The spooled upload returned by spool_upload
+
+    Returns:
+        pd.DataFrame or dict: The data, or an error message like read_file
+    """
+    try:
+        return read_spooled(source)
+    except ValueError as exception:
+        return {"error": str(exception)}
+
+
+def parse_upload(source):
+    """
+    Parses a spooled upload and pickles the frame for the worker processes
+
+    Returns:
+        dict: "frame" (path of the pickled frame) and "rows", or "error"
+    """
+    result = read_upload(source)
+    if not isinstance(result, pd.DataFrame):
+        return result
+    return {"frame": spool_dataframe(result), "rows": len(result)}
+
+
+def check_first_chunk(source):
+    """
+    Reads the first chunk of a spooled upload of a streaming job
+
+    Returns:
+        dict: "rows" of the first chunk, or "error"
+    """
+    result = read_first_chunk(source)
+    if not isinstance(result, pd.DataFrame):
+        return result
+    return {"rows": len(result)}
+
+
+def ingest_dataset(source, dataset_id):
+    """
+    Parses, cleans and encodes a spooled upload and stores it in the dataset store
+
+    Returns:
+        dict: Empty, or "error" with the messages of the data check
+    """
+    dataframe = read_upload(source)
+    if not isinstance(dataframe, pd.DataFrame):
+        return dataframe
+
+    # Meldungen der Datenprüfung unter einem eigenen Schlüssel sammeln
+    task_store = TaskStore(redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True))
+    ingest_id = "dataset-" + dataset_id
+    task_store.create(ingest_id, "dataset", status="processing")
+    _, matrix = prepare_data(task_store, dataframe, ingest_id, None, dataset_id, DatasetStore())
+    message = task_store.field(ingest_id, "message")
+    task_store.delete(ingest_id)
+    return {} if matrix is not None else {"error": message}
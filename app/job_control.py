@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Module deciding when a running job has to stop
+"""
+import os
+import time
+import threading
+
+# Wall-clock budget of a job in seconds, 0 disables the limit
+KMEANS_JOB_TIMEOUT = float(os.environ.get('KMEANS_JOB_TIMEOUT', '3600'))
+# Memory budget of a worker process in bytes, 0 disables the limit
+KMEANS_JOB_MAX_MEMORY = int(os.environ.get('KMEANS_JOB_MAX_MEMORY', '0'))
+# Seconds a job may overrun its budget or a cancel request before its worker process is replaced
+KMEANS_JOB_GRACE = float(os.environ.get('KMEANS_JOB_GRACE', '30'))
+
+# Statuses of tasks which were stopped before they completed
+STOPPED_STATUSES = ("cancelled", "timeout", "out of memory")
+# Statuses after which a task does not change anymore
+FINAL_STATUSES = ("completed", "Bad Request") + STOPPED_STATUSES
+
+
+class JobStopped(Exception):
+    """
+    Raised at a checkpoint of a job which has to stop
+    """
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class JobControl:
+    """
+    The stop conditions of one running job: a cancel request of the user
+    and the wall-clock budget.
+
+    The fits call check() at their checkpoints (between runs of n_init,
+    between the segments of a run, between the k values of an elbow sweep
+    and between the chunks of a streamed file). A check costs no redis
+    round trip, the cancel request is picked up by the heartbeat thread
+    of the worker, which calls cancel().
+    """
+
+    def __init__(self, timeout=KMEANS_JOB_TIMEOUT):
+        self.timeout = timeout
+        self.started = time.monotonic()
+        self._cancelled = threading.Event()
+        self._cancel_time = None
+
+    def cancel(self):
+        """
+        Lets the next checkpoint stop the job
+        """
+        if self._cancel_time is None:
+            self._cancel_time = time.monotonic()
+        self._cancelled.set()
+
+    def overrun(self):
+        """
+        Returns the seconds the job is running past its budget or its cancel request, or 0
+        """
+        if self._cancelled.is_set():
+            return time.monotonic() - self._cancel_time
+        if self.timeout > 0:
+            return max(time.monotonic() - self.started - self.timeout, 0)
+        return 0
+
+    def check(self):
+        """
+        Raises:
+            JobStopped: If the job was cancelled or exceeded its wall-clock budget
+        """
+        if self._cancelled.is_set():
+            raise JobStopped("cancelled", "The task was cancelled.")
+        if 0 < self.timeout < time.monotonic() - self.started:
+            raise JobStopped("timeout", f"The task exceeded its time limit of {self.timeout:g} s.")
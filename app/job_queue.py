@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Module providing the redis queue between the API and the clustering workers
+"""
+import os
+import json
+from app.task_store import TaskStore
+
+# Seconds between two heartbeats of a worker
+KMEANS_HEARTBEAT_INTERVAL = float(os.environ.get('KMEANS_HEARTBEAT_INTERVAL', '2'))
+# Seconds without heartbeat after which a worker is considered dead
+KMEANS_HEARTBEAT_TIMEOUT = float(os.environ.get('KMEANS_HEARTBEAT_TIMEOUT', '10'))
+# How often a job of a dead worker is started again
+KMEANS_JOB_RETRIES = int(os.environ.get('KMEANS_JOB_RETRIES', '2'))
+
+QUEUE_PREFIX = "kmeans:"
+
+
+# pylint: disable=too-many-instance-attributes
+class JobQueue:
+    """
+    Reliable job queue in redis.
+
+    The queue list holds the IDs of the waiting tasks, the job descriptions
+    (target, arguments, location of the data) are stored in the jobs hash
+    until the job is finished, so the data of an expired task is still removed.
+    A worker moves a task atomically from the queue to its own processing
+    list and removes it there when the job is finished. Workers renew a
+    heartbeat key while they are alive; the processing lists of workers
+    whose heartbeat expired are moved back to the queue. Nothing writes a
+    task while it waits or a k of an elbow sweep is fitted, so the pushes,
+    requeue_orphans and the heartbeats renew the TTL of the waiting tasks and
+    the heartbeat of a worker also that of its running task.
+    """
+
+    def __init__(self, redis_client, prefix=QUEUE_PREFIX,
+                 heartbeat_timeout=KMEANS_HEARTBEAT_TIMEOUT, retries=KMEANS_JOB_RETRIES):
+        self.redis_client = redis_client
+        self.task_store = TaskStore(redis_client)
+        self.prefix = prefix
+        self.heartbeat_timeout = heartbeat_timeout
+        self.retries = retries
+        self.queue_key = prefix + "queue"
+        self.workers_key = prefix + "workers"
+        self.jobs_key = prefix + "jobs"
+
+    def processing_key(self, worker_id):
+        """
+        Returns the key of the list of jobs a worker is running
+        """
+        return self.prefix + "processing:" + worker_id
+
+    def heartbeat_key(self, worker_id):
+        """
+        Returns the key which exists while a worker is alive
+        """
+        return self.prefix + "heartbeat:" + worker_id
+
+    def push(self, task_id, job):
+        """
+        Appends a job to the queue
+
+        Args:
+            task_id (str): The ID of the task, which has to exist in the task store
+            job (dict): The JSON-serialisable job description
+        """
+        self.task_store.update(task_id, attempts=0)
+        self.redis_client.hset(self.jobs_key, task_id, json.dumps(job))
+        self.redis_client.rpush(self.queue_key, task_id)
+        self.renew_waiting()
+
+    def renew_waiting(self):
+        """
+        Renews the TTL of the tasks waiting in the queue
+        """
+        self.task_store.renew(*self.redis_client.lrange(self.queue_key, 0, -1))
+
+    def length(self):
+        """
+        Returns the number of waiting jobs
+        """
+        return self.redis_client.llen(self.queue_key)
+
+    def position(self, task_id):
+        """
+        Returns the 1-based position of a task in the queue, or None if it is not waiting
+        """
+        position = self.redis_client.lpos(self.queue_key, task_id)
+        return None if position is None else position + 1
+
+    def remove(self, task_id):
+        """
+        Removes a waiting task from the queue
+
+        Returns:
+            bool: Whether the task was waiting
+        """
+        if self.redis_client.lrem(self.queue_key, 0, task_id) == 0:
+            return False
+        self.redis_client.hdel(self.jobs_key, task_id)
+        return True
+
+    def claim(self, worker_id, timeout):
+        """
+        Moves the next waiting task to the processing list of a worker
+
+        Returns:
+            str: The ID of the task, or None if no job arrived within timeout seconds
+        """
+        return self.redis_client.blmove(self.queue_key, self.processing_key(worker_id), timeout, "LEFT", "RIGHT")
+
+    def job(self, task_id):
+        """
+        Returns the job description and the number of restarts of a task, or (None, 0)
+        """
+        job = self.redis_client.hget(self.jobs_key, task_id)
+        attempts = self.redis_client.hget(task_id, "attempts")
+        return (None if job is None else json.loads(job)), int(attempts or 0)
+
+    def ack(self, worker_id, task_id):
+        """
+        Removes a finished job from the processing list of a worker
+        """
+        pipeline = self.redis_client.pipeline()
+        pipeline.lrem(self.processing_key(worker_id), 0, task_id)
+        pipeline.hdel(self.jobs_key, task_id)
+        pipeline.execute()
+
+    def heartbeat(self, worker_id, task_id=None):
+        """
+        Registers a worker and marks it alive for heartbeat_timeout seconds,
+        renews the TTL of its running task and of the waiting tasks
+
+        Args:
+            task_id (str): The task the worker is running, None if it is idle
+        """
+        pipeline = self.redis_client.pipeline()
+        pipeline.set(self.heartbeat_key(worker_id), 1, px=int(self.heartbeat_timeout * 1000))
+        pipeline.sadd(self.workers_key, worker_id)
+        if task_id is not None:
+            pipeline.expire(task_id, self.task_store.ttl)
+        pipeline.execute()
+        self.renew_waiting()
+
+    def unregister(self, worker_id):
+        """
+        Removes a worker which stopped regularly
+        """
+        pipeline = self.redis_client.pipeline()
+        pipeline.srem(self.workers_key, worker_id)
+        pipeline.delete(self.heartbeat_key(worker_id))
+        pipeline.execute()
+
+    def running(self):
+        """
+        Returns the number of jobs the registered workers are running
+        """
+        return sum(self.redis_client.llen(self.processing_key(worker_id))
+                   for worker_id in self.redis_client.smembers(self.workers_key))
+
+    def workers(self):
+        """
+        Returns the IDs of the workers with a live heartbeat
+        """
+        return [worker_id for worker_id in self.redis_client.smembers(self.workers_key)
+                if self.redis_client.exists(self.heartbeat_key(worker_id))]
+
+    def requeue_orphans(self):
+        """
+        Moves the jobs of dead workers back to the front of the queue
+
+        Returns:
+            list: The IDs of the requeued tasks
+        """
+        requeued = []
+        for worker_id in self.redis_client.smembers(self.workers_key):
+            if self.redis_client.exists(self.heartbeat_key(worker_id)):
+                continue
+            while True:
+                task_id = self.redis_client.lmove(self.processing_key(worker_id), self.queue_key, "RIGHT", "LEFT")
+                if task_id is None:
+                    break
+                self.redis_client.hincrby(task_id, "attempts", 1)
+                requeued.append(task_id)
+            self.redis_client.srem(self.workers_key, worker_id)
+        self.renew_waiting()
+        return requeued
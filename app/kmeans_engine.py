@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+"""
+Module with the k-means engine of the project: Lloyd and Elkan iterations
+in NumPy on blocks of rows, with a callback after every iteration
+"""
+import os
+import numpy as np
+import scipy.sparse
+from sklearn.cluster import kmeans_plusplus
+from sklearn.utils.sparsefuncs import mean_variance_axis
+
+# Bytes of the rows and distances of one block, a block should stay in the cache
+KMEANS_BLOCK_BYTES = int(os.environ.get('KMEANS_BLOCK_BYTES', '262144'))
+# Rows whose sums per cluster are accumulated in the dtype of the data before they are added in float64
+SUM_ROWS = 65536
+# 0 keeps the data in float64 even if float32 would be precise enough
+KMEANS_FLOAT32 = int(os.environ.get('KMEANS_FLOAT32', '1'))
+
+
+# pylint: disable=too-few-public-methods
+class KMeansResult:
+    """
+    A fitted k-means run, with the attribute names of sklearn's KMeans
+    """
+
+    def __init__(self, labels, cluster_centers, inertia, n_iter):
+        self.labels_ = labels
+        self.cluster_centers_ = cluster_centers
+        self.inertia_ = inertia
+        self.n_iter_ = n_iter
+
+
+class KMeansEngine:
+    """
+    Lloyd's and Elkan's k-means on a fixed matrix.
+
+    The data is centred once and kept in float32 if the rounding error of
+    the distances stays below the scaled tolerance, otherwise in float64.
+    Distances are computed block by block as ||x||² - 2x·c + ||c||² with
+    the row norms computed once; the buffers of the iterations are allocated
+    once per fit. Centroids are accumulated in float64.
+
+    The stop criteria are those of sklearn: no label changed, the centroids
+    moved less than tolerance times the mean variance of the data, or
+    max_iterations. "elkan" skips the distances of rows which cannot change
+    their cluster (with Hamerly's single lower bound) and gives the same result.
+
+    A CSR matrix stays sparse; its distances are sparse-dense products.
+    After __init__ the engine is read only, so several fits may run in parallel threads.
+    """
+
+    def __init__(self, matrix, tolerance, block_bytes=KMEANS_BLOCK_BYTES, float32=KMEANS_FLOAT32):
+        self.sparse = scipy.sparse.issparse(matrix)
+        matrix = scipy.sparse.csr_matrix(matrix) if self.sparse else np.asarray(matrix)
+        if matrix.ndim != 2 or matrix.shape[0] == 0 or matrix.shape[1] == 0:
+            raise ValueError(f"Expected a non-empty 2D matrix, got shape {matrix.shape}.")
+        self.block_bytes = block_bytes
+        if self.sparse:
+            self._init_sparse(matrix, tolerance, float32)
+            return
+        rows = max(64, block_bytes // (8 * matrix.shape[1]))
+
+        # Erster Durchlauf in float64: Mittelwert, Varianz und größte Zeilennorm
+        self.mean = np.zeros(matrix.shape[1])
+        for start in range(0, len(matrix), rows):
+            block = np.asarray(matrix[start:start + rows], dtype=np.float64)
+            if not np.all(np.isfinite(block)):
+                raise ValueError("Input contains NaN, infinity or a value too large for dtype('float64').")
+            self.mean += block.sum(axis=0)
+        self.mean /= len(matrix)
+        squares, largest_norm = np.zeros(matrix.shape[1]), 0.0
+        for start in range(0, len(matrix), rows):
+            block = np.asarray(matrix[start:start + rows], dtype=np.float64) - self.mean
+            squares += np.einsum("ij,ij->j", block, block)
+            largest_norm = max(largest_norm, float(np.einsum("ij,ij->i", block, block).max()))
+        # Wie bei sklearn wird die Toleranz mit der mittleren Varianz skaliert
+        self.threshold = tolerance * float(np.mean(squares / len(matrix)))
+
+        self.dtype = self._choose_dtype(largest_norm, float32)
+        self.data = np.empty(matrix.shape, dtype=self.dtype)
+        for start in range(0, len(matrix), rows):
+            self.data[start:start + rows] = np.asarray(matrix[start:start + rows], dtype=np.float64) - self.mean
+        self.row_norms = np.einsum("ij,ij->i", self.data, self.data)
+
+    def _init_sparse(self, matrix, tolerance, float32):
+        """
+        Keeps a CSR matrix sparse: it is not centred, which changes neither
+        the labels nor the centroids, only the rounding of the distances
+        """
+        if not np.all(np.isfinite(matrix.data)):
+            raise ValueError("Input contains NaN, infinity or a value too large for dtype('float64').")
+        self.mean = np.zeros(matrix.shape[1])
+        _, variance = mean_variance_axis(matrix.astype(np.float64), axis=0)
+        self.threshold = tolerance * float(np.mean(variance))
+        squared = matrix.multiply(matrix).sum(axis=1)
+        self.dtype = self._choose_dtype(float(squared.max()), float32)
+        self.data = matrix.astype(self.dtype)
+        self.data.sort_indices()
+        self.row_norms = np.asarray(squared, dtype=self.dtype).ravel()
+
+    def _choose_dtype(self, largest_norm, float32):
+        """
+        Returns float32 if its rounding error of the distances stays below the scaled tolerance
+        """
+        precise = np.spacing(np.float32(1)) * largest_norm <= self.threshold
+        return np.dtype(np.float32 if float32 and precise else np.float64)
+
+    def row(self, index):
+        """
+        Returns one row of the (centred) data as dense float64 array
+        """
+        if self.sparse:
+            return self.data[index].toarray().ravel().astype(np.float64)
+        return self.data[index].astype(np.float64)
+
+    def initial_centers(self, k_value, init, generator):
+        """
+        Draws the initial centroids of one run
+
+        Args:
+            init (str): "k-means++" or "random"
+            generator (np.random.RandomState): Random generator of the fit, see check_random_state
+
+        Returns:
+            np.ndarray: The centroids in the coordinates of the matrix
+        """
+        if k_value > self.data.shape[0]:
+            raise ValueError(f"n_samples={self.data.shape[0]} should be >= n_clusters={k_value}.")
+        if init == "k-means++":
+            centers, _ = kmeans_plusplus(self.data, k_value, x_squared_norms=self.row_norms,
+                                         random_state=generator)
+        elif init == "random":
+            centers = np.array([self.row(index)
+                                for index in generator.choice(self.data.shape[0], k_value, replace=False)])
+        else:
+            raise ValueError(str(init))
+        return np.asarray(centers, dtype=np.float64) + self.mean
+
+    def fit(self, centers, max_iterations, algorithm="lloyd", callback=None):
+        """
+        Runs k-means from the given centroids
+
+        Args:
+            centers (array): The initial centroids in the coordinates of the matrix
+            algorithm (str): "lloyd" or "elkan"
+            callback (callable): Called after every iteration with (iteration, inertia, center_shift),
+                                 the inertia is None for "elkan"; may raise to stop the fit
+
+        Returns:
+            KMeansResult: Labels, centroids, inertia and number of iterations
+        """
+        centers = np.array(centers, dtype=np.float64)
+        if centers.ndim != 2 or centers.shape[1] != self.data.shape[1]:
+            raise ValueError(f"The shape of the initial centers {centers.shape} does not match "
+                             f"the number of features of the data {self.data.shape[1]}.")
+        if len(centers) > self.data.shape[0]:
+            raise ValueError(f"n_samples={self.data.shape[0]} should be >= n_clusters={len(centers)}.")
+        if algorithm not in ("lloyd", "elkan"):
+            raise ValueError(f"algorithm must be 'lloyd' or 'elkan', got {algorithm}.")
+        centers -= self.mean
+        state = _FitState(self, len(centers))
+        previous = np.full(self.data.shape[0], -1, dtype=np.int32)
+
+        iteration, converged = 0, False
+        while iteration < max_iterations:
+            iteration += 1
+            if algorithm == "elkan":
+                # Die Schranken ergeben keine exakte Inertia
+                state.assign_bounded(centers, iteration == 1)
+                inertia = None
+            else:
+                inertia = state.assign(centers)
+            new_centers = state.update(centers)
+            shift = float(np.sum((new_centers - centers) ** 2))
+            if algorithm == "elkan":
+                state.move_bounds(np.sqrt(np.sum((new_centers - centers) ** 2, axis=1)))
+            centers = new_centers
+            if callback is not None:
+                callback(iteration, inertia, shift)
+            if np.array_equal(state.labels, previous):
+                converged = True
+                break
+            if shift <= self.threshold:
+                break
+            previous[:] = state.labels
+
+        # Wie bei sklearn passen die Labels danach zu den letzten Zentren
+        if not converged:
+            state.assign(centers)
+        return KMeansResult(state.labels, centers + self.mean, state.inertia(centers), iteration)
+
+
+# pylint: disable=too-many-instance-attributes
+class _FitState:
+    """
+    The buffers of one fit, allocated once and reused by every iteration
+    """
+
+    def __init__(self, engine, k_value):
+        self.engine = engine
+        self.k_value = k_value
+        length, features = engine.data.shape
+        # Bei CSR zählen die Nicht-Null-Werte einer Zeile
+        stored = engine.data.nnz // length + 1 if engine.sparse else features
+        self.rows = max(64, engine.block_bytes // ((stored + k_value) * engine.dtype.itemsize))
+        self.labels = np.zeros(length, dtype=np.int32)
+        self.distances = np.empty(length, dtype=engine.dtype)
+        # Abstände eines Blocks als k x Zeilen, die Minima laufen so über zusammenhängende Zeilen
+        self.products = np.empty(k_value * self.rows, dtype=engine.dtype)
+        self.keys = np.empty(k_value * self.rows, dtype=np.int64) if engine.dtype == np.float32 else None
+        self.clusters = np.arange(k_value, dtype=np.int64)[:, None]
+        self.index = np.arange(self.rows)
+        self.ones = np.ones(min(length, SUM_ROWS), dtype=engine.dtype)
+        self.pointers = np.arange(min(length, SUM_ROWS) + 1)
+        self.sums = np.empty((k_value, features))
+        self.counts = np.empty(k_value)
+        # Schranken von "elkan": Abstand zum eigenen und zum zweitnächsten Zentrum
+        self.upper = None
+        self.lower = None
+        self.scaled = None
+        self.center_norms = None
+
+    def _prepare(self, centers):
+        """
+        Computes -2c and ||c||² once per iteration, in the dtype of the data
+        """
+        self.scaled = np.ascontiguousarray(-2 * centers, dtype=self.engine.dtype)
+        self.center_norms = np.einsum("ij,ij->i", centers, centers).astype(self.engine.dtype)[:, None]
+
+    def _nearest(self, block, norms):
+        """
+        Finds the nearest centroid of every row of a block
+
+        Returns:
+            tuple: (labels, squared distances to the nearest centroid,
+                    squared distances to all centroids as k x rows in the products buffer)
+        """
+        count = block.shape[0]
+        products = self.products[:self.k_value * count].reshape(self.k_value, count)
+        if self.engine.sparse:
+            products[:] = (block @ self.scaled.T).T
+        else:
+            np.dot(self.scaled, block.T, out=products)
+        products += self.center_norms
+        products += norms
+        np.maximum(products, 0, out=products)
+        if self.keys is None:
+            labels = np.argmin(products, axis=0)
+            return labels, products[labels, self.index[:count]], products
+        # Nicht negative float32 sind wie ihre Bitmuster geordnet: Abstand in den oberen, Cluster in
+        # den unteren 32 Bit, sodass ein Minimum über int64 Label und Abstand zugleich liefert
+        keys = self.keys[:self.k_value * count].reshape(self.k_value, count)
+        np.left_shift(products.view(np.int32), 32, out=keys, dtype=np.int64)
+        keys |= self.clusters
+        nearest = keys.min(axis=0)
+        return nearest.astype(np.int32), (nearest >> 32).astype(np.int32).view(np.float32), products
+
+    def assign(self, centers):
+        """
+        Assigns every row to its nearest centroid
+
+        Returns:
+            float: The inertia of the assignment
+        """
+        data, norms = self.engine.data, self.engine.row_norms
+        self._prepare(centers)
+        for start in range(0, data.shape[0], self.rows):
+            stop = min(start + self.rows, data.shape[0])
+            self.labels[start:stop], self.distances[start:stop], _ = self._nearest(data[start:stop],
+                                                                                   norms[start:stop])
+        return float(self.distances.sum(dtype=np.float64))
+
+    def assign_bounded(self, centers, first):
+        """
+        Assigns the rows like assign, but computes the distances only of rows whose
+        bounds allow a nearer centroid
+        """
+        data, norms = self.engine.data, self.engine.row_norms
+        if first:
+            self.upper = np.empty(data.shape[0])
+            self.lower = np.empty(data.shape[0])
+            candidates = np.arange(data.shape[0])
+        else:
+            # Halber Abstand jedes Zentrums zum nächsten anderen Zentrum
+            between = np.sqrt(np.sum((centers[:, None] - centers[None]) ** 2, axis=2))
+            np.fill_diagonal(between, np.inf)
+            half = between.min(axis=1) / 2
+            candidates = np.flatnonzero(self.upper > np.maximum(self.lower, half[self.labels]))
+        self._prepare(centers)
+        for start in range(0, len(candidates), self.rows):
+            rows = candidates[start:start + self.rows]
+            labels, nearest, products = self._nearest(data[rows], norms[rows])
+            self.labels[rows] = labels
+            self.distances[rows] = nearest
+            self.upper[rows] = np.sqrt(nearest)
+            products[labels, self.index[:len(rows)]] = np.inf
+            self.lower[rows] = np.sqrt(products.min(axis=0))
+
+    def move_bounds(self, moved):
+        """
+        Loosens the bounds by the distances the centroids moved
+        """
+        self.upper += moved[self.labels]
+        self.lower -= moved.max()
+
+    def update(self, centers):
+        """
+        Returns the mean of the rows of every cluster; empty clusters
+        take the rows farthest from their centroid, as in sklearn
+        """
+        data = self.engine.data
+        self.sums[:] = 0
+        for start in range(0, data.shape[0], SUM_ROWS):
+            stop = min(start + SUM_ROWS, data.shape[0])
+            # Summen pro Cluster als dünn besetztes One-Hot-Produkt, je Abschnitt in float64 aufaddiert
+            one_hot = scipy.sparse.csr_matrix((self.ones[:stop - start], self.labels[start:stop],
+                                               self.pointers[:stop - start + 1]),
+                                              shape=(stop - start, len(centers)))
+            sums = one_hot.T @ data[start:stop]
+            self.sums += sums.toarray() if self.engine.sparse else sums
+        self.counts[:] = np.bincount(self.labels, minlength=len(centers))
+
+        empty = np.flatnonzero(self.counts == 0)
+        if len(empty):
+            distances = self._exact_distances(centers)
+            for cluster, row in zip(empty, np.argsort(distances)[::-1][:len(empty)]):
+                old = self.labels[row]
+                self.sums[old] -= self.engine.row(row)
+                self.counts[old] -= 1
+                self.sums[cluster] = self.engine.row(row)
+                self.counts[cluster] = 1
+
+        new_centers = centers.copy()
+        filled = self.counts > 0
+        new_centers[filled] = self.sums[filled] / self.counts[filled, None]
+        return new_centers
+
+    def _exact_distances(self, centers):
+        """
+        Returns the squared distance of every row to its centroid, computed in float64
+        """
+        data = self.engine.data
+        distances = np.empty(data.shape[0])
+        for start in range(0, data.shape[0], self.rows):
+            stop = min(start + self.rows, data.shape[0])
+            labels = self.labels[start:stop]
+            if self.engine.sparse:
+                # ||x||² - 2x·c + ||c||² in float64, ohne den Block dicht zu machen
+                block = data[start:stop].astype(np.float64)
+                products = np.asarray(block @ centers.T)[np.arange(stop - start), labels]
+                squared = np.asarray(block.multiply(block).sum(axis=1)).ravel()
+                distances[start:stop] = np.maximum(squared - 2 * products + np.sum(centers ** 2, axis=1)[labels], 0)
+            else:
+                difference = data[start:stop] - centers[labels]
+                distances[start:stop] = np.einsum("ij,ij->i", difference, difference)
+        return distances
+
+    def inertia(self, centers):
+        """
+        Returns the sum of the squared distances of the rows to their centroids
+        """
+        return float(self._exact_distances(centers).sum())
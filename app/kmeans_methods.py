@@ -2,16 +2,240 @@
 """
 Module for k-means clustering methods.
 """
+import os
 import json
-from sklearn.cluster import KMeans
-from app.utils import dataframe_to_json_str, elbow_to_json
-from app.datacheck import data_check, run_normalization, ohe
+import time
+import hashlib
+import itertools
+import numpy as np
+import scipy.sparse
+from joblib import Parallel, delayed
+from threadpoolctl import threadpool_limits
+from sklearn.cluster import KMeans, MiniBatchKMeans, kmeans_plusplus
+from sklearn.metrics import pairwise_distances_argmin_min
+from sklearn.utils import check_random_state
+from sklearn.utils.sparsefuncs import mean_variance_axis
+from app.utils import dataframe_to_json_str, elbow_to_json, iter_file_chunks, result_to_npz, hash_upload
+from app.datacheck import prepare_data, StreamingPreparation
+from app.datasets import DatasetStore
+from app.models import KMeansModel, ModelRegistry, nearest_centroids
+from app.progress import ProgressReporter, ControlReporter, KMEANS_PROGRESS_ITERATIONS, KMEANS_PROGRESS_SEGMENT
+from app.kmeans_engine import KMeansEngine, KMeansResult
+from app.knee import KneeTracker, find_knee, geometric_grid, refinement
+from app.scoring import score_clustering
+from app.seeding import INITS, SUMMARY_INITS, KMEANS_CORESET_SIZE, lightweight_coreset, summarize, seed_from_summary
 
-# pylint: disable=inconsistent-return-statements
-def run_kmeans_one_k(redis_client,
+# "numpy" fits lloyd and elkan with the engine of the project, "sklearn" with sklearn's KMeans
+KMEANS_ENGINE = os.environ.get('KMEANS_ENGINE', 'numpy')
+
+# Number of rows per partial_fit step of the mini-batch k-means
+KMEANS_BATCH_SIZE = int(os.environ.get('KMEANS_BATCH_SIZE', '4096'))
+# Maximal number of passes over a streamed upload
+KMEANS_STREAM_EPOCHS = int(os.environ.get('KMEANS_STREAM_EPOCHS', '10'))
+
+# Number of k values of an elbow sweep fitted in parallel, in a worker process
+# by default the CPU cores divided by the number of worker processes
+KMEANS_ELBOW_JOBS = int(os.environ.get('KMEANS_ELBOW_JOBS', str(os.cpu_count() or 1)))
+# BLAS/OpenMP threads of each parallel elbow fit
+KMEANS_ELBOW_JOB_THREADS = int(os.environ.get('KMEANS_ELBOW_JOB_THREADS', '1'))
+
+# Deprecated algorithm names, which newer scikit-learn versions no longer accept
+LEGACY_ALGORITHMS = {"auto": "lloyd", "full": "lloyd"}
+
+
+def create_kmeans(k_value, number_runs, max_iterations, tolerance, init, used_algorithm, random_state=None,
+                  copy_x=True):
+    """
+    Instantiates sklearn's KMeans, or MiniBatchKMeans for the algorithm "minibatch"
+
+    Args:
+        copy_x (bool): False lets KMeans center the data in place, it has to be writable
+    """
+    if used_algorithm == "minibatch":
+        return MiniBatchKMeans(
+            n_clusters=k_value,
+            init=init,
+            n_init=number_runs,
+            max_iter=max_iterations,
+            tol=tolerance,
+            batch_size=KMEANS_BATCH_SIZE,
+            random_state=random_state)
+    return KMeans(
+        n_clusters=k_value,
+        init=init,
+        n_init=number_runs,
+        max_iter=max_iterations,
+        tol=tolerance,
+        algorithm=LEGACY_ALGORITHMS.get(used_algorithm, used_algorithm),
+        random_state=random_state,
+        copy_x=copy_x)
+
+# pylint: disable=too-many-branches
+def fit_kmeans(matrix, k_value, number_runs, max_iterations, tolerance, init, used_algorithm,
+               random_state=None, reporter=None):
+    """
+    Fits k-means and reports the progress from inside the fit
+
+    With KMEANS_ENGINE "numpy" the runs out of n_init are fitted by the
+    KMeansEngine, which reports after every iteration. sklearn offers no
+    callback per iteration, so with KMEANS_ENGINE "sklearn" and a reporter
+    every run is fitted on its own, in segments of KMEANS_PROGRESS_ITERATIONS
+    iterations which continue from the centroids of the previous segment.
+    Short segments are stretched to about KMEANS_PROGRESS_SEGMENT seconds,
+    so small fits stay one sklearn call per run.
+
+    "k-means||" and "subsample" summarize the data once (see app.seeding)
+    and seed every run with weighted k-means++ on the summary, "coreset"
+    clusters a weighted coreset instead of the data (see fit_coreset).
+
+    Args:
+        init (str or array): "k-means++", "random", "k-means||", "subsample", "coreset"
+                             or the initial centroids
+        reporter (ProgressReporter): Receives the progress, may be None
+
+    Returns:
+        KMeans or KMeansResult: The fitted run with the lowest inertia
+    """
+    explicit = not isinstance(init, str)
+    if not explicit and init == "coreset":
+        return fit_coreset(matrix, k_value, number_runs, max_iterations, tolerance, used_algorithm,
+                           random_state, reporter)
+    numpy_engine = KMEANS_ENGINE == "numpy" and used_algorithm != "minibatch"
+    if (used_algorithm == "minibatch" or (reporter is None and not numpy_engine)) and (explicit or init not in SUMMARY_INITS):
+        return create_kmeans(k_value, number_runs, max_iterations, tolerance, init,
+                             used_algorithm, random_state).fit(matrix)
+    if isinstance(number_runs, bool) or not isinstance(number_runs, int) or number_runs < 1:
+        raise ValueError(f"number_kmeans_runs must be a positive integer, got {number_runs}.")
+    algorithm = LEGACY_ALGORITHMS.get(used_algorithm, used_algorithm)
+
+    runs = 1 if explicit else number_runs
+    generator = check_random_state(random_state)
+    summary = None
+    if numpy_engine:
+        engine = KMeansEngine(matrix, tolerance)
+        threshold = engine.threshold
+    else:
+        # Eine beschreibbare Kopie für alle Abschnitte statt einer Kopie pro sklearn-Aufruf
+        if scipy.sparse.issparse(matrix):
+            matrix = scipy.sparse.csr_matrix(matrix, dtype=float, copy=True)
+            variance = mean_variance_axis(matrix, axis=0)[1]
+        else:
+            matrix = np.array(matrix, dtype=float, order="C")
+            variance = np.var(matrix, axis=0)
+        # Wie bei sklearn wird die Toleranz mit der mittleren Varianz skaliert
+        threshold = tolerance * float(np.mean(variance))
+
+    def report_iteration(iteration, inertia, center_shift):
+        reporter.report(iteration=iteration, inertia=inertia, center_shift=center_shift)
+
+    best = None
+    for run in range(1, runs + 1):
+        if explicit:
+            centers = np.asarray(init, dtype=float)
+        elif init in SUMMARY_INITS:
+            # Die Zusammenfassung wird einmal für alle Durchläufe berechnet
+            if summary is None:
+                summary = summarize(engine.data if numpy_engine else matrix, k_value, init, generator)
+            centers = seed_from_summary(summary, k_value, generator) + (engine.mean if numpy_engine else 0)
+        elif numpy_engine:
+            centers = engine.initial_centers(k_value, init, generator)
+        else:
+            centers = initial_centers(matrix, k_value, init, generator)
+        if reporter is not None:
+            reporter.report(run=run, runs=runs, iteration=0, max_iterations=max_iterations, tolerance=threshold)
+        if numpy_engine:
+            kmeans = engine.fit(centers, max_iterations, algorithm, None if reporter is None else report_iteration)
+        elif reporter is None or used_algorithm == "minibatch":
+            kmeans = create_kmeans(k_value, 1, max_iterations, tolerance, centers, used_algorithm,
+                                   random_state).fit(matrix)
+        else:
+            kmeans = fit_run(matrix, centers, max_iterations, tolerance, threshold, algorithm, reporter)
+        if best is None or kmeans.inertia_ < best.inertia_:
+            best = kmeans
+        if reporter is not None:
+            reporter.report(best_inertia=float(best.inertia_))
+    return best
+
+
+def fit_coreset(matrix, k_value, number_runs, max_iterations, tolerance, used_algorithm, random_state=None,
+                reporter=None):
+    """
+    Coreset mode: fits k-means with number_runs k-means++ runs on a lightweight
+    coreset of KMEANS_CORESET_SIZE weighted rows and assigns every row of the
+    data to the nearest of its centroids in one blocked pass. The inertia is
+    that of the data.
+
+    Returns:
+        KMeansResult: Labels and inertia of the data, centroids and iterations of the coreset fit
+    """
+    generator = check_random_state(random_state)
+    points, weights = lightweight_coreset(matrix, max(KMEANS_CORESET_SIZE, k_value), generator)
+    if reporter is not None:
+        reporter.report(run=1, runs=1, iteration=0, max_iterations=max_iterations)
+    # Der Coreset ist klein, daher wird auch für "minibatch" Lloyd gerechnet
+    algorithm = "lloyd" if used_algorithm == "minibatch" else used_algorithm
+    kmeans = create_kmeans(k_value, number_runs, max_iterations, tolerance, "k-means++", algorithm,
+                           generator).fit(points, sample_weight=weights)
+    labels, distances = pairwise_distances_argmin_min(matrix, kmeans.cluster_centers_)
+    inertia = float(np.dot(distances, distances))
+    if reporter is not None:
+        reporter.report(iteration=int(kmeans.n_iter_), inertia=inertia, best_inertia=inertia)
+    return KMeansResult(labels.astype(np.int32), kmeans.cluster_centers_, inertia, kmeans.n_iter_)
+
+
+def initial_centers(matrix, k_value, init, generator):
+    """
+    Draws the initial centroids of one run
+
+    Args:
+        init (str): "k-means++" or "random"
+        generator (np.random.RandomState): Random generator of the fit, see check_random_state
+    """
+    if init == "k-means++":
+        centers, _ = kmeans_plusplus(matrix, k_value, random_state=generator)
+        return centers
+    if init == "random":
+        rows = matrix[generator.choice(matrix.shape[0], k_value, replace=False)]
+        return np.asarray(rows.toarray() if scipy.sparse.issparse(rows) else rows, dtype=float)
+    raise ValueError(str(init))
+
+
+def fit_run(matrix, centers, max_iterations, tolerance, threshold, used_algorithm, reporter):
+    """
+    Runs Lloyd/Elkan iterations from centers in segments and reports
+    the iteration, the inertia and the centroid shift after each segment
+
+    Args:
+        threshold (float): The tolerance scaled with the mean variance of the data
+
+    Returns:
+        KMeans: The fit after the last segment
+    """
+    iterations, step, labels = 0, KMEANS_PROGRESS_ITERATIONS, None
+    while True:
+        step = min(step, max_iterations - iterations)
+        begin = time.monotonic()
+        kmeans = create_kmeans(len(centers), 1, step, tolerance, centers, used_algorithm, copy_x=False).fit(matrix)
+        iterations += kmeans.n_iter_
+        # Verschiebung der Zentren während des letzten Abschnitts
+        shift = float(np.sum((kmeans.cluster_centers_ - centers) ** 2))
+        centers = kmeans.cluster_centers_
+        reporter.report(iteration=iterations, inertia=float(kmeans.inertia_), center_shift=shift)
+        # sklearn bricht innerhalb eines Abschnitts selbst ab; an den Grenzen gelten dieselben Kriterien
+        converged = kmeans.n_iter_ < step or shift <= threshold or np.array_equal(labels, kmeans.labels_)
+        if converged or iterations >= max_iterations:
+            return kmeans
+        labels = kmeans.labels_
+        # Jeder sklearn-Aufruf prüft und zentriert die Daten erneut, daher
+        # werden die Abschnitte auf etwa KMEANS_PROGRESS_SEGMENT Sekunden verlängert
+        elapsed = time.monotonic() - begin
+        if elapsed < KMEANS_PROGRESS_SEGMENT:
+            step = max(step * 2, int(step * KMEANS_PROGRESS_SEGMENT / max(elapsed, 1e-6)))
+
+
+def run_kmeans_one_k(task_store,
                     dataframe,
                     task_id,
-                    tasks,
                     k_value,
                     number_runs,
                     max_iterations,
@@ -19,84 +243,68 @@ def run_kmeans_one_k(redis_client,
                     initialisation,
                     used_algorithm,
                     centroids_start=None,
-                    normalization=None):
+                    normalization=None,
+                    random_state=None,
+                    dataset_id=None,
+                    control=None):
     """
     Uploads a CSV file, performs k-means, and returns an array with the clusters 
 
+    The fitted model of a dataset is stored in the model registry, its ID is the task field model_id.
+
     Args:
-        dataframe (pd.DataFrame): The uploaded CSV data.
+        task_store (TaskStore): The state of the tasks
+        dataframe (pd.DataFrame): The uploaded CSV data, None if the data is taken from dataset_id.
         num_clusters (int): The number of clusters, default = 2
         task_id (int): The taskID
+        random_state (int): Seed of the initialisation, makes the result deterministic
+        dataset_id (str): ID under which the prepared data is cached in the dataset store
+        control (JobControl): Stops the fit at its checkpoints when the job is cancelled or over budget
         
     Returns:
-        dict: A dictionary with the DataFrame with the CSV data.
-              If the uploaded file is not a CSV, an error message is returned.
+        None, the result is stored in redis; errors are the task status and message
     """
     #Dateicheck einfuegen
-    if tasks[task_id]["method"] == "one_k":
-        cleaned_df = data_check(redis_client, dataframe, tasks, task_id)
-        dataframe = ohe(redis_client, cleaned_df,tasks, task_id)
-        tasks[task_id]["status"] = "Data prepared. Processing"
-        redis_client.hset(task_id,'status',"Data prepared. Processing")
-
-        if normalization is not None:
-            dataframe = run_normalization(redis_client, dataframe,tasks, task_id, normalization)
-
-    if dataframe is None or tasks[task_id]["status"] == "Bad Request":
-        tasks[task_id]["status"] = "Bad Request"
-        redis_client.hset(task_id,'status',"Bad Request")
+    cleaned_df, matrix = prepare_data(task_store, dataframe, task_id, normalization, dataset_id)
+    if matrix is None:
+        task_store.update(task_id, status="Bad Request")
         return
+    task_store.update(task_id, status="Data prepared. Processing")
 
-    kmeans = None
-    if initialisation in ("k-means++","random"):
-        # Instantiate sklearn's k-means using num_clusters clusters
-        kmeans = KMeans(
-            n_clusters=k_value,
-            init=initialisation,
-            n_init=number_runs,
-            max_iter=max_iterations,
-            tol=tolerance,
-            algorithm=used_algorithm)
+    if initialisation in INITS:
+        init = initialisation
     elif initialisation == "centroids":
-        # Instantiate sklearn's k-means using num_clusters clusters
-        kmeans = KMeans(
-                n_clusters=k_value,
-                init=centroids_start,
-                n_init=number_runs,
-                max_iter=max_iterations,
-                tol=tolerance,
-                algorithm=used_algorithm)
-    if kmeans is None:
-        tasks[task_id]["status"] = "Bad Request"
-        tasks[task_id]["message"] += str(initialisation)
-        redis_client.hset(task_id,'message',str(initialisation))
-        redis_client.hset(task_id,'status',"Bad Request")
-        return None
+        init = centroids_start
+    else:
+        task_store.fail(task_id, str(initialisation))
+        return
 
+    reporter = ProgressReporter(task_store, task_id, control=control)
     try:
         # execute k-means algorithm
-        kmeans.fit(dataframe.values)
+        kmeans = fit_kmeans(matrix, k_value, number_runs, max_iterations, tolerance, init, used_algorithm,
+                            random_state, reporter)
         # Update the task with the "completed" status and the results
-        if tasks[task_id]["method"] == "one_k":
-            result_to_json = dataframe_to_json_str(cleaned_df, kmeans.labels_, kmeans.cluster_centers_)
-            json_string = json.loads(result_to_json)
-            tasks[task_id]["json_result"] = json_string
-            redis_client.hset(task_id,"json_result",str(result_to_json))
-            redis_client.hset(task_id,"status","completed")
-            tasks[task_id]["status"] = "completed"
-        elif  tasks[task_id]["method"] == "elbow":
-            return kmeans.inertia_
+        # Nur Labels und Zentren speichern; die Datenpunkte liegen im Dataset-Speicher
+        result = {"result_npz": result_to_npz(kmeans.labels_, kmeans.cluster_centers_),
+                  **summary_fields(kmeans.labels_, kmeans.cluster_centers_, kmeans.inertia_),
+                  "status": "completed"}
+        if dataset_id is not None:
+            result.update(register_model(kmeans.cluster_centers_,
+                                         DatasetStore().load_preparation(dataset_id, normalization),
+                                         task_store.field(task_id, "cache_key")))
+        if dataset_id is not None and DatasetStore().exists(dataset_id):
+            result["dataset_id"] = dataset_id
+        else:
+            result["json_result"] = dataframe_to_json_str(cleaned_df, kmeans.labels_, kmeans.cluster_centers_)
+        reporter.flush(**result)
     except ValueError as exception:
-        tasks[task_id]["status"] = "Bad Request"
-        tasks[task_id]["message"] += str(exception)
-        redis_client.hset(task_id,'message',str(exception))
-        redis_client.hset(task_id,'status',"Bad Request")
+        task_store.fail(task_id, str(exception))
 
 # pylint: disable=too-many-locals
-def run_kmeans_elbow(redis_client,
+def run_kmeans_elbow(task_store,
                         dataframe,
                         task_id,
-                        tasks,
                         k_min,
                         k_max,
                         number_runs,
@@ -105,42 +313,350 @@ def run_kmeans_elbow(redis_client,
                         initialisation,
                         used_algorithm,
                         centroids_start=None,
-                        normalization=None):
+                        normalization=None,
+                        warm_start=False,
+                        random_state=None,
+                        dataset_id=None,
+                        search="full",
+                        scores=False,
+                        control=None):
     """
     Performs kmeans for elbow method
+
+    The k values are fitted in parallel (KMEANS_ELBOW_JOBS jobs with
+    KMEANS_ELBOW_JOB_THREADS BLAS/OpenMP threads each). With warm_start the
+    sweep runs sequentially and starts k+1 from the centroids of k plus one
+    k-means++ seeded centroid. Every inertia is written to redis as soon as it is known,
+    together with the knee of the inertias so far as recommended_k.
+    With a job control the sweep stops once the job is cancelled or over budget, between
+    the k values and at the checkpoints inside their fits (runs and iterations).
+
+    Args:
+        search (str): "full" fits every k from k_min to k_max, "early-stop" stops the
+                      ascending sweep once the knee is confirmed and the curve flattened,
+                      "coarse-to-fine" fits a geometric grid of k values and then the
+                      k values between the neighbours of its knee
+        scores (bool): Also scores every k with the sampled silhouette, Davies-Bouldin and
+                       Calinski-Harabasz, computed in the parallel jobs and stored as scores
     """
 
     k_min = max(k_min, 1)
     k_values = range(k_min, k_max + 1)
-    inertia_values = []
-
-    cleaned_df = data_check(redis_client, dataframe, tasks, task_id)
-    dataframe = ohe(redis_client, cleaned_df,tasks, task_id)
-    tasks[task_id]["status"] = "Data prepared. Processing"
-    redis_client.hset(task_id,'status',"Data prepared. Processing")
-
-    if normalization is not None:
-        dataframe = run_normalization(redis_client, dataframe,tasks, task_id, normalization)
-
-    for k_value in k_values:
-        inertia = run_kmeans_one_k(redis_client,
-                                    dataframe,
-                                    task_id,
-                                    tasks,
-                                    k_value,
-                                    number_runs,
-                                    max_iterations,
-                                    tolerance,
-                                    initialisation,
-                                    used_algorithm,
-                                    centroids_start,
-                                    normalization)
-        inertia_values.append(inertia)
-
-    elbow_json = elbow_to_json(k_min, k_max, inertia_values)
-    json_string = json.loads(elbow_json)
-    tasks[task_id]["json_inertia"] = json_string
-    tasks[task_id]["status"] = "completed"
-    tasks[task_id]["inertia_values"] = inertia_values
-    redis_client.hset(task_id,'inertia_values',str(elbow_json))
-    redis_client.hset(task_id,'status',"completed")
+
+    _, matrix = prepare_data(task_store, dataframe, task_id, normalization, dataset_id)
+
+    if matrix is None:
+        task_store.update(task_id, status="Bad Request")
+        return
+
+    task_store.update(task_id, status="Data prepared. Processing")
+
+    if initialisation == "centroids":
+        init = centroids_start
+    elif initialisation in INITS:
+        init = initialisation
+    else:
+        task_store.fail(task_id, str(initialisation))
+        return
+
+    inertias = {}
+    k_scores = {}
+    tracker = KneeTracker(k_min)
+    reporter = ProgressReporter(task_store, task_id)
+    previous = {}
+    generator = np.random.default_rng(random_state)
+
+    def store_inertia(k_value, inertia, k_score=None):
+        # Zwischenergebnis schreiben, damit die Kurve schon während der Berechnung gezeichnet werden kann
+        inertias[k_value] = float(inertia)
+        tracker.add(k_value, inertia)
+        fields = knee_fields(inertias)
+        if k_score is not None:
+            k_scores[k_value] = k_score
+            fields["scores"] = elbow_to_json(k_scores)
+        reporter.progress.update(k=k_value, k_done=len(inertias), k_total=len(k_values))
+        reporter.flush(inertia_values=elbow_to_json(inertias), **fields)
+        if control is not None:
+            control.check()
+
+    def fit_values(selected, stopped=lambda: False):
+        if warm_start and initialisation != "centroids":
+            for k_value in selected:
+                if stopped():
+                    break
+                kmeans = fit_warm_started(matrix, k_value, previous.get(k_value - 1), number_runs, max_iterations,
+                                          tolerance, init, used_algorithm, generator, control)
+                previous.clear()
+                previous[k_value] = kmeans.cluster_centers_
+                store_inertia(k_value, kmeans.inertia_,
+                              score_clustering(matrix, kmeans.labels_, kmeans.cluster_centers_, random_state)
+                              if scores else None)
+            return
+        # Die k-Werte werden erst beim Verteilen erzeugt, nach dem Stopp also keine neuen Fits mehr gestartet
+        jobs = (delayed(fit_inertia)(matrix, k_value, number_runs, max_iterations,
+                                     tolerance, init, used_algorithm, random_state, control, scores)
+                for k_value in itertools.takewhile(lambda _: not stopped(), selected))
+        with threadpool_limits(limits=KMEANS_ELBOW_JOB_THREADS):
+            # Die Fits geben den GIL frei, daher reichen Threads ohne Kopie der Daten
+            parallel = Parallel(n_jobs=KMEANS_ELBOW_JOBS, prefer="threads", return_as="generator_unordered",
+                                pre_dispatch="n_jobs")
+            for k_value, inertia, k_score in parallel(jobs):
+                store_inertia(k_value, inertia, k_score)
+
+    try:
+        if search == "coarse-to-fine":
+            search_coarse_to_fine(fit_values, inertias, k_min, k_max)
+        else:
+            fit_values(k_values, tracker.stopped if search == "early-stop" else lambda: False)
+    except ValueError as exception:
+        task_store.fail(task_id, str(exception))
+        return
+
+    task_store.update(task_id, inertia_values=elbow_to_json(inertias), status="completed", **knee_fields(inertias))
+
+
+def search_coarse_to_fine(fit_values, inertias, k_min, k_max):
+    """
+    Fits a geometric grid of k values and then the k values between the
+    fitted neighbours of the knee, until the neighbours are contiguous
+
+    Args:
+        fit_values (callable): Fits a list of k values and stores their inertias in inertias
+        inertias (dict): The inertia of each fitted k
+    """
+    selected = geometric_grid(k_min, k_max)
+    while selected:
+        fit_values(selected)
+        fitted = sorted(inertias)
+        knee, _ = find_knee(fitted, [inertias[k_value] for k_value in fitted])
+        selected = [] if knee is None else refinement(fitted, knee, k_min, k_max)
+
+
+def knee_fields(inertias):
+    """
+    Returns the redis field recommended_k with the knee of the fitted k values, if there is one
+
+    Args:
+        inertias (dict): The inertia of each fitted k
+    """
+    fitted = sorted(inertias)
+    knee, _ = find_knee(fitted, [inertias[k_value] for k_value in fitted])
+    return {} if knee is None else {"recommended_k": knee}
+
+
+def fit_inertia(matrix, k_value, number_runs, max_iterations, tolerance, init, used_algorithm, random_state=None,
+                control=None, scores=False):
+    """
+    Fits k-means for one k of the elbow sweep, unless the job was stopped in the meantime;
+    the control is also checked between the runs and iterations of the fit
+
+    Returns:
+        tuple: (k, inertia, scores of score_clustering or None)
+    """
+    if control is not None:
+        control.check()
+    kmeans = fit_kmeans(matrix, k_value, number_runs, max_iterations, tolerance, init, used_algorithm, random_state,
+                        control_reporter(control))
+    if not scores:
+        return k_value, kmeans.inertia_, None
+    return k_value, kmeans.inertia_, score_clustering(matrix, kmeans.labels_, kmeans.cluster_centers_, random_state)
+
+
+def control_reporter(control):
+    """
+    Returns a reporter which checks the job control inside a fit, None without control
+    """
+    return None if control is None else ControlReporter(control)
+
+
+def fit_warm_started(matrix, k_value, centers, number_runs, max_iterations, tolerance, init, used_algorithm, generator,
+                     control=None):
+    """
+    Fits k-means for k_value clusters, starting from the centroids of the
+    previous k plus one new centroid drawn with the k-means++ rule.
+    Without previous centroids the fit is started cold.
+
+    Args:
+        generator (np.random.Generator): Random generator of the sweep
+        control (JobControl): Checked between the runs and iterations of the fit
+    """
+    random_state = int(generator.integers(2 ** 31))
+    if centers is None or len(centers) != k_value - 1:
+        return fit_kmeans(matrix, k_value, number_runs, max_iterations, tolerance, init, used_algorithm,
+                          random_state, control_reporter(control))
+
+    # k-means++: neuer Startpunkt mit Wahrscheinlichkeit proportional zum quadrierten Abstand
+    _, distances = pairwise_distances_argmin_min(matrix, centers)
+    weights = distances ** 2
+    if weights.sum() > 0:
+        index = generator.choice(matrix.shape[0], p=weights / weights.sum())
+    else:
+        index = generator.integers(matrix.shape[0])
+    row = matrix[index]
+    start = np.vstack([centers, row.toarray() if scipy.sparse.issparse(row) else row])
+
+    return fit_kmeans(matrix, k_value, 1, max_iterations, tolerance, start, used_algorithm, random_state,
+                      control_reporter(control))
+
+
+def summary_fields(labels, cluster_centers, inertia):
+    """
+    Returns the redis fields of the O(k) summary of a k-means result
+    """
+    return {"centroids": json.dumps(np.asarray(cluster_centers).tolist()),
+            "cluster_sizes": json.dumps(np.bincount(labels, minlength=len(cluster_centers)).tolist()),
+            "inertia": float(inertia)}
+
+
+def register_model(cluster_centers, preparation, key=None):
+    """
+    Stores the centroids with the fitted preparation of their data in the model registry.
+    The model ID is derived from the cache key of the request and the centroids, so a rerun
+    of an identical request stores no further model; without seed the centroids differ.
+
+    Args:
+        key (str): The cache key of the task, a new model ID if None
+
+    Returns:
+        dict: The task field model_id, empty without preparation (data prepared before models were stored)
+    """
+    if preparation is None:
+        return {}
+    model = KMeansModel(cluster_centers, preparation)
+    model_id = None
+    if key is not None:
+        model_id = hashlib.sha256(key.encode("utf-8") + model.cluster_centers.tobytes()).hexdigest()
+    return {"model_id": ModelRegistry().save(model, model_id)}
+
+
+def run_kmeans_minibatch(task_store,
+                         source,
+                         task_id,
+                         k_value,
+                         number_runs,
+                         max_iterations,
+                         tolerance,
+                         initialisation,
+                         centroids_start=None,
+                         normalization=None,
+                         random_state=None,
+                         control=None):
+    """
+    Performs mini-batch k-means on a spooled upload, which is read in chunks,
+    so the memory is bounded by the chunk size instead of the file size
+
+    Args:
+        source (dict): The spooled upload returned by utils.spool_upload
+        The other arguments are the same as for run_kmeans_one_k, the algorithm is always mini-batch k-means
+
+    Returns:
+        None, the result is stored in redis like the one of run_kmeans_one_k, with the model_id;
+        the upload is moved into the dataset store, from which its data points are read
+    """
+    try:
+        if initialisation in ("k-means++", "random"):
+            init = initialisation
+        elif initialisation in INITS:
+            # MiniBatchKMeans setzt k-means++ ohnehin nur auf eine Stichprobe von init_size Zeilen
+            init = "k-means++"
+        elif initialisation == "centroids":
+            init = np.array(centroids_start, dtype=float)
+            number_runs = 1
+        else:
+            raise ValueError(str(initialisation))
+
+        task_store.update(task_id, status="Data Preparation")
+
+        preparation = StreamingPreparation(normalization)
+        for chunk in iter_file_chunks(source):
+            preparation.observe(chunk)
+        for chunk in iter_file_chunks(source):
+            preparation.count(chunk)
+        preparation.build_encoder()
+        for chunk in iter_file_chunks(source):
+            preparation.fit_scaler(chunk)
+
+        task_store.append_message(task_id, preparation.message(), status="Data prepared. Processing")
+
+        kmeans = MiniBatchKMeans(n_clusters=k_value, init=init, n_init=number_runs,
+                                 batch_size=KMEANS_BATCH_SIZE, random_state=random_state)
+        fit_minibatch(kmeans, source, preparation, min(max_iterations, KMEANS_STREAM_EPOCHS), tolerance,
+                      ProgressReporter(task_store, task_id, control=control))
+
+        # Zweiter Durchlauf: Zuordnung der Datenpunkte zu den Clustern
+        labels, inertia = assign_clusters(kmeans.cluster_centers_, source, preparation)
+
+        # Die Datenpunkte werden aus der gespeicherten Datei gelesen, nur Labels und Zentren liegen in redis
+        dataset_id = source.get("dataset_id") or spooled_dataset_id(source)
+        DatasetStore().save_spooled(dataset_id, source, preparation.types)
+        task_store.update(task_id,
+                          result_npz=result_to_npz(labels, kmeans.cluster_centers_),
+                          **summary_fields(labels, kmeans.cluster_centers_, inertia),
+                          **register_model(kmeans.cluster_centers_, preparation, task_store.field(task_id, "cache_key")),
+                          dataset_id=dataset_id,
+                          data_source="spooled",
+                          status="completed")
+    except ValueError as exception:
+        task_store.fail(task_id, str(exception))
+    finally:
+        if os.path.exists(source["path"]):
+            os.remove(source["path"])
+
+
+def fit_minibatch(kmeans, source, preparation, epochs, tolerance, reporter=None):
+    """
+    Fits a MiniBatchKMeans with partial_fit, passing over the chunks of the upload
+    until the centroids move less than the tolerance during one pass.
+    The reporter receives the epoch before each chunk and the centroid shift after each pass.
+    """
+    k_value = kmeans.n_clusters
+    # Wie bei sklearn wird die Toleranz mit der mittleren Varianz skaliert
+    threshold = tolerance * preparation.mean_variance()
+    previous_centers = None
+    for epoch in range(1, epochs + 1):
+        for chunk in iter_file_chunks(source):
+            if reporter is not None:
+                reporter.report(epoch=epoch, epochs=epochs)
+            _, matrix = preparation.transform(chunk)
+            for start in range(0, matrix.shape[0], KMEANS_BATCH_SIZE):
+                batch = matrix[start:start + KMEANS_BATCH_SIZE]
+                # Die Initialisierung braucht mindestens k Datenpunkte
+                if not hasattr(kmeans, "cluster_centers_") and batch.shape[0] < k_value:
+                    continue
+                kmeans.partial_fit(batch)
+        centers = kmeans.cluster_centers_.copy()
+        shift = None if previous_centers is None else float(np.sum((centers - previous_centers) ** 2))
+        if reporter is not None:
+            reporter.report(epoch=epoch, epochs=epochs, center_shift=shift, tolerance=threshold)
+        if shift is not None and shift <= threshold:
+            break
+        previous_centers = centers
+
+
+def assign_clusters(cluster_centers, source, preparation):
+    """
+    Assigns the rows of a spooled upload to the nearest centroid, chunk by chunk;
+    only the labels are kept, the data points are read from the upload again
+
+    Returns:
+        tuple: (labels of all cleaned rows as int32, inertia)
+    """
+    all_labels = []
+    inertia = 0.0
+    for chunk in iter_file_chunks(source):
+        _, matrix = preparation.transform(chunk)
+        if matrix.shape[0] == 0:
+            continue
+        labels, distances = nearest_centroids(matrix, cluster_centers)
+        inertia += float(np.dot(distances, distances))
+        all_labels.append(labels)
+    labels = np.concatenate(all_labels) if all_labels else np.empty(0, dtype=np.int32)
+    return labels, inertia
+
+
+def spooled_dataset_id(source):
+    """
+    Returns the sha256 of a spooled upload, the dataset ID of a job started without one
+    """
+    with open(source["path"], "rb") as file:
+        return hash_upload(file)
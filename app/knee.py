@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Module detecting the knee of an elbow curve and planning the k values of a sweep
+"""
+import os
+import math
+import numpy as np
+
+# Sensitivity S of Kneedle: a knee is confirmed once the difference curve
+# falls S times the mean distance of the k values below its local maximum
+ELBOW_SENSITIVITY = float(os.environ.get('ELBOW_SENSITIVITY', '1.0'))
+# Number of further k values an early stopped sweep fits after the knee was confirmed
+ELBOW_PATIENCE = int(os.environ.get('ELBOW_PATIENCE', '3'))
+# An early stopped sweep stops only if the log inertia fell after the knee by at
+# most this share of its fall up to the knee, i.e. the curve has flattened
+ELBOW_FLATNESS = float(os.environ.get('ELBOW_FLATNESS', '0.1'))
+# Ratio of two neighbouring k values of the coarse grid of the coarse-to-fine search
+ELBOW_GRID_RATIO = float(os.environ.get('ELBOW_GRID_RATIO', '1.5'))
+
+# "full" fits every k, "early-stop" stops the ascending sweep once the knee is
+# confirmed, "coarse-to-fine" fits a geometric grid and then the k values around its knee
+SEARCH_MODES = ("full", "early-stop", "coarse-to-fine")
+
+
+def find_knee(k_values, inertias, sensitivity=ELBOW_SENSITIVITY):
+    """
+    Finds the knee of a decreasing elbow curve with Kneedle (Satopää et al.,
+    Finding a "Kneedle" in a Haystack) on the logarithm of the inertias:
+    both axes are scaled to [0, 1] and the knee is the first local maximum of
+    the distance below the chord, 1 - x - y, after which this distance falls
+    by more than sensitivity times the mean step of the scaled k values.
+    The logarithm keeps the knee of many clusters from being hidden by the
+    steep start of the curve.
+
+    Args:
+        k_values (list): The k values in ascending order, not necessarily contiguous
+        inertias (list): Their inertias
+
+    Returns:
+        tuple: (knee, confirmed), the knee is the k with the largest distance
+               if no local maximum is confirmed, None for fewer than three points
+    """
+    k_values = np.asarray(k_values, dtype=float)
+    inertias = np.log(np.maximum(np.asarray(inertias, dtype=float), np.finfo(float).tiny))
+    if len(k_values) < 3 or inertias.max() == inertias.min():
+        return None, False
+    x_scaled = (k_values - k_values[0]) / (k_values[-1] - k_values[0])
+    y_scaled = (inertias - inertias.min()) / (inertias.max() - inertias.min())
+    difference = 1 - x_scaled - y_scaled
+
+    threshold_step = sensitivity * float(np.mean(np.diff(x_scaled)))
+    maxima = [index for index in range(1, len(difference) - 1)
+              if difference[index - 1] <= difference[index] >= difference[index + 1]]
+    for number, index in enumerate(maxima):
+        # Bestätigt, wenn die Kurve vor dem nächsten lokalen Maximum unter die Schwelle fällt
+        end = maxima[number + 1] if number + 1 < len(maxima) else len(difference)
+        if np.any(difference[index + 1:end] < difference[index] - threshold_step):
+            return int(k_values[index]), True
+    return int(k_values[int(np.argmax(difference))]), False
+
+
+class KneeTracker:
+    """
+    Follows the knee of an ascending sweep while the inertias arrive, in any
+    order: the knee is searched on the contiguous k values from k_min on.
+    The sweep may stop once the knee is confirmed, did not change while
+    ELBOW_PATIENCE further k values were added and the curve has flattened
+    after it.
+    """
+
+    def __init__(self, k_min, patience=ELBOW_PATIENCE, flatness=ELBOW_FLATNESS):
+        self.k_min = k_min
+        self.patience = patience
+        self.flatness = flatness
+        self.inertias = {}
+        # Nur ein bestätigtes Knie wird gemerkt
+        self.knee = None
+        self.stable = 0
+        self.contiguous = k_min - 1
+
+    def add(self, k_value, inertia):
+        """
+        Adds the inertia of one k
+
+        Returns:
+            bool: Whether the sweep can stop
+        """
+        self.inertias[k_value] = inertia
+        while self.contiguous + 1 in self.inertias:
+            self.contiguous += 1
+            k_values = list(range(self.k_min, self.contiguous + 1))
+            knee, confirmed = find_knee(k_values, [self.inertias[k] for k in k_values])
+            knee = knee if confirmed else None
+            self.stable = self.stable + 1 if knee is not None and knee == self.knee else 0
+            self.knee = knee
+        return self.stopped()
+
+    def stopped(self):
+        """
+        Returns whether the knee is confirmed, stable and followed by a flat curve
+        """
+        if self.knee is None or self.stable < self.patience:
+            return False
+        first, knee, last = np.log(np.maximum([self.inertias[k] for k in (self.k_min, self.knee, self.contiguous)],
+                                              np.finfo(float).tiny))
+        # Ein weiterer starker Abfall nach dem Knie deutet auf ein späteres Knie hin
+        return knee - last <= self.flatness * (first - knee)
+
+
+def geometric_grid(k_min, k_max, ratio=ELBOW_GRID_RATIO):
+    """
+    Returns the coarse grid of k values from k_min to k_max, each about ratio
+    times its predecessor and at least one larger
+    """
+    grid = [k_min]
+    while grid[-1] < k_max:
+        grid.append(min(k_max, max(grid[-1] + 1, int(math.ceil(grid[-1] * ratio)))))
+    return grid
+
+
+def refinement(fitted, knee, k_min, k_max):
+    """
+    Returns the k values between the fitted neighbours of the knee which are not fitted yet
+
+    Args:
+        fitted (list): The fitted k values in ascending order
+        knee (int): The knee of the fitted k values
+    """
+    index = fitted.index(knee)
+    lower = fitted[index - 1] if index > 0 else k_min
+    upper = fitted[index + 1] if index + 1 < len(fitted) else k_max
+    return [k_value for k_value in range(lower + 1, upper) if k_value not in fitted]
@@ -2,24 +2,84 @@
 import os
 import json
 import uuid
-import threading
+import hashlib
+import asyncio
+from contextlib import asynccontextmanager
 from urllib.parse import unquote
-import pandas as pd
+import numpy as np
 import redis
-from fastapi import FastAPI, UploadFile
+from fastapi import FastAPI, UploadFile, Request, Response
 from fastapi.exceptions import HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 import uvicorn
-from app.kmeans_methods import run_kmeans_one_k, run_kmeans_elbow
-from app.utils import read_file, check_parameter
+from app.kmeans_methods import run_kmeans_one_k, run_kmeans_elbow, run_kmeans_minibatch, LEGACY_ALGORITHMS
+from app.utils import check_parameter, spool_upload, hash_upload
+from app.utils import npz_from_result
+from app.results import result_summary, load_rows, result_page, iter_ndjson
+from app.executor import JobExecutor, QueueFullError
+from app.result_cache import ResultCache, cache_key
+from app.datasets import DatasetStore
+from app.models import ModelRegistry
+from app.ingestion import IngestionPool, parse_upload, check_first_chunk, ingest_dataset
+from app.task_store import TaskStore
+from app.notifications import TaskNotifier, wait_for
+from app.job_control import FINAL_STATUSES, STOPPED_STATUSES
 
 REDIS_HOST = os.environ.get('REDIS_HOST', 'localhost')
 REDIS_PORT = os.environ.get('REDIS_PORT', '6379')
 
-app = FastAPI()
+# Longest wait of a long poll of the status endpoint in seconds
+LONG_POLL_MAX_WAIT = float(os.environ.get('LONG_POLL_MAX_WAIT', '30'))
+# Seconds after which an idle event stream sends a comment and re-reads the task
+EVENT_STREAM_KEEPALIVE = float(os.environ.get('EVENT_STREAM_KEEPALIVE', '15'))
+# Upper bound of the rows of one prediction request
+PREDICT_MAX_ROWS = int(os.environ.get('PREDICT_MAX_ROWS', '100000'))
 
 redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
 
+# State of all tasks, shared by every API worker through redis
+task_store = TaskStore(redis_client)
+
+# Wakes up long polls and event streams when their task changes
+notifier = TaskNotifier(REDIS_HOST, REDIS_PORT)
+
+# Bounded redis queue of the clustering jobs and the embedded worker processes
+executor = JobExecutor(redis_client, REDIS_HOST, REDIS_PORT)
+
+# Results of earlier tasks with the same file and parameters
+result_cache = ResultCache(redis_client)
+
+# Cleaned and prepared data of earlier uploads
+dataset_store = DatasetStore()
+
+# Fitted models of the k-means tasks, the most recently used ones in memory
+model_registry = ModelRegistry()
+
+# Bounded pool of processes parsing the uploads off the event loop
+ingestion = IngestionPool()
+
+# Media type of the binary k-means result
+NPZ_MEDIA_TYPE = "application/x-npz"
+# Media type of the streamed k-means result
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+# Media type of the Server-Sent Events of a task
+EVENT_STREAM_MEDIA_TYPE = "text/event-stream"
+
+@asynccontextmanager
+async def lifespan(_app):
+    """
+    Starts the parsing processes, lets the embedded workers drain the job
+    queue and the parsing processes finish when the server shuts down
+    """
+    ingestion.start()
+    yield
+    await run_in_threadpool(ingestion.shutdown)
+    await run_in_threadpool(executor.shutdown)
+
+app = FastAPI(lifespan=lifespan)
+
 # Allow all origins by setting allow_origins to  "*"
 app.add_middleware(
     CORSMiddleware,
@@ -29,26 +89,26 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Dictionary to store tasks, including status and results
-tasks = {}
-
 @app.post("/kmeans/")
-async def kmeans_start(file: UploadFile,
-                       k: int,
-                       number_kmeans_runs: str = 10,
+async def kmeans_start(k: int,
+                       file: UploadFile = None,
+                       number_kmeans_runs: str = "10",
                        max_iterations:int = 300,
                        tolerance: float = 0.0001,
                        init: str = "k-means++",
                        algorithm: str = "lloyd",
                        centroids: str = None,
-                       normalization: str= None):
+                       normalization: str= None,
+                       seed: int = 0,
+                       dataset_id: str = None,
+                       columns: str = None):
     """
     Uploads a json or csv file, performs k-means, and returns the id of the task
 
     Args:
-        Only k and file are mandatory
+        Only k and file (or dataset_id) are mandatory
 
-        file (UploadFile): The uploaded json, csv or xlsx file.
+        file (UploadFile): The uploaded json, ndjson, csv, xlsx, parquet, arrow/feather or npy file.
 
         k (int): The number of clusters
 
@@ -61,37 +121,37 @@ async def kmeans_start(file: UploadFile,
         tolerance (float): The height of the frobenius norm which has to be 
                             fallen below in order for the kmeans algorithm to stop iterating
 
-        init(str) ("k-means++", "random" or "centroids"): 
+        init(str) ("k-means++", "random", "centroids", "k-means||", "subsample" or "coreset"): 
                                     The initialisation method of the centroids. 
                                     k-means++: Automatically choose best initial start centroids;
                                     random: randomly choose startpoint
                                     centroids: Use the provided centroids
+                                    k-means||, subsample: Fast k-means++ for large data
+                                    coreset: Cluster a weighted coreset, then assign every row
 
-        algorithm (str) ("lloyd", "elkan", "auto", "full")
+        algorithm (str) ("lloyd", "elkan", "auto", "full", "minibatch"):
+                                    minibatch: The file is read in chunks and clustered
+                                    with mini-batch k-means, for files which do not fit in memory
 
         Centroids JSON string containing the array of arrays of the initial centroid positions
 
         normalization (str) (None, z, min-max): The normalization method to be used on the data
 
+        seed (int): Seed of the random initialisation, identical requests give identical results
+
+        dataset_id (str): The ID of a dataset returned by an earlier request, used instead of file
+
+        columns (str): Comma separated names of the columns read from file, the other columns
+                       of a parquet, arrow or npy file are never decoded. The columns of a
+                       2-d npy array are named 0, 1, ...
+
     Returns:
         dict: The Id of the task
               If the uploaded file is not a json or csv, an error message is returned.
     """
 
-    result = read_file(file.file, file.filename)
-
-    if isinstance(result, pd.DataFrame):
-        dataframe = result
-    else:
-        raise HTTPException(status_code=400, detail= result)
-
-    if not isinstance(number_kmeans_runs, int):
-        if number_kmeans_runs.isdigit():
-            number_runs = int(number_kmeans_runs)
-        else:
-            number_runs = number_kmeans_runs
-    else:
-        number_runs = number_kmeans_runs
+    number_runs = parse_number_runs(number_kmeans_runs)
+    columns = parse_columns(columns)
 
     if centroids is not None:
         try:
@@ -99,54 +159,72 @@ async def kmeans_start(file: UploadFile,
         except json.JSONDecodeError as exception:
             raise HTTPException(status_code=400, detail= str(exception)) from exception
 
-    error_message = check_parameter(centroids, number_runs, dataframe, k, k, init, algorithm, normalization)
+    # Das Hashen liest die ganze Datei, daher nicht im Event-Loop
+    dataset_id = await run_in_threadpool(resolve_dataset_id, file, dataset_id, columns)
+
+    # Identische Anfragen direkt mit dem zwischengespeicherten Ergebnis beantworten
+    key = cache_key(dataset_id, "one_k", {
+        "k": k, "number_runs": number_runs, "max_iterations": max_iterations, "tolerance": tolerance,
+        "init": init, "algorithm": LEGACY_ALGORITHMS.get(algorithm, algorithm), "centroids": centroids,
+        "normalization": normalization, "seed": seed})
+    cached_task_id = answer_from_cache(key)
+    if cached_task_id is not None:
+        return {"TaskID": cached_task_id, "DatasetID": dataset_id}
+
+    frame, rows, source = await load_upload(file, algorithm, dataset_id, columns)
+
+    error_message = check_parameter(centroids, number_runs, rows, k, k, init, algorithm, normalization)
 
     if error_message != "":
+        discard_upload(source, frame)
         raise HTTPException(status_code=400, detail= error_message)
 
     # Create a unique task ID
     task_id = str(uuid.uuid4())
 
-    # Initialize the task with a "processing" status and an empty results list.
-    tasks[task_id] = {
-        "status": "processing",
-        "method": "one_k",
-        "json_result": {},
-        "json_inertia": {},
-        "message": ""}
-
-    data_upload = {
-        "status": "processing",
-        "method": "one_k"}
+    # Initialize the task with a "queued" status
+    task_store.create(task_id, "one_k", cache_key=key)
 
-    redis_client.hmset(task_id, data_upload)
-    redis_client.expire(task_id,600)
+    # Hand the job to the worker pool
+    try:
+        if source is not None:
+            submit_job(task_id, run_kmeans_minibatch, source,
+                       k, number_runs, max_iterations, tolerance, init, centroids, normalization, seed)
+            return {"TaskID": task_id, "DatasetID": dataset_id}
 
-    # Create a separate thread to run run_kmeans_one_k
-    kmeans_thread = threading.Thread(target=run_kmeans_one_k, args=(
-        redis_client,dataframe, task_id, tasks, k, number_runs, max_iterations, tolerance, init, algorithm, centroids, normalization))
-    kmeans_thread.start()
+        submit_job(task_id, run_kmeans_one_k, frame,
+                   k, number_runs, max_iterations, tolerance, init, algorithm, centroids, normalization, seed,
+                   dataset_id)
+    except HTTPException:
+        discard_upload(source, frame)
+        raise
 
-    return {"TaskID": task_id}
+    return {"TaskID": task_id, "DatasetID": dataset_id}
 
 @app.post("/elbow/")
-async def elbow_start(file: UploadFile,
-                       k_min: int,
+async def elbow_start(k_min: int,
                        k_max: int,
-                       number_kmeans_runs: str = 10,
+                       file: UploadFile = None,
+                       number_kmeans_runs: str = "10",
                        max_iterations:int = 300,
                        tolerance: float = 0.0001,
                        init: str = "k-means++",
                        algorithm: str = "lloyd",
                        centroids: str = None,
-                       normalization: str= None):
+                       normalization: str= None,
+                       warm_start: bool = False,
+                       seed: int = 0,
+                       dataset_id: str = None,
+                       search: str = "full",
+                       scores: bool = False,
+                       columns: str = None):
     """
     Uploads a json or csv file, performs k-means for each k, and returns the id of the task
 
     Args:
-        Only k and file are mandatory
+        Only k and file (or dataset_id) are mandatory
 
-        file (UploadFile): The uploaded json, csv or xlsx file.
+        file (UploadFile): The uploaded json, ndjson, csv, xlsx, parquet, arrow/feather or npy file.
 
         k_min (int): The lowest number of clusters on which kmeans is supposed performed in order to evaluate its inertia
 
@@ -161,11 +239,13 @@ async def elbow_start(file: UploadFile,
         tolerance (float): The height of the frobenius norm which has to be 
                             fallen below in order for the kmeans algorithm to stop iterating
 
-        init(str) ("k-means++", "random" or "centroids"): 
+        init(str) ("k-means++", "random", "centroids", "k-means||", "subsample" or "coreset"): 
                                     The initialisation method of the centroids. 
                                     k-means++: Automatically choose best initial start centroids;
                                     random: randomly choose startpoint
                                     centroids: Use the provided centroids
+                                    k-means||, subsample: Fast k-means++ for large data
+                                    coreset: Cluster a weighted coreset, then assign every row
 
         algorithm (str) ("lloyd", "elkan", "auto", "full"): "lloyd"
 
@@ -174,23 +254,31 @@ async def elbow_start(file: UploadFile,
 
         normalization (str) (None, z, min-max): The normalization method to be used on the data
 
+        warm_start (bool): Start k+1 from the centroids of k plus one k-means++ seeded centroid
+                           instead of fitting every k from scratch in parallel
+
+        seed (int): Seed of the random initialisation, identical requests give identical results
+
+        dataset_id (str): The ID of a dataset returned by an earlier request, used instead of file
+
+        search (str) ("full", "early-stop", "coarse-to-fine"): "full" fits every k,
+                     "early-stop" stops once the knee of the curve is confirmed,
+                     "coarse-to-fine" fits a geometric grid of k values and refines around its knee.
+                     The knee is returned as recommended_k in every mode.
+
+        scores (bool): Also score every k with the silhouette of a stratified sample,
+                       Davies-Bouldin and Calinski-Harabasz, returned as scores
+
+        columns (str): Comma separated names of the columns read from file, the other columns
+                       of a parquet, arrow or npy file are never decoded. The columns of a
+                       2-d npy array are named 0, 1, ...
+
     Returns:
         dict: The Id of the task
               If the uploaded file is not a json or csv, an error message is returned.
     """
-    result = read_file(file.file, file.filename)
-    if isinstance(result, pd.DataFrame):
-        dataframe = result
-    else:
-        raise HTTPException(status_code=400, detail= result)
-
-    if not isinstance(number_kmeans_runs, int):
-        if number_kmeans_runs.isdigit():
-            number_runs = int(number_kmeans_runs)
-        else:
-            number_runs = number_kmeans_runs
-    else:
-        number_runs = number_kmeans_runs
+    number_runs = parse_number_runs(number_kmeans_runs)
+    columns = parse_columns(columns)
 
     if centroids is not None:
         try:
@@ -198,85 +286,583 @@ async def elbow_start(file: UploadFile,
         except json.JSONDecodeError as exception:
             raise HTTPException(status_code=400, detail= str(exception)) from Exception
 
-    error_message = check_parameter(centroids, number_runs, dataframe, k_min, k_max, init, algorithm, normalization)
+    # Das Hashen liest die ganze Datei, daher nicht im Event-Loop
+    dataset_id = await run_in_threadpool(resolve_dataset_id, file, dataset_id, columns)
+
+    # Identische Anfragen direkt mit dem zwischengespeicherten Ergebnis beantworten
+    key = cache_key(dataset_id, "elbow", {
+        "k_min": k_min, "k_max": k_max, "number_runs": number_runs, "max_iterations": max_iterations,
+        "tolerance": tolerance, "init": init, "algorithm": LEGACY_ALGORITHMS.get(algorithm, algorithm),
+        "centroids": centroids, "normalization": normalization, "warm_start": warm_start, "seed": seed,
+        "search": search, "scores": scores})
+    cached_task_id = answer_from_cache(key)
+    if cached_task_id is not None:
+        return {"TaskID": cached_task_id, "DatasetID": dataset_id}
+
+    frame, rows, _ = await load_upload(file, None, dataset_id, columns)
+
+    error_message = check_parameter(centroids, number_runs, rows, k_min, k_max, init, algorithm, normalization,
+                                    search)
 
     if error_message != "":
+        discard_upload(None, frame)
         raise HTTPException(status_code=400, detail= error_message)
 
     # Create a unique task ID
     task_id = str(uuid.uuid4())
 
-    # Initialize the task with a "processing" status and an empty results list
-    tasks[task_id] = {
-        "status": "processing",
-        "method": "elbow",
-        "json_result": {},
-        "json_inertia": {},
-        "message": ""}
-
-    data_upload = {
-        "status": "processing",
-        "method": "elbow",
-  }
-
-    redis_client.hmset(task_id,data_upload)
-
-    # Create a separate thread to run run_kmeans_one_k
-    kmeans_elbow_thread = threading.Thread(target=run_kmeans_elbow, args=(
-        redis_client, dataframe, task_id, tasks, k_min, k_max, number_runs, max_iterations, tolerance, init, algorithm, centroids, normalization))
-    kmeans_elbow_thread.start()
+    # Initialize the task with a "queued" status
+    task_store.create(task_id, "elbow", cache_key=key)
+
+    # Hand the job to the worker pool
+    try:
+        submit_job(task_id, run_kmeans_elbow, frame,
+                   k_min, k_max, number_runs, max_iterations, tolerance, init, algorithm, centroids, normalization,
+                   warm_start, seed, dataset_id, search, scores)
+    except HTTPException:
+        discard_upload(None, frame)
+        raise
     # Convert the DataFrame to a JSON-serializable format
-    return {"TaskID": task_id}
+    return {"TaskID": task_id, "DatasetID": dataset_id}
+
+def parse_number_runs(number_kmeans_runs):
+    """
+    Converts number_kmeans_runs to an int if it consists of digits
+    """
+    if not isinstance(number_kmeans_runs, int):
+        if number_kmeans_runs.isdigit():
+            return int(number_kmeans_runs)
+    return number_kmeans_runs
+
+def answer_from_cache(key):
+    """
+    Creates an already completed task if the result of key is cached
+
+    Returns:
+        str: The ID of the new task, or None on a cache miss
+    """
+    fields = result_cache.lookup(key)
+    # Die Datenpunkte des Ergebnisses liegen im Dataset-Speicher, das Modell in der Modell-Registry
+    if fields is None or ("dataset_id" in fields and
+                          not dataset_store.exists(fields["dataset_id"], spooled="data_source" in fields)):
+        return None
+    if "model_id" in fields and not model_registry.exists(fields["model_id"]):
+        return None
+
+    task_id = str(uuid.uuid4())
+    method = fields.pop("method")
+    task_store.create(task_id, method, status="completed", cache_key=key,
+                      message="Result served from cache. ", **fields)
+    return task_id
+
+def parse_columns(columns):
+    """
+    Splits the comma separated columns parameter, None selects all columns
+    """
+    if columns is None:
+        return None
+    return [column.strip() for column in unquote(columns).split(",") if column.strip()] or None
+
+def resolve_dataset_id(file, dataset_id, columns=None):
+    """
+    Returns the dataset ID of a request: the sha256 of the uploaded file,
+    or the given dataset_id if no file is uploaded.
+    A selection of columns of a file is a dataset of its own.
+    """
+    if file is not None:
+        file_hash = hash_upload(file.file)
+        if columns is None:
+            return file_hash
+        return hashlib.sha256(json.dumps([file_hash, columns]).encode("utf-8")).hexdigest()
+    if columns is not None:
+        raise HTTPException(status_code=400, detail="Columns can only be selected from an uploaded file.")
+    if dataset_id is None:
+        raise HTTPException(status_code=400, detail="Either a file or a dataset_id is required.")
+    if not dataset_id.isalnum():
+        raise HTTPException(status_code=400, detail="Invalid dataset_id.")
+    return dataset_id
+
+async def load_upload(file, algorithm, dataset_id, columns=None):
+    """
+    Reads an upload. If the dataset was already prepared by an earlier job,
+    the file is not parsed again; a dataset only stored as the upload of a
+    mini-batch job is read from a copy of that upload. For mini-batch jobs
+    the file is only spooled to disk and read later in chunks, here only its
+    first chunk is checked.
+    The file is spooled to disk in a thread and parsed by the ingestion pool,
+    so the event loop keeps serving other requests meanwhile.
+
+    Returns:
+        tuple: (path of the pickled frame or None, number of rows, spooled upload or None)
+    """
+    stored = None
+    if file is None and not dataset_store.exists(dataset_id):
+        stored, _ = dataset_store.load_spooled(dataset_id)
+    if stored is None and (file is None or (algorithm != "minibatch" and dataset_store.exists(dataset_id))):
+        info = dataset_store.info(dataset_id)
+        if info is None:
+            raise HTTPException(status_code=404, detail="Dataset not found")
+        return None, info["rows"], None
+
+    if stored is not None:
+        source = await run_in_threadpool(copy_stored_upload, stored)
+    else:
+        source = await run_in_threadpool(spool_upload, file.file, file.filename)
+        source["columns"] = columns
+    # Unter dem Hash wird eine konvertierte Arbeitsmappe wiederverwendet
+    source["dataset_id"] = dataset_id
+    if algorithm == "minibatch":
+        try:
+            result = await ingest(check_first_chunk, source)
+        except HTTPException:
+            discard_upload(source)
+            raise
+    else:
+        # Nach dem Parsen wird nur noch der gepickelte Frame gebraucht
+        try:
+            result = await ingest(parse_upload, source)
+        finally:
+            discard_upload(source)
+        source = None
+
+    if "error" in result:
+        discard_upload(source)
+        raise HTTPException(status_code=400, detail= result)
+    return result.get("frame"), result["rows"], source
+
+def copy_stored_upload(stored):
+    """
+    Spools a copy of the upload a mini-batch job moved into the dataset store,
+    the job which reads it removes or moves its spooled file
+
+    Raises:
+        HTTPException: If the dataset was removed in the meantime
+    """
+    try:
+        with open(stored["path"], "rb") as file:
+            source = spool_upload(file, stored["filename"])
+    except FileNotFoundError as exception:
+        raise HTTPException(status_code=404, detail="Dataset not found") from exception
+    source["columns"] = stored["columns"]
+    return source
+
+async def ingest(function, *args):
+    """
+    Runs a parsing function of app.ingestion in the ingestion pool,
+    answers with 503 and Retry-After if too many uploads are being read
+    """
+    try:
+        return await ingestion.run(function, *args)
+    except QueueFullError as exception:
+        raise HTTPException(status_code=503, detail=str(exception),
+                            headers={"Retry-After": str(exception.retry_after)}) from exception
+
+def discard_upload(source, frame=None):
+    """
+    Removes an upload which was spooled to disk for a streaming job and
+    the pickled frame of a parsed upload
+    """
+    if source is not None:
+        os.remove(source["path"])
+    if frame is not None:
+        os.remove(frame)
+
+def submit_job(task_id, target, dataframe, *args):
+    """
+    Admits a job to the executor, answers with 503 and Retry-After if the queue is full
+    """
+    try:
+        executor.submit(task_id, target, dataframe, *args)
+    except QueueFullError as exception:
+        task_store.delete(task_id)
+        raise HTTPException(status_code=503, detail=str(exception),
+                            headers={"Retry-After": str(exception.retry_after)}) from exception
 
 
 
 @app.get("/kmeans/status/{task_id}")
-async def get_task_status(task_id: str):
+async def get_task_status(task_id: str, wait: float = 0):
     """
     Returns the current status of a task
 
     Args:
         task_id: The ID of the task
+        wait (float): Long poll: answer only when the status changes, at the latest
+                      after wait seconds (at most LONG_POLL_MAX_WAIT)
         
     Returns:
-        dict: A dictionary with the status of the task.
+        dict: A dictionary with the status of the task
+              and its position in the queue while it is waiting.
+              For running tasks the progress (run out of n_init, iteration,
+              inertia, centroid shift, elbow k values done) is included,
+              for running elbow tasks also the inertias computed so far.
+    """
+    task = task_store.get(task_id)
+    if task is not None and wait > 0 and task["status"] not in FINAL_STATUSES:
+        task = await wait_for_status_change(task_id, task["status"], min(wait, LONG_POLL_MAX_WAIT))
+    if task is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    if task["status"] == "Bad Request":
+        raise HTTPException(status_code=400, detail= task["message"])
+    return status_payload(task_id, task)
+
+async def wait_for_status_change(task_id, status, timeout):
+    """
+    Waits until the status of a task differs from status or timeout seconds passed
+
+    Returns:
+        dict: The task, None if it was removed
     """
-    task_status=redis_client.hget(task_id,'status')
-    if task_status is None:
+    deadline = asyncio.get_running_loop().time() + timeout
+    async with notifier.watch(task_id, status_only=True) as changed:
+        while True:
+            # Erst nach dem Anmelden lesen, damit keine Änderung verloren geht
+            task = task_store.get(task_id)
+            remaining = deadline - asyncio.get_running_loop().time()
+            if task is None or task["status"] != status or remaining <= 0:
+                return task
+            await wait_for(changed, remaining)
+
+@app.get("/kmeans/events/{task_id}")
+async def get_task_events(task_id: str):
+    """
+    Streams the status of a task as Server-Sent Events
+
+    Every change of the status or the progress is sent as an event "status"
+    with the payload of /kmeans/status/{task_id}; the stream ends after the
+    task is completed or stopped, or with an event "error" if the task failed.
+    One stream replaces the polling of the status endpoint.
+
+    Args:
+        task_id: The ID of the task
+    """
+    if task_store.get(task_id) is None:
         raise HTTPException(status_code=404, detail="Task not found")
-    if task_status == "Bad Request":
-        raise HTTPException(status_code=400, detail= tasks[task_id]["message"])
-    return {"status": task_status}
+    return StreamingResponse(iter_task_events(task_id), media_type=EVENT_STREAM_MEDIA_TYPE,
+                             headers={"Cache-Control": "no-cache"})
+
+def status_payload(task_id, task):
+    """
+    Returns the status of a task with its position in the queue while it is waiting,
+    and its progress and the inertias of an elbow task computed so far while it is running.
+    Elbow tasks carry the knee of their inertias so far as recommended_k,
+    and while they are running their scores so far, if requested.
+    Stopped tasks (cancelled, timeout, out of memory) carry the reason in "message".
+    """
+    payload = {"status": task["status"]}
+    if task["status"] in STOPPED_STATUSES:
+        payload["message"] = task["message"]
+        return payload
+    # Die Warteschlange liegt in redis, jeder API-Worker kennt die Position
+    queue_position = executor.queue_position(task_id)
+    if queue_position is not None:
+        payload["queue_position"] = queue_position
+    elif task["status"] != "completed":
+        if "progress" in task:
+            payload["progress"] = json.loads(task["progress"])
+        if task["method"] == "elbow" and "inertia_values" in task:
+            payload["inertia_values"] = json.loads(task["inertia_values"])
+        if task["method"] == "elbow" and "scores" in task:
+            payload["scores"] = json.loads(task["scores"])
+    if "recommended_k" in task:
+        payload["recommended_k"] = int(task["recommended_k"])
+    return payload
+
+async def iter_task_events(task_id):
+    """
+    Yields an event whenever the status payload of a task changes; the task
+    is only read again when a write of it is announced, or after
+    EVENT_STREAM_KEEPALIVE seconds together with a keep-alive comment
+    """
+    last = None
+    async with notifier.watch(task_id) as changed:
+        while True:
+            task = task_store.get(task_id)
+            if task is None or task["status"] == "Bad Request":
+                detail = "Task not found" if task is None else task["message"]
+                yield f"event: error\ndata: {json.dumps({'detail': detail})}\n\n"
+                return
+            payload = status_payload(task_id, task)
+            if payload != last:
+                last = payload
+                yield f"event: status\ndata: {json.dumps(payload)}\n\n"
+            if task["status"] in FINAL_STATUSES:
+                return
+            if not await wait_for(changed, EVENT_STREAM_KEEPALIVE):
+                yield ": keep-alive\n\n"
+
+@app.delete("/kmeans/{task_id}")
+async def cancel_task(task_id: str):
+    """
+    Cancels a task. A waiting job is removed from the queue, a running job
+    stops at its next checkpoint and its task gets the status "cancelled".
+
+    Args:
+        task_id: The ID of the task
+
+    Returns:
+        dict: The ID and the status of the task, "cancelled" or "cancelling" while the job stops
+    """
+    task = task_store.get(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    if task["status"] in FINAL_STATUSES:
+        raise HTTPException(status_code=409, detail="The task is already finished.")
+
+    if executor.cancel(task_id):
+        task_store.append_message(task_id, "The task was cancelled. ", status="cancelled")
+        return {"TaskID": task_id, "status": "cancelled"}
+    # Der Worker liest die Anfrage mit seinem Heartbeat und stoppt am nächsten Prüfpunkt
+    task_store.update(task_id, cancel_requested=1)
+    return {"TaskID": task_id, "status": "cancelling"}
+
+@app.post("/datasets/")
+async def dataset_upload(file: UploadFile, columns: str = None):
+    """
+    Ingests and validates an uploaded file once, later jobs refer to it by its dataset_id
+
+    Args:
+        file (UploadFile): The uploaded json, ndjson, csv, xlsx, parquet, arrow/feather or npy file.
+
+        columns (str): Comma separated names of the columns read from file
+
+    Returns:
+        dict: The ID of the dataset with its shape, columns and dtypes
+    """
+    file.file.seek(0, os.SEEK_END)
+    if file.file.tell() > dataset_store.max_bytes:
+        raise HTTPException(status_code=413, detail="The file exceeds the dataset quota.")
+
+    columns = parse_columns(columns)
+    dataset_id = await run_in_threadpool(resolve_dataset_id, file, None, columns)
+    if not dataset_store.exists(dataset_id):
+        source = await run_in_threadpool(spool_upload, file.file, file.filename)
+        source["dataset_id"] = dataset_id
+        source["columns"] = columns
+        try:
+            result = await ingest(ingest_dataset, source, dataset_id)
+        finally:
+            discard_upload(source)
+        if "error" in result:
+            raise HTTPException(status_code=400, detail= result["error"])
+    return dataset_summary(dataset_id)
+
+@app.get("/datasets/{dataset_id}")
+async def get_dataset(dataset_id: str):
+    """
+    Returns the shape, columns and dtypes of a stored dataset
+    """
+    return dataset_summary(dataset_id)
+
+@app.delete("/datasets/{dataset_id}")
+async def delete_dataset(dataset_id: str):
+    """
+    Removes a stored dataset
+    """
+    if not dataset_id.isalnum() or not dataset_store.delete(dataset_id):
+        raise HTTPException(status_code=404, detail="Dataset not found")
+    return {"DatasetID": dataset_id}
+
+def dataset_summary(dataset_id):
+    """
+    Returns the description of a stored dataset
+
+    Raises:
+        HTTPException: If the dataset is not stored
+    """
+    info = dataset_store.info(dataset_id) if dataset_id.isalnum() else None
+    if info is None:
+        raise HTTPException(status_code=404, detail="Dataset not found")
+    return {
+        "DatasetID": dataset_id,
+        "shape": [info["rows"], len(info["columns"])],
+        "columns": info["columns"],
+        "dtypes": info["dtypes"],
+        "bytes": info["bytes"]}
+
+@app.post("/predict/{model_id}")
+async def predict(model_id: str, request: Request):
+    """
+    Assigns new rows to the clusters of a fitted model
+
+    The body is a JSON list of rows, or {"data_points": [...]} like a json upload.
+    A row is an object with the columns of the uploaded file or a list with a value
+    for every column of the file. The rows are cleaned, encoded and normalized like
+    the data of the model; rows with missing or invalid values get the label -1.
+
+    Returns:
+        dict: The model ID, the nearest centroid of every row as "labels" and
+              the Euclidean distance to it as "distances" (null for label -1)
+    """
+    body = await request.body()
+    content = await run_in_threadpool(predict_rows, model_id, body)
+    return Response(content=content, media_type="application/json")
+
+def predict_rows(model_id, body):
+    """
+    Parses the rows of a prediction request and assigns them with the model
+
+    Returns:
+        str: The serialised answer of /predict/
+
+    Raises:
+        HTTPException: If the model is not stored or the rows are invalid
+    """
+    model = model_registry.load(model_id) if model_id.isalnum() else None
+    if model is None:
+        raise HTTPException(status_code=404, detail="Model not found")
+    try:
+        rows = json.loads(body)
+    except ValueError as exception:
+        raise HTTPException(status_code=400, detail="Invalid JSON: " + str(exception)) from exception
+    if isinstance(rows, dict):
+        rows = rows.get("data_points")
+    if not isinstance(rows, list):
+        raise HTTPException(status_code=400, detail="Expected a list of rows.")
+    if len(rows) > PREDICT_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"At most {PREDICT_MAX_ROWS} rows per request.")
+    try:
+        labels, distances = model.predict(rows)
+    except ValueError as exception:
+        raise HTTPException(status_code=400, detail=str(exception)) from exception
+    # NaN ist kein gültiges JSON
+    distances = np.where(np.isnan(distances), None, distances).tolist()
+    return json.dumps({"ModelID": model_id, "labels": labels.tolist(), "distances": distances},
+                      separators=(",", ":"))
+
+@app.get("/models/{model_id}")
+async def get_model(model_id: str):
+    """
+    Returns the number of clusters, the columns and the normalization of a model
+    """
+    model = await run_in_threadpool(model_registry.load, model_id) if model_id.isalnum() else None
+    if model is None:
+        raise HTTPException(status_code=404, detail="Model not found")
+    return {"ModelID": model_id, **model.info()}
+
+@app.delete("/models/{model_id}")
+async def delete_model(model_id: str):
+    """
+    Removes a stored model
+    """
+    if not model_id.isalnum() or not model_registry.delete(model_id):
+        raise HTTPException(status_code=404, detail="Model not found")
+    return {"ModelID": model_id}
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+    """
+    Returns the hit and miss counters and the size of the result cache
+    """
+    return result_cache.stats()
 
 @app.get("/kmeans/result/{task_id}")
-async def get_task_result(task_id: str):
+async def get_task_result(task_id: str,
+                          request: Request,
+                          view: str = None,
+                          cluster: int = None,
+                          offset: int = 0,
+                          limit: int = None):
     """
     Gets the results of the k-means method
 
+    Clients sending "Accept: application/x-npz" receive the labels (int32)
+    and centroids of a k-means task as npz file, clients sending
+    "Accept: application/x-ndjson" a stream with one line per data point,
+    all others the JSON with the data points per cluster.
+
     Args:
         task_id: The ID of the regarded task
+        view (str) (None, "summary"): "summary" returns only the centroids, cluster sizes, inertia and model_id,
+                                      for an elbow task the inertias together with recommended_k
+                                      and the scores, if requested
+        cluster (int): Only return this cluster
+        offset (int): Index of the first returned data point per cluster
+        limit (int): Maximum number of returned data points per cluster
         
     Returns:
         array: An array with the results of the task.
     """
 
-    task_status = redis_client.hget(task_id,'status')
-    if task_status is None:
+    task = task_store.get(task_id)
+    if task is None:
         raise HTTPException(status_code=404, detail="Task not found")
 
-    if task_status != "completed":
-        if task_status == "Bad Request":
-            raise HTTPException(status_code=400, detail= tasks[task_id]["message"])
+    if task["status"] != "completed":
+        if task["status"] == "Bad Request" or task["status"] in STOPPED_STATUSES:
+            raise HTTPException(status_code=400, detail= task["message"])
         raise HTTPException(status_code=400, detail="Task result not available yet")
 
-    task_method = redis_client.hget(task_id,'method')
+    task_method = task["method"]
 
     if task_method == "one_k":
-        task_result = redis_client.hget(task_id,'json_result')
-        return json.loads(task_result)
+        if view not in (None, "summary"):
+            raise HTTPException(status_code=400, detail="Invalid view.")
+        if offset < 0 or (limit is not None and limit < 0):
+            raise HTTPException(status_code=400, detail="offset and limit must not be negative.")
+        return await one_k_result(task, request.headers.get("accept", ""),
+                                  view, cluster, offset, limit)
     if task_method == "elbow":
-        task_inertias = redis_client.hget(task_id,'inertia_values')
-        return json.loads(task_inertias)
+        if view not in (None, "summary"):
+            raise HTTPException(status_code=400, detail="Invalid view.")
+        inertia_values = json.loads(task["inertia_values"])
+        if view == "summary":
+            recommended_k = int(task["recommended_k"]) if "recommended_k" in task else None
+            summary = {"inertia_values": inertia_values, "recommended_k": recommended_k}
+            if "scores" in task:
+                summary["scores"] = json.loads(task["scores"])
+            return summary
+        return inertia_values
+
+async def one_k_result(result, accept, view, cluster, offset, limit):
+    """
+    Returns the result of a k-means task in the requested view and media type
+    """
+    if view == "summary":
+        return result_summary(result)
+    if NPZ_MEDIA_TYPE in accept:
+        return Response(content=npz_from_result(result["result_npz"]), media_type=NPZ_MEDIA_TYPE,
+                        headers={"Vary": "Accept"})
+    if NDJSON_MEDIA_TYPE in accept:
+        rows = await run_in_threadpool(load_task_rows, result)
+        return StreamingResponse(iter_ndjson(rows), media_type=NDJSON_MEDIA_TYPE,
+                                 headers={"Vary": "Accept"})
+    if cluster is not None or offset > 0 or limit is not None:
+        rows = await run_in_threadpool(load_task_rows, result)
+        if cluster is not None and cluster not in rows.clusters():
+            raise HTTPException(status_code=404, detail="Cluster not found")
+        return await run_in_threadpool(result_page, rows, cluster, offset, limit)
+    if "json_result" in result:
+        # Bereits serialisiert, ohne erneutes Parsen ausliefern
+        content = result["json_result"]
+    else:
+        content = await run_in_threadpool(result_to_json, result)
+    return Response(content=content, media_type="application/json", headers={"Vary": "Accept"})
+
+def load_task_rows(result):
+    """
+    Returns the reader of the data points of a k-means task
+
+    Raises:
+        HTTPException: If the dataset was removed in the meantime
+    """
+    rows = load_rows(result, dataset_store)
+    if rows is None:
+        raise HTTPException(status_code=410, detail="The dataset of this result was removed, "
+                                                    "only the npz result is available.")
+    return rows
+
+def result_to_json(result):
+    """
+    Builds the JSON result of a k-means task from its labels
+    and the data points in the dataset store
+
+    Raises:
+        HTTPException: If the dataset was removed in the meantime
+    """
+    page = result_page(load_task_rows(result))
+    return json.dumps({"Cluster": [{"centroids": entry["centroids"], "data_points": entry["data_points"]}
+                                   for entry in page["Cluster"]]}, separators=(",", ":"))
 
 if __name__ == '__main__':
     uvicorn.run(app, host="0.0.0.0", port=5000)
@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+"""
+Module storing fitted k-means models and assigning new rows to their clusters
+"""
+import os
+import time
+import uuid
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import scipy.sparse
+from app.kmeans_engine import KMEANS_BLOCK_BYTES
+
+MODEL_DIR = os.environ.get('MODEL_DIR', os.path.join(tempfile.gettempdir(), 'kmeans-models'))
+# Number of models every process keeps in memory, the least recently used ones are dropped first
+MODEL_CACHE_SIZE = int(os.environ.get('MODEL_CACHE_SIZE', '32'))
+# Seconds after which an unused model is removed from disk
+MODEL_TTL = int(os.environ.get('MODEL_TTL', str(7 * 86400)))
+# Upper bound of the disk space of all models, the least recently used ones are removed first
+MODEL_MAX_BYTES = int(os.environ.get('MODEL_MAX_BYTES', str(1024 * 1024 * 1024)))
+
+
+def nearest_centroids(matrix, cluster_centers, center_norms=None, block_bytes=KMEANS_BLOCK_BYTES):
+    """
+    Assigns every row of a matrix to its nearest centroid. The squared distances
+    are computed block by block as ||x||² - 2x·c + ||c||², one matrix product
+    per block; CSR rows stay sparse.
+
+    Args:
+        matrix (np.ndarray or CSR matrix): The prepared rows
+        cluster_centers (np.ndarray): The centroids
+        center_norms (np.ndarray): The squared norms of the centroids, computed if None
+
+    Returns:
+        tuple: (labels as int32, Euclidean distances to the nearest centroid)
+    """
+    centers = np.asarray(cluster_centers, dtype=float)
+    if center_norms is None:
+        center_norms = np.einsum("ij,ij->i", centers, centers)
+    scaled = -2 * centers.T
+    length = matrix.shape[0]
+    rows = max(64, block_bytes // (8 * (matrix.shape[1] + len(centers))))
+    labels = np.empty(length, dtype=np.int32)
+    distances = np.empty(length)
+    for start in range(0, length, rows):
+        block = matrix[start:start + rows]
+        if scipy.sparse.issparse(block):
+            norms = np.asarray(block.multiply(block).sum(axis=1)).ravel()
+        else:
+            block = np.asarray(block, dtype=float)
+            norms = np.einsum("ij,ij->i", block, block)
+        products = np.asarray(block @ scaled)
+        products += center_norms
+        nearest = np.argmin(products, axis=1)
+        labels[start:start + len(nearest)] = nearest
+        distances[start:start + len(nearest)] = products[np.arange(len(nearest)), nearest] + norms
+    # Rundungsfehler können kleine negative Quadrate ergeben
+    np.maximum(distances, 0, out=distances)
+    return labels, np.sqrt(distances, out=distances)
+
+
+class KMeansModel:
+    """
+    A fitted k-means model: its centroids and the fitted StreamingPreparation
+    (column types, encoder and scalers) of the data it was fitted on, so new
+    rows are cleaned, encoded and normalized exactly like that data.
+    """
+
+    def __init__(self, cluster_centers, preparation):
+        self.cluster_centers = np.ascontiguousarray(cluster_centers, dtype=float)
+        self.center_norms = np.einsum("ij,ij->i", self.cluster_centers, self.cluster_centers)
+        self.preparation = preparation
+        self.created = time.time()
+
+    @property
+    def columns(self):
+        """
+        The columns of the uploaded file, in their order
+        """
+        return list(self.preparation.types)
+
+    @property
+    def used_columns(self):
+        """
+        The columns the model uses, the others were dropped during the preparation
+        """
+        return [column for column, entry in self.preparation.types.items() if entry["type"] != "dropped"]
+
+    def frame(self, rows):
+        """
+        Builds the dataframe of a batch of raw rows: objects are matched to the
+        columns of the uploaded file by name, lists by position. Dropped and
+        unknown columns are ignored.
+
+        Args:
+            rows (list): Objects or lists, e.g. parsed from JSON
+
+        Raises:
+            ValueError: If a row has the wrong type or length, or a used column is missing
+        """
+        used = self.used_columns
+        if all(isinstance(row, dict) for row in rows):
+            frame = pd.DataFrame.from_records(rows)
+            # Namen aus JSON sind immer Strings, die Spalten einer Datei auch Zahlen
+            missing = [str(column) for column in used if str(column) not in frame.columns]
+            if missing:
+                raise ValueError("Missing columns: " + ", ".join(missing))
+            frame = frame[[str(column) for column in used]]
+            frame.columns = used
+            return frame
+        if all(isinstance(row, list) for row in rows):
+            columns = self.columns
+            if any(len(row) != len(columns) for row in rows):
+                raise ValueError(f"Every row needs {len(columns)} values: " + ", ".join(map(str, columns)))
+            return pd.DataFrame(rows, columns=columns)[used]
+        raise ValueError("The rows have to be either objects or lists.")
+
+    def predict(self, rows):
+        """
+        Assigns a batch of raw rows to the nearest centroids
+
+        Args:
+            rows (list or pd.DataFrame): The rows, see frame, or a dataframe with the used columns
+
+        Returns:
+            tuple: (labels, -1 for rows with missing or invalid values or categories
+                    the model has not seen, Euclidean distances to the nearest centroid, NaN for those rows)
+        """
+        frame = rows[self.used_columns] if isinstance(rows, pd.DataFrame) else self.frame(rows)
+        frame = frame.reset_index(drop=True)
+        labels = np.full(len(frame), -1, dtype=np.int32)
+        distances = np.full(len(frame), np.nan)
+        cleaned, matrix = self.preparation.transform(frame)
+        # Unbekannte Kategorien wären von der ersten, weggelassenen Kategorie nicht zu unterscheiden
+        known = ~self.preparation.encoder.unknown(cleaned)
+        if not known.all():
+            matrix = matrix[known]
+        if matrix.shape[0] > 0:
+            # Die bereinigten Zeilen behalten ihre Position im Batch
+            kept = cleaned.index.to_numpy()[known]
+            labels[kept], distances[kept] = nearest_centroids(matrix, self.cluster_centers, self.center_norms)
+        return labels, distances
+
+    def info(self):
+        """
+        Returns the description of the model
+        """
+        return {
+            "k": len(self.cluster_centers),
+            "columns": [str(column) for column in self.columns],
+            "used_columns": [str(column) for column in self.used_columns],
+            "normalization": self.preparation.normalization,
+            "created": self.created,
+        }
+
+
+# pylint: disable=too-many-instance-attributes
+class ModelRegistry:
+    """
+    Fitted models stored under their ID as pickle files on local disk.
+
+    Every process keeps the cache_size most recently used models in memory,
+    so predicting with a hot model neither reads nor unpickles anything.
+    The modification time of a model file is its last use; models unused
+    for ttl seconds are removed when another model is saved, and when all
+    models together grow beyond max_bytes, the least recently used ones.
+    """
+
+    def __init__(self, directory=MODEL_DIR, cache_size=MODEL_CACHE_SIZE, ttl=MODEL_TTL, max_bytes=MODEL_MAX_BYTES):
+        self.directory = directory
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, model_id):
+        """
+        Returns the path of the file of a model
+        """
+        if not model_id.isalnum():
+            raise ValueError("Invalid model ID")
+        return os.path.join(self.directory, model_id + ".pkl")
+
+    def _remember(self, model_id, model):
+        """
+        Puts a model into the in-memory cache and drops the least recently used ones
+        """
+        with self.lock:
+            self.cache[model_id] = model
+            self.cache.move_to_end(model_id)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def save(self, model, model_id=None):
+        """
+        Stores a model under its ID; a model already stored under this ID is only marked as used
+
+        Args:
+            model_id (str): The ID, derived from the request and the centroids, a new one if None
+
+        Returns:
+            str: The model ID
+        """
+        if model_id is None:
+            model_id = uuid.uuid4().hex
+        else:
+            try:
+                # Dasselbe Modell einer wiederholten Anfrage nicht erneut schreiben
+                os.utime(self.path(model_id))
+                self._remember(model_id, model)
+                return model_id
+            except FileNotFoundError:
+                pass
+        os.makedirs(self.directory, exist_ok=True)
+        # Atomar schreiben, andere Prozesse lesen nie halb geschriebene Dateien
+        with tempfile.NamedTemporaryFile(dir=self.directory, delete=False) as tmp:
+            pickle.dump(model, tmp, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp.name, self.path(model_id))
+        self._remember(model_id, model)
+        self.evict(keep=model_id)
+        return model_id
+
+    def load(self, model_id):
+        """
+        Returns a model, from memory if it was used recently, or None if it is not stored
+        """
+        path = self.path(model_id)
+        try:
+            # Markiert das Modell als benutzt und erkennt, ob es ein anderer Prozess gelöscht hat
+            os.utime(path)
+        except FileNotFoundError:
+            with self.lock:
+                self.cache.pop(model_id, None)
+            return None
+        with self.lock:
+            model = self.cache.get(model_id)
+            if model is not None:
+                self.cache.move_to_end(model_id)
+                self.hits += 1
+                return model
+            self.misses += 1
+        try:
+            with open(path, "rb") as file:
+                model = pickle.load(file)
+        except FileNotFoundError:
+            return None
+        self._remember(model_id, model)
+        return model
+
+    def delete(self, model_id):
+        """
+        Removes a model, returns whether it existed
+        """
+        with self.lock:
+            self.cache.pop(model_id, None)
+        try:
+            os.remove(self.path(model_id))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def exists(self, model_id):
+        """
+        Returns whether a model is stored
+        """
+        return os.path.exists(self.path(model_id))
+
+    def evict(self, keep=None):
+        """
+        Removes the models unused for ttl seconds and the least recently used
+        ones until all models fit into max_bytes. The model keep is never removed.
+        """
+        if not os.path.isdir(self.directory):
+            return
+        models = []
+        for entry in os.scandir(self.directory):
+            name, extension = os.path.splitext(entry.name)
+            if extension != ".pkl" or not name.isalnum():
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            models.append((stat.st_mtime, name, stat.st_size))
+
+        # Älteste Modelle zuerst
+        models.sort()
+        total = sum(size for _, _, size in models)
+        expired = time.time() - self.ttl
+        for last_used, model_id, size in models:
+            if model_id == keep:
+                continue
+            if last_used < expired or total > self.max_bytes:
+                self.delete(model_id)
+                total -= size
+
+    def stats(self):
+        """
+        Returns the hit and miss counters and the size of the in-memory cache
+        """
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "cached": len(self.cache),
+                    "cache_size": self.cache_size}
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Module waking up requests which wait for a change of a task
+"""
+import asyncio
+import contextlib
+import redis
+import redis.asyncio
+from app.task_store import TASK_CHANNEL_PREFIX
+
+
+# pylint: disable=too-few-public-methods
+class TaskNotifier:
+    """
+    Every write of the task store is published on the channel of the task.
+    Each API worker holds one pattern subscription to all task channels and
+    sets the events of the requests waiting for that task, so long polls and
+    event streams cost no redis reads while a task does not change.
+    """
+
+    def __init__(self, redis_host, redis_port):
+        self.redis_host = redis_host
+        self.redis_port = redis_port
+        self._waiters = {}
+        self._loop = None
+        self._listener = None
+        self._ready = None
+
+    async def _listen(self, ready):
+        """
+        Receives the announcements of all tasks until the event loop stops
+        """
+        client = redis.asyncio.Redis(host=self.redis_host, port=self.redis_port, decode_responses=True)
+        pubsub = client.pubsub()
+        try:
+            await pubsub.psubscribe(TASK_CHANNEL_PREFIX + "*")
+            async for message in pubsub.listen():
+                if message["type"] == "psubscribe":
+                    ready.set()
+                elif message["type"] == "pmessage":
+                    waiters = self._waiters.get(message["channel"][len(TASK_CHANNEL_PREFIX):], {})
+                    for event, status_only in waiters.items():
+                        # Die Nachricht ist leer, wenn sich nur der Fortschritt geändert hat
+                        if message["data"] or not status_only:
+                            event.set()
+        except redis.exceptions.ConnectionError:
+            # Ohne Verbindung enden die Wartezeiten über ihr Timeout, der nächste Aufruf verbindet neu
+            pass
+        finally:
+            ready.set()
+            await pubsub.aclose()
+            await client.aclose()
+
+    async def _start(self):
+        """
+        Subscribes on first use, and again if the event loop or the connection changed
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._listener.done():
+            self._loop = loop
+            self._ready = asyncio.Event()
+            self._listener = loop.create_task(self._listen(self._ready))
+        await self._ready.wait()
+
+    @contextlib.asynccontextmanager
+    async def watch(self, task_id, status_only=False):
+        """
+        Registers for the changes of a task
+
+        Args:
+            task_id (str): The ID of the task
+            status_only (bool): Ignore writes which do not set the status, e.g. of the progress
+
+        Yields:
+            asyncio.Event: Set on every write of the task, the caller clears it
+        """
+        await self._start()
+        event = asyncio.Event()
+        self._waiters.setdefault(task_id, {})[event] = status_only
+        try:
+            yield event
+        finally:
+            waiters = self._waiters.get(task_id, {})
+            waiters.pop(event, None)
+            if not waiters:
+                self._waiters.pop(task_id, None)
+
+
+async def wait_for(event, timeout):
+    """
+    Waits until event is set or timeout seconds passed and clears it
+
+    Returns:
+        bool: Whether the event was set
+    """
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+    except asyncio.TimeoutError:
+        return False
+    event.clear()
+    return True
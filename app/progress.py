@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Module publishing the progress of running fits to the task store
+"""
+import os
+import json
+import time
+
+# Minimal seconds between two progress writes of a task
+KMEANS_PROGRESS_INTERVAL = float(os.environ.get('KMEANS_PROGRESS_INTERVAL', '0.5'))
+# Lloyd/Elkan iterations of the first segment of a k-means run
+KMEANS_PROGRESS_ITERATIONS = int(os.environ.get('KMEANS_PROGRESS_ITERATIONS', '50'))
+# Seconds the following segments of a run should last
+KMEANS_PROGRESS_SEGMENT = float(os.environ.get('KMEANS_PROGRESS_SEGMENT', '5'))
+
+
+class ProgressReporter:
+    """
+    Collects the progress of a task, e.g. the current run out of n_init,
+    the iteration, the inertia and the centroid shift, and writes it as
+    the JSON field "progress" of the task.
+
+    Reports arrive from the inner loops of the fit, so at most one write
+    per interval seconds reaches redis; flush writes immediately.
+    Every report is also a checkpoint of the job control, if one is given.
+    """
+
+    def __init__(self, task_store, task_id, interval=KMEANS_PROGRESS_INTERVAL, control=None):
+        self.task_store = task_store
+        self.task_id = task_id
+        self.interval = interval
+        self.control = control
+        self.progress = {}
+        self._written = 0.0
+
+    def report(self, **progress):
+        """
+        Updates the progress, written only if the last write is older than interval
+
+        Raises:
+            JobStopped: If the job was cancelled or exceeded its budget
+        """
+        if self.control is not None:
+            self.control.check()
+        self.progress.update(progress)
+        if time.monotonic() - self._written >= self.interval:
+            self.flush()
+
+    def flush(self, **fields):
+        """
+        Writes the progress together with further fields of the task
+        """
+        self._written = time.monotonic()
+        self.task_store.update(self.task_id, progress=json.dumps(self.progress), **fields)
+
+
+class ControlReporter:
+    """
+    A reporter which only checks the job control at every report, for fits
+    whose progress is not written, e.g. the k values of an elbow sweep which
+    run in parallel and report the sweep as a whole
+    """
+
+    def __init__(self, control):
+        self.control = control
+
+    def report(self, **_progress):
+        """
+        Raises:
+            JobStopped: If the job was cancelled or exceeded its budget
+        """
+        self.control.check()
+
+    def flush(self, **_fields):
+        """
+        Writes nothing
+        """
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Module providing a content-addressed cache for clustering results
+"""
+import os
+import json
+import time
+import hashlib
+
+# Upper bound of the size of all cached results, 0 disables the cache
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+# Seconds after which an unused result is removed
+RESULT_CACHE_TTL = int(os.environ.get('RESULT_CACHE_TTL', '3600'))
+
+CACHE_PREFIX = "result-cache:"
+# Task fields which make up the result of a task
+RESULT_FIELDS = ("method", "json_result", "result_npz", "dataset_id", "inertia_values", "recommended_k", "scores",
+                 "inertia", "centroids", "cluster_sizes", "model_id", "data_source")
+
+
+def cache_key(upload_hash, method, parameters):
+    """
+    Builds the cache key of a job from the hash of the upload and the canonical parameters
+
+    Args:
+        upload_hash (str): sha256 of the uploaded bytes
+        method (str): "one_k" or "elbow"
+        parameters (dict): The k-means parameters of the job
+
+    Returns:
+        str: The cache key
+    """
+    canonical = json.dumps({"method": method, **parameters}, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256((upload_hash + canonical).encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    Results of finished tasks stored in redis under the hash of their input.
+
+    The entries expire after RESULT_CACHE_TTL seconds without a hit; when the
+    cached results grow beyond RESULT_CACHE_MAX_BYTES, the least recently
+    used ones are evicted.
+    """
+
+    def __init__(self, redis_client, max_bytes=RESULT_CACHE_MAX_BYTES, ttl=RESULT_CACHE_TTL, prefix=CACHE_PREFIX):
+        self.redis_client = redis_client
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.prefix = prefix
+        self.lru_key = prefix + "lru"
+        self.sizes_key = prefix + "sizes"
+
+    def enabled(self):
+        """
+        Returns whether results are cached at all
+        """
+        return self.max_bytes > 0
+
+    def lookup(self, key):
+        """
+        Returns the cached result fields of a key, or None on a miss
+        """
+        if not self.enabled():
+            return None
+        fields = self.redis_client.hgetall(self.prefix + key)
+        if not fields:
+            self.redis_client.incr(self.prefix + "misses")
+            return None
+
+        pipeline = self.redis_client.pipeline()
+        pipeline.incr(self.prefix + "hits")
+        pipeline.zadd(self.lru_key, {key: time.time()})
+        pipeline.expire(self.prefix + key, self.ttl)
+        pipeline.execute()
+        return fields
+
+    def store(self, key, fields):
+        """
+        Stores the result fields of a finished task and evicts old entries
+        """
+        fields = {name: value for name, value in fields.items() if name in RESULT_FIELDS}
+        size = sum(len(str(value)) for value in fields.values())
+        if not self.enabled() or size > self.max_bytes:
+            return
+
+        pipeline = self.redis_client.pipeline()
+        pipeline.hset(self.prefix + key, mapping=fields)
+        pipeline.expire(self.prefix + key, self.ttl)
+        pipeline.zadd(self.lru_key, {key: time.time()})
+        pipeline.hset(self.sizes_key, key, size)
+        pipeline.execute()
+        self.evict()
+
+    def evict(self):
+        """
+        Removes expired entries from the bookkeeping and the least recently
+        used entries until the cache fits into max_bytes
+        """
+        # Abgelaufene Einträge aus der LRU-Liste entfernen
+        expired = self.redis_client.zrangebyscore(self.lru_key, 0, time.time() - self.ttl)
+        if expired:
+            self._remove(expired)
+
+        sizes = self.redis_client.hgetall(self.sizes_key)
+        total = sum(int(size) for size in sizes.values())
+        if total <= self.max_bytes:
+            return
+
+        victims = []
+        for key in self.redis_client.zrange(self.lru_key, 0, -1):
+            if total <= self.max_bytes:
+                break
+            total -= int(sizes.get(key, 0))
+            victims.append(key)
+        self._remove(victims)
+
+    def _remove(self, keys):
+        """
+        Deletes cache entries together with their bookkeeping
+        """
+        pipeline = self.redis_client.pipeline()
+        pipeline.delete(*[self.prefix + key for key in keys])
+        pipeline.zrem(self.lru_key, *keys)
+        pipeline.hdel(self.sizes_key, *keys)
+        pipeline.execute()
+
+    def stats(self):
+        """
+        Returns the hit and miss counters and the size of the cache
+        """
+        hits, misses = self.redis_client.mget(self.prefix + "hits", self.prefix + "misses")
+        sizes = self.redis_client.hvals(self.sizes_key)
+        return {"hits": int(hits or 0),
+                "misses": int(misses or 0),
+                "entries": len(sizes),
+                "bytes": sum(int(size) for size in sizes)}
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""
+Module reading the stored results of k-means tasks in parts
+"""
+import os
+import io
+import json
+import itertools
+import numpy as np
+from app.datacheck import clean_columns
+from app.utils import JsonStream, iter_file_chunks, result_from_npz
+
+# Number of data points serialised per chunk of a streamed result
+NDJSON_BATCH_ROWS = 1000
+# Maximum number of data points collected during one pass over the spooled upload of a mini-batch result
+RESULT_PASS_ROWS = int(os.environ.get('RESULT_PASS_ROWS', '100000'))
+
+
+def result_summary(result):
+    """
+    Returns the centroids, the cluster sizes and the inertia of a task,
+    which are stored separately from the data points, and the ID of its model
+
+    Args:
+        result (dict): The redis fields of the task
+
+    Returns:
+        dict: The summary
+    """
+    summary = {
+        "centroids": json.loads(result["centroids"]),
+        "cluster_sizes": json.loads(result["cluster_sizes"]),
+        "inertia": float(result["inertia"]),
+    }
+    if "model_id" in result:
+        summary["model_id"] = result["model_id"]
+    return summary
+
+
+def load_rows(result, store):
+    """
+    Returns the reader of the data points of a task
+
+    Args:
+        result (dict): The redis fields of the task
+        store (DatasetStore): The store holding the data points of the task
+
+    Returns:
+        ResultRows: The reader, None if the dataset was removed
+    """
+    labels, centroids = result_from_npz(result["result_npz"])
+    if result.get("data_source") == "spooled":
+        source, types = store.load_spooled(result["dataset_id"])
+        if source is None:
+            return None
+        return ResultRows(labels, centroids, chunks=lambda: iter_cleaned_chunks(source, types))
+    if "dataset_id" in result:
+        cleaned_df = store.load_cleaned(result["dataset_id"])
+        if cleaned_df is None:
+            return None
+        return ResultRows(labels, centroids, cleaned_df=cleaned_df)
+    return ResultRows(labels, centroids, json_result=result["json_result"])
+
+
+class ResultRows:
+    """
+    The data points of a task, read cluster by cluster. The rows of a
+    cluster are selected by their indices in the labels and only these
+    rows are taken from the cleaned data, or from the cleaned chunks of the
+    spooled upload of a mini-batch job; without dataset the stored
+    json_result is read as a stream instead of being parsed at once.
+    """
+
+    def __init__(self, labels, centroids, cleaned_df=None, json_result=None, chunks=None):
+        self.labels = labels
+        self.centroids = centroids
+        self.sizes = np.bincount(labels, minlength=len(centroids))
+        self.cleaned_df = cleaned_df
+        self.json_result = json_result
+        self.chunks = chunks
+
+    def clusters(self):
+        """
+        Returns the non-empty clusters, in the order of the full result
+        """
+        return np.flatnonzero(self.sizes).tolist()
+
+    def iter_rows(self, clusters, offset=0, limit=None, batch_rows=None):
+        """
+        Yields the data points offset to offset + limit of the given clusters,
+        in the order of the full result
+
+        Args:
+            clusters (list): Non-empty clusters in ascending order
+            batch_rows (int): Maximum number of data points per batch, all in one batch if None
+
+        Yields:
+            tuple: (cluster, list of data points), at least one batch per cluster
+        """
+        end = None if limit is None else offset + limit
+        if self.chunks is not None:
+            yield from self._iter_spooled(clusters, offset, end, batch_rows)
+            return
+        if self.cleaned_df is not None:
+            for cluster in clusters:
+                indices = np.flatnonzero(self.labels == cluster)[offset:end]
+                yield from ((cluster, self.cleaned_df.iloc[batch].values.tolist())
+                            for batch in split_batches(indices, batch_rows))
+            return
+        selected = set(clusters)
+        for cluster, data_points in zip(self.clusters(), iter_json_clusters(self.json_result)):
+            if cluster in selected:
+                data_points = itertools.islice(data_points, offset, end)
+                yield from ((cluster, batch) for batch in split_batches(data_points, batch_rows))
+
+    def _iter_spooled(self, clusters, offset, end, batch_rows):
+        """
+        Reads the rows of the clusters from the spooled upload. One pass over
+        the file collects the rows of consecutive clusters up to RESULT_PASS_ROWS
+        data points, the rows of a larger cluster are yielded chunk by chunk
+        during a pass of its own.
+        """
+        for group in self._pass_groups(clusters, offset, end):
+            indices = {cluster: np.flatnonzero(self.labels == cluster)[offset:end] for cluster in group}
+            if len(group) == 1:
+                found = False
+                for cluster, rows in self._read_pass(indices):
+                    found = True
+                    yield from ((cluster, batch) for batch in split_batches(rows, batch_rows))
+                if not found:
+                    yield group[0], []
+                continue
+            collected = {cluster: [] for cluster in group}
+            for cluster, rows in self._read_pass(indices):
+                collected[cluster].extend(rows)
+            for cluster in group:
+                yield from ((cluster, batch) for batch in split_batches(collected[cluster], batch_rows))
+
+    def _pass_groups(self, clusters, offset, end):
+        """
+        Splits the clusters into groups of at most RESULT_PASS_ROWS selected data points,
+        a cluster with more data points forms a group of its own
+        """
+        group, rows = [], 0
+        for cluster in clusters:
+            count = len(range(self.sizes[cluster])[offset:end])
+            if group and rows + count > RESULT_PASS_ROWS:
+                yield group
+                group, rows = [], 0
+            group.append(cluster)
+            rows += count
+        if group:
+            yield group
+
+    def _read_pass(self, indices):
+        """
+        Passes over the cleaned chunks until the last selected row
+
+        Args:
+            indices (dict): cluster -> ascending indices of its selected rows among all cleaned rows
+
+        Yields:
+            tuple: (cluster, list of its selected rows in the current chunk)
+        """
+        last = max((selected[-1] for selected in indices.values() if len(selected) > 0), default=-1)
+        start = 0
+        for cleaned in self.chunks():
+            if start > last:
+                break
+            stop = start + len(cleaned)
+            for cluster, selected in indices.items():
+                first, after = np.searchsorted(selected, [start, stop])
+                if after > first:
+                    yield cluster, cleaned.iloc[selected[first:after] - start].values.tolist()
+            start = stop
+
+
+def iter_cleaned_chunks(source, types):
+    """
+    Iterates over the chunks of a spooled upload, cleaned with the column types of its
+    preparation, so their rows are the rows the labels of the mini-batch job refer to
+    """
+    for chunk in iter_file_chunks(source):
+        yield clean_columns(chunk, types)[0]
+
+
+def split_batches(items, batch_rows):
+    """
+    Splits an array or iterator into lists or arrays of batch_rows items,
+    yields one (possibly empty) batch if batch_rows is None
+    """
+    if isinstance(items, np.ndarray):
+        step = batch_rows or max(len(items), 1)
+        yield from (items[start:start + step] for start in range(0, max(len(items), 1), step))
+        return
+    iterator = iter(items)
+    batch = list(itertools.islice(iterator, batch_rows))
+    yield batch
+    while batch_rows is not None and len(batch) == batch_rows:
+        batch = list(itertools.islice(iterator, batch_rows))
+        if batch:
+            yield batch
+
+
+def iter_json_clusters(json_result):
+    """
+    Iterates over the clusters of a stored json_result without parsing the
+    document at once: yields per cluster an iterator over its data points,
+    whose unread rest is skipped before the next cluster is read
+    """
+    stream = JsonStream(io.BytesIO(json_result.encode("utf-8")))
+    stream.expect("{")
+    while True:
+        name = stream.value()
+        stream.expect(":")
+        if name == "Cluster":
+            break
+        stream.value()
+        stream.expect(",")
+    stream.expect("[")
+    if stream.peek() == "]":
+        return
+    while True:
+        stream.expect("{")
+        while True:
+            name = stream.value()
+            stream.expect(":")
+            if name == "data_points":
+                stream.expect("[")
+                data_points = stream.array_items()
+                yield data_points
+                for _ in data_points:
+                    pass
+            else:
+                stream.value()
+            if stream.expect(",}") == "}":
+                break
+        if stream.expect(",]") == "]":
+            return
+
+
+def result_page(rows, cluster=None, offset=0, limit=None):
+    """
+    Returns a page of the data points of every cluster, or of one cluster
+
+    Args:
+        rows (ResultRows): The data points of the task, as returned by load_rows
+        cluster (int): Only this cluster, all clusters if None
+        offset (int): Index of the first data point per cluster
+        limit (int): Maximum number of data points per cluster, all if None
+
+    Returns:
+        dict: The page, in the shape of the full result plus the cluster number and size
+    """
+    selected = rows.clusters() if cluster is None else [cluster]
+    data_points = {number: [] for number in selected}
+    for number, batch in rows.iter_rows(selected, offset, limit):
+        data_points[number].extend(batch)
+    page = [{"cluster": number,
+             "centroids": rows.centroids[number].tolist(),
+             "size": int(rows.sizes[number]),
+             "data_points": data_points[number]} for number in selected]
+    return {"Cluster": page, "offset": offset, "limit": limit}
+
+
+def iter_ndjson(rows):
+    """
+    Yields the result as newline-delimited JSON, cluster by cluster: per
+    cluster one line with its centroid and size, followed by one line per data point
+
+    Yields:
+        str: Chunks of lines
+    """
+    current = None
+    for cluster, batch in rows.iter_rows(rows.clusters(), batch_rows=NDJSON_BATCH_ROWS):
+        if cluster != current:
+            current = cluster
+            yield json.dumps({"cluster": cluster, "centroids": rows.centroids[cluster].tolist(),
+                              "size": int(rows.sizes[cluster])}) + "\n"
+        yield "".join(json.dumps({"cluster": cluster, "data_point": row}) + "\n" for row in batch)
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+Module scoring a clustering by its labels and centroids: silhouette on a
+stratified sample, Davies-Bouldin and Calinski-Harabasz in O(n·k)
+"""
+import os
+import numpy as np
+import scipy.sparse
+from sklearn import config_context
+from sklearn.metrics import silhouette_samples
+
+# Number of rows the silhouette is computed on, the full silhouette needs O(n²) distances
+SILHOUETTE_SAMPLE = int(os.environ.get('SILHOUETTE_SAMPLE', '10000'))
+# Megabytes of the chunks of pairwise distances of the silhouette
+SILHOUETTE_WORKING_MEMORY = int(os.environ.get('SILHOUETTE_WORKING_MEMORY', '64'))
+# Bytes of the rows of one block of the distances to the centroids
+SCORING_BLOCK_BYTES = int(os.environ.get('SCORING_BLOCK_BYTES', str(8 * 1024 * 1024)))
+
+SCORES = ("silhouette", "davies_bouldin", "calinski_harabasz")
+
+
+def stratified_sample(labels, size, generator):
+    """
+    Draws about size row indices, from every cluster in proportion to its size
+    and at least two rows (if it has them), so small clusters are not lost
+
+    Args:
+        labels (np.ndarray): The cluster of every row
+        generator (np.random.Generator): Random generator
+
+    Returns:
+        np.ndarray: The sorted row indices
+    """
+    rows = len(labels)
+    if size >= rows:
+        return np.arange(rows)
+    # Zufällige Reihenfolge innerhalb jedes Clusters, die Cluster hintereinander
+    order = generator.permutation(rows)
+    order = order[np.argsort(labels[order], kind="stable")]
+    counts = np.bincount(labels)
+    quotas = np.maximum(np.round(counts * size / rows).astype(int), np.minimum(counts, 2))
+    starts = np.cumsum(counts) - counts
+    return np.sort(np.concatenate([order[start:start + quota] for start, quota in zip(starts, quotas)]))
+
+
+def sampled_silhouette(matrix, labels, generator, size=SILHOUETTE_SAMPLE,
+                       working_memory=SILHOUETTE_WORKING_MEMORY):
+    """
+    Returns the mean silhouette of a stratified sample of the rows. The
+    pairwise distances of the sample are computed in chunks of at most
+    working_memory megabytes, so the memory stays bounded for every size.
+
+    Returns:
+        float: The silhouette, None if the sample has fewer than two clusters
+    """
+    indices = stratified_sample(labels, size, generator)
+    sample_labels = labels[indices]
+    clusters = len(np.unique(sample_labels))
+    if clusters < 2 or clusters >= len(indices):
+        return None
+    with config_context(working_memory=working_memory):
+        return float(np.mean(silhouette_samples(matrix[indices], sample_labels)))
+
+
+def squared_distances_to_centers(matrix, labels, centers, block_bytes=SCORING_BLOCK_BYTES):
+    """
+    Returns the squared distance of every row to its centroid, block by block in float64
+    """
+    distances = np.empty(matrix.shape[0])
+    rows = max(1, block_bytes // (8 * matrix.shape[1]))
+    for start in range(0, matrix.shape[0], rows):
+        block = matrix[start:start + rows]
+        own = centers[labels[start:start + rows]]
+        if scipy.sparse.issparse(block):
+            # ||x||² - 2x·c + ||c||², ohne den Block dicht zu machen
+            block = block.astype(np.float64)
+            squared = np.asarray(block.multiply(block).sum(axis=1)).ravel()
+            products = np.asarray(block.multiply(own).sum(axis=1)).ravel()
+            distances[start:start + rows] = np.maximum(squared - 2 * products + np.einsum("ij,ij->i", own, own), 0)
+        else:
+            difference = np.asarray(block, dtype=np.float64) - own
+            distances[start:start + rows] = np.einsum("ij,ij->i", difference, difference)
+    return distances
+
+
+def davies_bouldin(labels, centers, distances):
+    """
+    Davies-Bouldin index from the distances of the rows to their centroids:
+    the mean over the clusters of the largest (s_i + s_j) / d(c_i, c_j),
+    s the mean distance of the members to their centroid; lower is better
+
+    Args:
+        distances (np.ndarray): The squared distance of every row to its centroid
+    """
+    counts = np.bincount(labels, minlength=len(centers))
+    scatter = np.bincount(labels, weights=np.sqrt(distances), minlength=len(centers)) / np.maximum(counts, 1)
+    squared_norms = np.einsum("ij,ij->i", centers, centers)
+    separation = np.sqrt(np.maximum(squared_norms[:, None] - 2 * centers @ centers.T + squared_norms[None], 0))
+    # Zusammenfallende Zentren zählen wie bei sklearn nicht
+    separation[separation == 0] = np.inf
+    ratios = (scatter[:, None] + scatter[None]) / separation
+    np.fill_diagonal(ratios, 0)
+    return float(np.mean(ratios.max(axis=1)))
+
+
+def calinski_harabasz(labels, centers, distances, mean):
+    """
+    Calinski-Harabasz index, the dispersion between the clusters per degree
+    of freedom over the dispersion within; higher is better
+
+    Args:
+        distances (np.ndarray): The squared distance of every row to its centroid
+        mean (np.ndarray): The mean of the rows
+    """
+    rows, k_value = len(labels), len(centers)
+    counts = np.bincount(labels, minlength=k_value)
+    between = float(np.dot(counts, ((centers - mean) ** 2).sum(axis=1)))
+    within = float(distances.sum())
+    if within == 0:
+        return 1.0
+    return between * (rows - k_value) / (within * (k_value - 1))
+
+
+def score_clustering(matrix, labels, centers, random_state=None):
+    """
+    Scores a clustering by its labels and centroids
+
+    Args:
+        matrix (array or CSR matrix): The clustered rows
+        labels (np.ndarray): The cluster of every row
+        centers (np.ndarray): The centroids
+        random_state (int): Seed of the silhouette sample
+
+    Returns:
+        dict: silhouette, davies_bouldin and calinski_harabasz; None for fewer than two clusters
+    """
+    labels = np.asarray(labels, dtype=np.intp)
+    centers = np.asarray(centers, dtype=np.float64)
+    if len(centers) < 2 or len(centers) >= matrix.shape[0]:
+        return dict.fromkeys(SCORES)
+    distances = squared_distances_to_centers(matrix, labels, centers)
+    mean = np.asarray(matrix.mean(axis=0, dtype=np.float64)).ravel()
+    return {"silhouette": sampled_silhouette(matrix, labels, np.random.default_rng(random_state)),
+            "davies_bouldin": davies_bouldin(labels, centers, distances),
+            "calinski_harabasz": calinski_harabasz(labels, centers, distances, mean)}
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Module with fast seedings of k-means for large data: k-means|| and k-means++
+on a subsample, and the lightweight coreset of the coreset mode.
+
+All of them summarize the data once by a small set of weighted rows; the
+centroids of every run out of n_init are then drawn from the summary, so
+the cost of the seeding no longer grows with n_init.
+"""
+import os
+import numpy as np
+import scipy.sparse
+from sklearn.cluster import kmeans_plusplus
+from sklearn.metrics import pairwise_distances_argmin_min
+
+# Number of passes of k-means|| over the data
+KMEANS_PARALLEL_ROUNDS = int(os.environ.get('KMEANS_PARALLEL_ROUNDS', '5'))
+# Expected number of candidates of k-means|| per pass, as multiple of k
+KMEANS_PARALLEL_OVERSAMPLING = float(os.environ.get('KMEANS_PARALLEL_OVERSAMPLING', '2'))
+# Number of rows of the subsample seeded by init="subsample"
+KMEANS_SEED_SAMPLE = int(os.environ.get('KMEANS_SEED_SAMPLE', '10000'))
+# Number of rows drawn for the coreset of init="coreset"
+KMEANS_CORESET_SIZE = int(os.environ.get('KMEANS_CORESET_SIZE', '20000'))
+
+# Seedings whose centroids are drawn from a weighted summary of the data
+SUMMARY_INITS = ("k-means||", "subsample")
+# All values of init besides "centroids"
+INITS = ("k-means++", "random") + SUMMARY_INITS + ("coreset",)
+
+
+def squared_distances_to_mean(data):
+    """
+    Returns the squared distance of every row to the mean of the rows
+    """
+    if scipy.sparse.issparse(data):
+        mean = np.asarray(data.mean(axis=0), dtype=np.float64).ravel()
+        norms = np.asarray(data.multiply(data).sum(axis=1), dtype=np.float64).ravel()
+        return np.maximum(norms - 2 * (data @ mean) + mean @ mean, 0)
+    mean = data.mean(axis=0, dtype=np.float64)
+    distances = np.empty(data.shape[0])
+    rows = max(1, 2 ** 20 // data.shape[1])
+    for start in range(0, data.shape[0], rows):
+        block = data[start:start + rows] - mean
+        distances[start:start + rows] = np.einsum("ij,ij->i", block, block)
+    return distances
+
+
+def kmeans_parallel(data, k_value, generator, rounds=KMEANS_PARALLEL_ROUNDS,
+                    oversampling=KMEANS_PARALLEL_OVERSAMPLING):
+    """
+    k-means|| (Bahmani et al., Scalable K-Means++): every pass draws each row
+    with probability oversampling·k·d²/φ as candidate, where d² is its squared
+    distance to the nearest candidate so far and φ the sum of them. Each pass
+    is one blocked product of all rows with the new candidates instead of
+    k sequential passes of k-means++.
+
+    Args:
+        data (array or CSR matrix): The rows
+        generator (np.random.RandomState): Random generator, see check_random_state
+
+    Returns:
+        tuple: (candidates, weights: number of rows nearest to each candidate)
+    """
+    rows = data.shape[0]
+    indices = [int(generator.randint(rows))]
+    nearest, distances = pairwise_distances_argmin_min(data, data[indices])
+    distances **= 2
+    for _ in range(rounds):
+        total = distances.sum()
+        if total <= 0:
+            break
+        drawn = np.flatnonzero(generator.random_sample(rows) < oversampling * k_value * distances / total)
+        if len(drawn) == 0:
+            continue
+        # Nur die Abstände zu den neuen Kandidaten werden berechnet
+        closest, new_distances = pairwise_distances_argmin_min(data, data[drawn])
+        new_distances **= 2
+        closer = new_distances < distances
+        nearest[closer] = closest[closer] + len(indices)
+        distances[closer] = new_distances[closer]
+        indices += drawn.tolist()
+
+    weights = np.bincount(nearest, minlength=len(indices)).astype(np.float64)
+    if len(indices) < k_value:
+        # Zu wenige Kandidaten, z.B. bei vielen gleichen Zeilen: mit zufälligen Zeilen auffüllen
+        others = np.setdiff1d(np.arange(rows), indices)
+        extra = generator.choice(others, min(k_value - len(indices), len(others)), replace=False)
+        indices += extra.tolist()
+        weights = np.append(weights, np.ones(len(extra)))
+    return data[indices], weights
+
+
+def subsample(data, size, generator):
+    """
+    Draws size rows uniformly without replacement, each standing for rows/size rows
+
+    Returns:
+        tuple: (rows, weights)
+    """
+    rows = data.shape[0]
+    if size >= rows:
+        return data, np.ones(rows)
+    indices = np.sort(generator.choice(rows, size, replace=False))
+    return data[indices], np.full(size, rows / size)
+
+
+def lightweight_coreset(data, size, generator, squared_distances=None):
+    """
+    Lightweight coreset (Bachem et al., Scalable k-Means Clustering via
+    Lightweight Coresets): rows are drawn with probability
+    q = 1/(2n) + d²/(2·Σd²), d² the squared distance to the mean, and
+    weighted with 1/(size·q). The weighted k-means cost of the coreset
+    approximates the cost of the data for every set of centroids.
+
+    Args:
+        squared_distances (np.ndarray): The squared distances of the rows to
+            their mean, computed if None
+
+    Returns:
+        tuple: (rows, weights); rows drawn several times are merged
+    """
+    rows = data.shape[0]
+    if size >= rows:
+        return data, np.ones(rows)
+    if squared_distances is None:
+        squared_distances = squared_distances_to_mean(data)
+    total = float(squared_distances.sum())
+    probabilities = np.full(rows, 0.5 / rows)
+    probabilities += 0.5 * squared_distances / total if total > 0 else 0.5 / rows
+    probabilities /= probabilities.sum()
+    indices, counts = np.unique(generator.choice(rows, size, p=probabilities), return_counts=True)
+    return data[indices], counts / (size * probabilities[indices])
+
+
+def summarize(data, k_value, init, generator):
+    """
+    Returns the weighted summary the centroids of init are drawn from
+
+    Args:
+        init (str): "k-means||" or "subsample"
+
+    Returns:
+        tuple: (rows, weights)
+    """
+    if init == "k-means||":
+        return kmeans_parallel(data, k_value, generator)
+    if init == "subsample":
+        return subsample(data, max(KMEANS_SEED_SAMPLE, k_value), generator)
+    raise ValueError(str(init))
+
+
+def seed_from_summary(summary, k_value, generator):
+    """
+    Draws the initial centroids of one run with weighted k-means++ on a summary
+
+    Returns:
+        np.ndarray: The centroids in float64
+    """
+    points, weights = summary
+    if points.shape[0] < k_value:
+        raise ValueError(f"n_samples={points.shape[0]} should be >= n_clusters={k_value}.")
+    centers, _ = kmeans_plusplus(points, k_value, sample_weight=weights, random_state=generator)
+    return np.asarray(centers, dtype=np.float64)
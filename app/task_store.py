@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Module keeping the state of the clustering tasks in redis
+"""
+import os
+import time
+
+# Seconds a task is kept after its last update
+TASK_TTL = int(os.environ.get('TASK_TTL', '600'))
+
+# Every write of a task is announced on the channel prefix + task ID
+TASK_CHANNEL_PREFIX = "task-events:"
+
+
+class TaskStore:
+    """
+    The lifecycle of every task lives only in redis, in one hash per task:
+    status, method, message, the result fields and the timestamps
+    created_at and updated_at.
+
+    Every write is one pipelined round trip which also renews the TTL,
+    so any API worker or replica sees the same state and finished
+    or abandoned tasks expire ttl seconds after their last update.
+    Appending to the message reads it in a WATCH/MULTI transaction,
+    so concurrent appends are not lost.
+    The job queue renews waiting and running tasks, which are not written.
+    The write is announced on the channel of the task, so waiting
+    requests are woken up instead of polling.
+    """
+
+    def __init__(self, redis_client, ttl=TASK_TTL):
+        self.redis_client = redis_client
+        self.ttl = ttl
+
+    def create(self, task_id, method, status="queued", **fields):
+        """
+        Creates a task
+        """
+        now = time.time()
+        self._write(task_id, {"status": status, "method": method, "message": "",
+                              "created_at": now, "updated_at": now, **fields})
+
+    def update(self, task_id, **fields):
+        """
+        Sets fields of a task
+        """
+        self._write(task_id, {**fields, "updated_at": time.time()})
+
+    def append_message(self, task_id, message, **fields):
+        """
+        Appends to the message of a task and sets further fields in the same write.
+        The message is read under WATCH and written in a MULTI transaction,
+        which is retried if another append changed the task in between
+        """
+        def append(pipeline):
+            current = pipeline.hget(task_id, "message") or ""
+            pipeline.multi()
+            self._queue_write(pipeline, task_id,
+                              {**fields, "message": current + message, "updated_at": time.time()})
+
+        self.redis_client.transaction(append, task_id)
+
+    def fail(self, task_id, message):
+        """
+        Marks a task as failed with an error message
+        """
+        self.append_message(task_id, message, status="Bad Request")
+
+    def get(self, task_id):
+        """
+        Returns all fields of a task, or None if it does not exist
+        """
+        fields = self.redis_client.hgetall(task_id)
+        # Schreibt ein Job noch in eine abgelaufene Task, entsteht ein Hash ohne Status
+        return fields if "status" in fields else None
+
+    def field(self, task_id, name):
+        """
+        Returns one field of a task, or None
+        """
+        return self.redis_client.hget(task_id, name)
+
+    def renew(self, *task_ids):
+        """
+        Renews the TTL of existing tasks without writing them
+        """
+        if not task_ids:
+            return
+        pipeline = self.redis_client.pipeline()
+        for task_id in task_ids:
+            pipeline.expire(task_id, self.ttl)
+        pipeline.execute()
+
+    def delete(self, task_id):
+        """
+        Removes a task
+        """
+        pipeline = self.redis_client.pipeline()
+        pipeline.delete(task_id)
+        pipeline.publish(TASK_CHANNEL_PREFIX + task_id, "deleted")
+        pipeline.execute()
+
+    def _write(self, task_id, fields):
+        """
+        Writes fields and renews the TTL in one round trip
+        """
+        pipeline = self.redis_client.pipeline()
+        self._queue_write(pipeline, task_id, fields)
+        pipeline.execute()
+
+    def _queue_write(self, pipeline, task_id, fields):
+        """
+        Queues the write of fields, the renewal of the TTL and the announcement
+        """
+        pipeline.hset(task_id, mapping=fields)
+        pipeline.expire(task_id, self.ttl)
+        # Die Nachricht enthält den neuen Status, leer wenn er sich nicht ändert
+        pipeline.publish(TASK_CHANNEL_PREFIX + task_id, fields.get("status", ""))
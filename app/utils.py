@@ -3,9 +3,54 @@
 Module containing different methods
 """
 
+import os
+import re
+import csv
 import json
 import io
+import codecs
+import base64
+import itertools
+import shutil
+import hashlib
+import tempfile
+from importlib.util import find_spec
+import numpy as np
 import pandas as pd
+import openpyxl
+import pyarrow as pa
+import pyarrow.parquet
+from app.knee import SEARCH_MODES
+from app.seeding import INITS
+from app.datasets import DatasetStore
+
+# Number of bytes used to detect the delimiter and the decimal separator of a csv file
+CSV_SNIFF_BYTES = int(os.environ.get('CSV_SNIFF_BYTES', str(64 * 1024)))
+# Number of rows parsed at once by the csv reader
+CSV_CHUNK_ROWS = int(os.environ.get('CSV_CHUNK_ROWS', '100000'))
+# Directory for uploads which are spooled to disk for streaming jobs
+UPLOAD_DIR = os.environ.get('UPLOAD_DIR', tempfile.gettempdir())
+# Reader of xlsx files: calamine (if python-calamine is installed), openpyxl or auto
+XLSX_ENGINE = os.environ.get('XLSX_ENGINE', 'auto')
+# Number of rows of a workbook converted to columns at once
+XLSX_BLOCK_ROWS = int(os.environ.get('XLSX_BLOCK_ROWS', '50000'))
+
+# Number of bytes of a json file decoded at once
+JSON_BLOCK_BYTES = int(os.environ.get('JSON_BLOCK_BYTES', str(1024 * 1024)))
+# Number of data points of a json file collected before they are converted to columns
+JSON_CHUNK_ROWS = int(os.environ.get('JSON_CHUNK_ROWS', '10000'))
+# Line-delimited json, one data point per line
+NDJSON_FORMATS = (".ndjson", ".jsonl")
+
+# Binary columnar formats, read from the path of the spooled upload so they can be memory-mapped
+COLUMNAR_FORMATS = (".parquet", ".arrow", ".feather", ".npy")
+
+CSV_DELIMITERS = ",;\t|"
+JSON_WHITESPACE = re.compile(r"[ \t\n\r]*")
+JSON_ITEM_SEPARATOR = re.compile(r"[ \t\n\r]*,[ \t\n\r]*")
+NDJSON_LINE_BREAKS = re.compile(r"[\r\n]+[ \t\r\n]*")
+COMMA_DECIMAL = re.compile(r"^\s*-?\d+,\d+\s*$")
+POINT_DECIMAL = re.compile(r"^\s*-?\d*\.\d+\s*$")
 
 
 def dataframe_to_json_str(dataframe, cluster_labels, centroids):
@@ -15,104 +60,766 @@ def dataframe_to_json_str(dataframe, cluster_labels, centroids):
     Returns:
         json str for frontend
     """
-    data = []
+    return json.dumps(clusters_to_dict(dataframe.values, cluster_labels, centroids), separators=(",", ":"))
+
+
+def group_by_cluster(values, cluster_labels):
+    """
+    Groups the rows of an array by their cluster in one pass,
+    instead of one boolean mask per cluster
+
+    Returns:
+        dict: cluster -> array of its rows, in the original order
+    """
+    cluster_labels = np.asarray(cluster_labels)
+    if len(cluster_labels) == 0:
+        return {}
+    order = np.argsort(cluster_labels, kind="stable")
+    sizes = np.bincount(cluster_labels)
+    groups = np.split(values[order], np.cumsum(sizes)[:-1])
+    return {cluster: groups[cluster] for cluster in np.flatnonzero(sizes).tolist()}
+
+
+def clusters_to_dict(values, cluster_labels, centroids):
+    """
+    Builds the result shape of the frontend: per cluster its centroid and data points
+    """
+    groups = group_by_cluster(values, cluster_labels)
+    return {"Cluster": [{"centroids": centroids[cluster].tolist(),
+                         "data_points": groups[cluster].tolist()}
+                        for cluster in groups]}
 
-    unique_clusters = set(cluster_labels)
 
-    for cluster in unique_clusters:
-        cluster_data = {
-            "centroids": centroids[cluster].tolist(),
-            "data_points": dataframe[cluster_labels == cluster].values.tolist()
-        }
-        data.append(cluster_data)
+def result_to_npz(cluster_labels, centroids):
+    """
+    Packs the labels (int32) and the centroids into a base64 encoded npz payload,
+    which is stored in redis instead of the data points
 
-    result = {
-        "Cluster": data
-    }
+    Returns:
+        str: The payload
+    """
+    buffer = io.BytesIO()
+    np.savez(buffer, labels=np.asarray(cluster_labels, dtype=np.int32),
+             centroids=np.asarray(centroids, dtype=np.float64))
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
 
-    return json.dumps(result, indent=2)
+
+def npz_from_result(payload):
+    """
+    Returns the raw npz bytes of a payload created by result_to_npz
+    """
+    return base64.b64decode(payload)
+
+
+def result_from_npz(payload):
+    """
+    Unpacks a payload created by result_to_npz
+
+    Returns:
+        tuple: (labels, centroids)
+    """
+    with np.load(io.BytesIO(npz_from_result(payload))) as arrays:
+        return arrays["labels"], arrays["centroids"]
 
 
-def read_file(file, filename):
+# pylint: disable=too-many-return-statements
+def read_file(file, filename, columns=None):
     """
         function to read data out of file in a dataframe
+
+        columns is the list of the columns to read, all columns if None.
+        Parquet, Arrow and npy files can also be given by their path, then they are memory-mapped.
     """
+    if filename.endswith(COLUMNAR_FORMATS):
+        return read_columnar(file, filename, columns)
     if filename.endswith(".json"):
+        # Die Datenpunkte einzeln aus dem Array "data_points" lesen, ohne das ganze Dokument zu laden
+        return select_columns(concat_json_chunks(iter_json_chunks(iter_json_items(file))), columns)
+    if filename.endswith(NDJSON_FORMATS):
+        return select_columns(concat_json_chunks(iter_json_chunks(iter_ndjson_items(file))), columns)
+    if filename.endswith(".csv"):
+        try:
+            # Trennzeichen und Dezimalzeichen nur anhand des Dateianfangs erkennen
+            # und die Datei danach stückweise mit dem C-Parser einlesen
+            return select_columns(read_csv_chunked(file, columns=columns), columns)
+        except (pd.errors.ParserError, UnicodeDecodeError, csv.Error):
+            file.seek(0)
+            return select_columns(read_csv_fallback(file), columns)
+    if filename.endswith(".xlsx"):
+        return select_columns(read_xlsx(file), columns)
+    return {"error": "Die hochgeladene Datei ist keine json, ndjson, xlsx, csv, parquet, arrow, feather oder npy Datei."}
+
+
+class JsonStream:
+    """
+    Reads json values one at a time from a binary file, which is decoded
+    block by block; only the unread rest of the current block is kept.
+    """
+
+    def __init__(self, file, block_bytes=JSON_BLOCK_BYTES):
+        self.file = file
+        self.block_bytes = block_bytes
+        self.decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        self.parser = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        """
+        Appends the next block to the unread rest, returns False at the end of the file
+        """
+        if self.eof:
+            return False
+        # Mindestens so viel wie noch ungelesen ist, damit große Werte nicht quadratisch oft geparst werden
+        block = self.file.read(max(self.block_bytes, len(self.buffer) - self.pos))
+        self.eof = not block
+        self.buffer = self.buffer[self.pos:] + self.decoder.decode(block, final=self.eof)
+        self.pos = 0
+        return not self.eof
+
+    def peek(self):
+        """
+        Skips whitespace and returns the next character, or "" at the end of the file
+        """
+        while True:
+            self.pos = JSON_WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, characters):
+        """
+        Consumes one of the given structural characters and returns it
+
+        Raises:
+            json.JSONDecodeError: If the next character is another one
+        """
+        character = self.peek()
+        if not character or character not in characters:
+            raise json.JSONDecodeError(f"Expecting one of {characters!r}", self.buffer, self.pos)
+        self.pos += 1
+        return character
+
+    def value(self):
+        """
+        Parses the next json value
+
+        Raises:
+            json.JSONDecodeError: If the value is invalid or incomplete
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.parser.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # Eine Zahl am Ende des Blocks könnte im nächsten Block weitergehen
+            if end == len(self.buffer) and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def array_items(self):
+        """
+        Iterates over the items of the json array whose "[" was just consumed.
+
+        The complete object or array items of a block are decoded at once:
+        the block is cut after its last "]," or "},", which parses as array
+        only if the cut lies between two items. Otherwise the items are
+        scanned one by one by the C scanner of the json module; only an item
+        which may be cut off at the end of the block takes the slower path
+        of value() and expect().
+        """
+        if self.peek() == "]":
+            self.expect("]")
+            return
+        while True:
+            self.peek()
+            cut = max(self.buffer.rfind("],", self.pos), self.buffer.rfind("},", self.pos))
+            try:
+                items = json.loads("[" + self.buffer[self.pos:cut + 1] + "]") if cut > self.pos else None
+            except json.JSONDecodeError:
+                items = None
+            if items is not None:
+                self.pos = cut + 2
+                yield from items
+            else:
+                yield from self._scan_items()
+                yield self.value()
+                if self.expect(",]") == "]":
+                    return
+
+    def line_items(self):
+        """
+        Iterates over the values of a line-delimited json file. The complete
+        lines of a block are decoded at once as one array; if that fails,
+        e.g. because a value spans several lines, the values are read one at a time.
+        """
+        batched = True
+        while self.peek():
+            cut = self.buffer.rfind("\n", self.pos)
+            items = self._decode_lines(self.buffer[self.pos:cut]) if batched and cut > self.pos else None
+            if items is None:
+                # Nach einem fehlgeschlagenen Versuch den Rest der Datei Wert für Wert lesen
+                batched = batched and cut <= self.pos
+                yield self.value()
+                continue
+            self.pos = cut + 1
+            yield from items
+
+    @staticmethod
+    def _decode_lines(lines):
+        """
+        Decodes complete lines of json values as one array, returns None if that fails
+        """
+        try:
+            # Zuerst ohne Leerzeilen annehmen, das ist deutlich schneller als der reguläre Ausdruck
+            return json.loads("[" + lines.replace("\n", ",") + "]")
+        except json.JSONDecodeError:
+            pass
+        try:
+            return json.loads("[" + NDJSON_LINE_BREAKS.sub(",", lines.strip()) + "]")
+        except json.JSONDecodeError:
+            return None
+
+    def _scan_items(self):
+        """
+        Scans the items of the current block, up to the last one which may be cut off
+        """
+        scan = self.parser.scan_once
+        separator = JSON_ITEM_SEPARATOR.match
+        buffer, pos = self.buffer, self.pos
+        try:
+            while True:
+                value, end = scan(buffer, pos)
+                following = separator(buffer, end)
+                if following is None or following.end() == len(buffer):
+                    break
+                yield value
+                pos = following.end()
+        except (StopIteration, json.JSONDecodeError):
+            # Unvollständiger oder ungültiger Wert, value() liest nach oder meldet den Fehler
+            pass
+        finally:
+            self.pos = pos
 
-        #json Datei öffnen
-        with file as json_file:
-            data = json.load(json_file)
 
-        # Zugriff auf die Datenpunkte
-        data_points = data.get("data_points", [])
+def iter_json_items(file, key="data_points", block_bytes=JSON_BLOCK_BYTES):
+    """
+    Iterates over the items of the array data[key] of a json document
+    without loading the document, the other values are skipped
+
+    Raises:
+        json.JSONDecodeError: If the document is invalid
+    """
+    stream = JsonStream(file, block_bytes)
+    stream.expect("{")
+    if stream.peek() == "}":
+        return
+    while True:
+        name = stream.value()
+        stream.expect(":")
+        if name == key:
+            stream.expect("[")
+            yield from stream.array_items()
+        else:
+            stream.value()
+        if stream.expect(",}") == "}":
+            return
+
+
+def iter_ndjson_items(file, block_bytes=JSON_BLOCK_BYTES):
+    """
+    Iterates over the values of a line-delimited json file
+    """
+    return JsonStream(file, block_bytes).line_items()
+
+
+def iter_json_chunks(items, chunk_rows=JSON_CHUNK_ROWS):
+    """
+    Converts json data points (objects or arrays) into dataframes of chunk_rows rows,
+    so only the data points of one chunk exist as Python objects at a time
+    """
+    start = 0
+    while True:
+        chunk = list(itertools.islice(items, chunk_rows))
+        if not chunk:
+            return
+        yield pd.DataFrame(chunk, index=range(start, start + len(chunk)))
+        start += len(chunk)
+
+
+def concat_json_chunks(chunks):
+    """
+    Concatenates the chunks of a json file. Data points may have different keys,
+    a column missing in a chunk is filled with NaN there.
+
+    Returns:
+        pd.DataFrame: The complete data
+    """
+    chunks = list(chunks)
+    if any(not chunk.columns.equals(chunks[0].columns) for chunk in chunks):
+        chunks = [pd.concat(chunks)]
+    # Spalten, die in einem Chunk nur leer sind, wieder als Zahlen speichern
+    return concat_chunks(chunks).infer_objects()
+
+
+def project_columns(names, columns):
+    """
+    Checks the requested columns against the columns of a file
 
-        # Erstellen eines  Pandas DataFrame
-        dataframe = pd.DataFrame(data_points)
+    Returns:
+        list: columns, or all names if columns is None
+
+    Raises:
+        ValueError: If a requested column does not exist
+    """
+    if columns is None:
+        return list(names)
+    missing = [column for column in columns if column not in names]
+    if missing:
+        raise ValueError(f"Unknown columns: {', '.join(map(str, missing))}")
+    return list(columns)
+
+
+def select_columns(dataframe, columns):
+    """
+    Keeps only the requested columns of a parsed file
+    """
+    if columns is None:
         return dataframe
-    if filename.endswith(".csv"):
-        # Read the uploaded CSV file
-        csv_data = file.read().decode('utf-8')
+    return dataframe[project_columns([str(name) for name in dataframe.columns], columns)]
+
+
+def read_columnar(file, filename, columns=None):
+    """
+    Reads a Parquet, Arrow IPC (Feather) or npy file, decoding only the requested columns.
+
+    If file is a path, the file is memory-mapped: uncompressed Arrow columns
+    and the columns of a npy array are then not copied before the dataframe is built.
+
+    Returns:
+        pd.DataFrame: The data, the columns of a 2-d npy array are named "0", "1", ...
+    """
+    memory_map = isinstance(file, str)
+    if filename.endswith(".npy"):
+        array = np.load(file, mmap_mode="r" if memory_map else None, allow_pickle=False)
+        if array.dtype.names is not None:
+            return pd.DataFrame({name: array[name] for name in project_columns(array.dtype.names, columns)})
+        if array.ndim == 1:
+            array = array[:, np.newaxis]
+        if array.ndim != 2:
+            raise ValueError("The npy file has to contain a 1-d, 2-d or structured array.")
+        names = [str(i) for i in range(array.shape[1])]
+        return pd.DataFrame({name: array[:, int(name)] for name in project_columns(names, columns)})
+
+    if filename.endswith(".parquet"):
+        parquet = pyarrow.parquet.ParquetFile(file, memory_map=memory_map)
+        table = parquet.read(columns=project_columns(parquet.schema_arrow.names, columns))
+    else:
+        table = read_arrow(file, columns, memory_map)
+    # Spalten ohne fehlende Werte werden dabei nicht kopiert
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+
+def read_arrow(file, columns, memory_map):
+    """
+    Reads an Arrow IPC file (Feather v2), only the requested columns are decoded
+
+    Returns:
+        pa.Table: The requested columns
+    """
+    source = pa.memory_map(file) if memory_map else pa.py_buffer(file.read())
+    names = pa.ipc.open_file(source).schema.names
+    columns = project_columns(names, columns)
+    options = pa.ipc.IpcReadOptions(included_fields=[names.index(column) for column in columns])
+    return pa.ipc.open_file(source, options=options).read_all().select(columns)
+
+
+def xlsx_engine():
+    """
+    Returns the reader of xlsx files, calamine if it is installed and not disabled
+    """
+    if XLSX_ENGINE == "auto":
+        return "calamine" if find_spec("python_calamine") is not None else "openpyxl"
+    return XLSX_ENGINE
+
+
+def read_xlsx(file, block_rows=XLSX_BLOCK_ROWS):
+    """
+    Reads the first worksheet of a xlsx file
+
+    With calamine (Rust) pandas reads the workbook directly. Otherwise the
+    rows are streamed by the read-only reader of openpyxl as plain values and
+    converted block by block into typed columns, instead of converting every
+    cell and passing the rows through the text parser like pd.read_excel.
+
+    Returns:
+        pd.DataFrame: The data, the first row is the header
+    """
+    if xlsx_engine() == "calamine":
+        return pd.read_excel(file, engine="calamine")
+
+    workbook = openpyxl.load_workbook(file, read_only=True, data_only=True, keep_links=False)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        blocks = []
+        block = []
+        # Leere Zeilen am Ende des Blatts erst übernehmen, wenn noch Daten folgen
+        blank = []
+        for row in rows:
+            if all(value is None for value in row):
+                blank.append(row)
+                continue
+            block.extend(blank)
+            blank = []
+            block.append(row)
+            if len(block) >= block_rows:
+                blocks.append(rows_to_columns(block))
+                block = []
+        if block or not blocks:
+            blocks.append(rows_to_columns(block))
+    finally:
+        workbook.close()
+
+    width = max([len(header or ())] + [len(columns) for columns in blocks])
+    columns = [concat_cells([columns[i] for columns in blocks if i < len(columns)]) for i in range(width)]
+    names = xlsx_header(header or (), width)
+    # Leere Spalten am Ende des Blatts weglassen wie pd.read_excel
+    while width and str(names[width - 1]).startswith("Unnamed: ") and columns[width - 1].isna().all():
+        width -= 1
+    return pd.DataFrame(dict(zip(names[:width], columns[:width])), columns=names[:width])
+
+
+def rows_to_columns(rows):
+    """
+    Transposes a block of worksheet rows into object arrays, one per column
+    """
+    width = max((len(row) for row in rows), default=0)
+    values = np.full((len(rows), width), None, dtype=object)
+    for i, row in enumerate(rows):
+        values[i, :len(row)] = row
+    return list(values.T)
+
+
+def concat_cells(parts):
+    """
+    Concatenates the blocks of a column and infers its dtype once,
+    empty cells become NaN
+    """
+    values = np.concatenate(parts) if parts else np.empty(0, dtype=object)
+    column = pd.Series(values, dtype=object).infer_objects()
+    if column.dtype == object and column.isna().all():
+        return column.astype(np.float64)
+    return column
+
+
+def xlsx_header(header, width):
+    """
+    Returns the column names of a worksheet like pd.read_excel:
+    empty cells are named "Unnamed: i", repeated names get a suffix ".n"
+    """
+    names = []
+    seen = {}
+    for i in range(width):
+        name = header[i] if i < len(header) and header[i] is not None else f"Unnamed: {i}"
+        base = name
+        while name in seen:
+            seen[base] += 1
+            name = f"{base}.{seen[base]}"
+        seen[name] = 0
+        names.append(name)
+    return names
+
+
+def sniff_csv_format(prefix):
+    """
+    Detects the delimiter and the decimal separator of a csv file
+
+    Args:
+        prefix (str): The first complete lines of the file
+
+    Returns:
+        tuple: (delimiter, decimal)
+    """
+    try:
+        delimiter = csv.Sniffer().sniff(prefix, delimiters=CSV_DELIMITERS).delimiter
+    except csv.Error:
+        # Fallback: das häufigste Trennzeichen in der Kopfzeile
+        header = prefix.split("\n", 1)[0]
+        delimiter = max(CSV_DELIMITERS, key=header.count)
+
+    if delimiter == ",":
+        return delimiter, "."
+
+    comma_decimals = 0
+    point_decimals = 0
+    for row in csv.reader(io.StringIO(prefix), delimiter=delimiter):
+        for field in row:
+            if COMMA_DECIMAL.match(field):
+                comma_decimals += 1
+            elif POINT_DECIMAL.match(field):
+                point_decimals += 1
+
+    return delimiter, "," if comma_decimals >= point_decimals else "."
+
+
+def open_csv_reader(file, chunk_rows=CSV_CHUNK_ROWS, columns=None):
+    """
+    Opens a chunked C-engine reader on a csv file
+
+    Only the first CSV_SNIFF_BYTES are decoded to detect the format,
+    the rest is parsed straight from the (spooled) binary file.
+
+    Args:
+        file: The binary file object of the upload
+        chunk_rows (int): The number of rows parsed at once
+        columns (list): The columns to parse, all columns if None
+
+    Returns:
+        TextFileReader: Iterator over dataframes of chunk_rows rows
+    """
+    prefix = file.read(CSV_SNIFF_BYTES)
+    file.seek(0)
+    if isinstance(prefix, bytes):
+        prefix = prefix.decode('utf-8', errors='ignore')
+    if len(prefix) >= CSV_SNIFF_BYTES and "\n" in prefix:
+        # Die letzte, eventuell abgeschnittene Zeile ignorieren
+        prefix = prefix[:prefix.rindex("\n")]
+    delimiter, decimal = sniff_csv_format(prefix.lstrip("\ufeff"))
+
+    if columns is not None:
+        header = next(csv.reader(io.StringIO(prefix.lstrip("\ufeff")), delimiter=delimiter), [])
+        columns = project_columns(header, columns)
+
+    return pd.read_csv(file, sep=delimiter, decimal=decimal, thousands=None, usecols=columns,
+                       engine='c', encoding='utf-8-sig', chunksize=chunk_rows)
+
+
+def read_csv_chunked(file, chunk_rows=CSV_CHUNK_ROWS, columns=None):
+    """
+    Reads a csv file in chunks with the C parser
+
+    Returns:
+        pd.DataFrame: The parsed data
+    """
+    with open_csv_reader(file, chunk_rows, columns) as reader:
+        return concat_chunks(list(reader))
+
+
+def hash_upload(file, block_size=1024 * 1024):
+    """
+    Computes the sha256 of a whole upload block by block and rewinds the file
+
+    Returns:
+        str: The hex digest
+    """
+    digest = hashlib.sha256()
+    file.seek(0)
+    for block in iter(lambda: file.read(block_size), b""):
+        digest.update(block)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def spool_upload(file, filename, directory=UPLOAD_DIR):
+    """
+    Copies an upload to a file on disk, so it can be read several times in chunks
 
+    Returns:
+        dict: The path and the original filename of the spooled upload
+    """
+    suffix = os.path.splitext(filename)[1]
+    with tempfile.NamedTemporaryFile(dir=directory, suffix=suffix, delete=False) as spooled:
+        shutil.copyfileobj(file, spooled)
+    return {"path": spooled.name, "filename": filename}
+
+
+def spool_dataframe(dataframe, directory=UPLOAD_DIR):
+    """
+    Writes a parsed upload to disk, so a worker process can load it
+
+    Returns:
+        str: The path of the pickled dataframe
+    """
+    with tempfile.NamedTemporaryFile(dir=directory, suffix=".pkl", delete=False) as spooled:
+        dataframe.to_pickle(spooled)
+    return spooled.name
+
+
+def read_spooled(source, store=None):
+    """
+    Parses a spooled upload. A workbook is converted only once per file:
+    its frame is kept in the dataset store under source["dataset_id"]
+    (the sha256 of the file), so a re-submitted workbook and every epoch
+    of a streaming job skip the conversion. Columnar formats are memory-mapped.
+
+    Args:
+        source (dict): The spooled upload returned by spool_upload, optionally
+                       with its dataset_id and the list of columns to read
+
+    Returns:
+        pd.DataFrame or dict: The data, or an error message like read_file
+    """
+    filename = source["filename"]
+    columns = source.get("columns")
+    if filename.endswith(COLUMNAR_FORMATS):
+        return read_columnar(source["path"], filename, columns)
+
+    dataset_id = source.get("dataset_id")
+    if not (filename.endswith(".xlsx") and dataset_id):
+        with open(source["path"], "rb") as file:
+            return read_file(file, filename, columns)
+
+    store = store or DatasetStore()
+    dataframe = store.load_upload(dataset_id)
+    if dataframe is None:
+        with open(source["path"], "rb") as file:
+            dataframe = read_file(file, filename, columns)
+        store.save_upload(dataset_id, dataframe)
+    return dataframe
+
+
+def iter_file_chunks(source, chunk_rows=CSV_CHUNK_ROWS):
+    """
+    Iterates over a spooled upload in dataframes of at most chunk_rows rows.
+    Csv, json and Parquet files are parsed chunk by chunk, the other formats are read at once and then split.
+
+    Args:
+        source (dict): The spooled upload returned by spool_upload
+
+    Raises:
+        ValueError: If the file type is not supported
+    """
+    columns = source.get("columns")
+    if source["filename"].endswith(".csv"):
+        with open(source["path"], "rb") as file, open_csv_reader(file, chunk_rows, columns) as reader:
+            yield from reader
+        return
+    if source["filename"].endswith(".parquet"):
+        parquet = pyarrow.parquet.ParquetFile(source["path"], memory_map=True)
+        batches = parquet.iter_batches(chunk_rows, columns=project_columns(parquet.schema_arrow.names, columns))
+        for batch in batches:
+            yield batch.to_pandas()
+        return
+    if source["filename"].endswith((".json",) + NDJSON_FORMATS):
+        with open(source["path"], "rb") as file:
+            items = iter_json_items(file) if source["filename"].endswith(".json") else iter_ndjson_items(file)
+            for chunk in iter_json_chunks(items, chunk_rows):
+                yield select_columns(chunk, columns)
+        return
+
+    dataframe = read_spooled(source)
+    if not isinstance(dataframe, pd.DataFrame):
+        raise ValueError(dataframe["error"])
+    for start in range(0, len(dataframe), chunk_rows):
+        yield dataframe.iloc[start:start + chunk_rows]
+
+
+def concat_chunks(chunks):
+    """
+    Concatenates the chunks of the csv reader column by column,
+    releasing the chunks of each column as soon as it is copied
+
+    Returns:
+        pd.DataFrame: The complete data
+    """
+    if not chunks:
+        return pd.DataFrame()
+    if len(chunks) == 1:
+        return chunks[0].reset_index(drop=True)
+
+    columns = {}
+    for name in chunks[0].columns:
+        parts = [chunk.pop(name) for chunk in chunks]
+        if all(part.dtype.kind in "biuf" for part in parts):
+            columns[name] = np.concatenate([part.to_numpy() for part in parts])
+        else:
+            columns[name] = pd.concat(parts, ignore_index=True)
+        del parts
+    return pd.DataFrame(columns)
+
+
+def read_first_chunk(source, chunk_rows=CSV_CHUNK_ROWS):
+    """
+    Reads only the first chunk of a spooled upload, used to validate streaming jobs
+
+    Returns:
+        pd.DataFrame or dict: The first chunk, or an error message like read_file
+    """
+    chunks = iter_file_chunks(source, chunk_rows)
+    try:
+        return next(chunks, pd.DataFrame())
+    except (ValueError, pd.errors.ParserError, UnicodeDecodeError) as exception:
+        return {"error": str(exception)}
+    finally:
+        chunks.close()
+
+
+def read_csv_fallback(file):
+    """
+    Reads a csv file with the python parser, used if the format detection fails
+    """
+    csv_data = file.read().decode('utf-8')
+
+    # Versuche, das Trennzeichen automatisch zu erkennen
+    try:
         # Versuche, das Trennzeichen automatisch zu erkennen
+        dataframe = pd.read_csv(io.StringIO(csv_data, newline = ''), sep=None, decimal = ',', engine='python', thousands=None)
+    except pd.errors.ParserError:
         try:
-            # Versuche, das Trennzeichen automatisch zu erkennen
-            dataframe = pd.read_csv(io.StringIO(csv_data, newline = ''), sep=None, decimal = ',', engine='python', thousands=None)
+            # Versuch 2: CSV mit Komma als Dezimalzeichen
+            dataframe = pd.read_csv(io.StringIO(csv_data, newline = ''), sep=";", engine='python', decimal=',')
         except pd.errors.ParserError:
-            try:
-                # Versuch 2: CSV mit Komma als Dezimalzeichen
-                dataframe = pd.read_csv(io.StringIO(csv_data, newline = ''), sep=";", engine='python', decimal=',')
-            except pd.errors.ParserError:
-                # Wenn das automatische Erkennen und beide Versuche fehlschlagen, verwende ';' als Fallback-Trennzeichen
-                dataframe = pd.read_csv(io.StringIO(csv_data, newline = ''), sep=",", engine='python', decimal='.')
+            # Wenn das automatische Erkennen und beide Versuche fehlschlagen, verwende ';' als Fallback-Trennzeichen
+            dataframe = pd.read_csv(io.StringIO(csv_data, newline = ''), sep=",", engine='python', decimal='.')
 
-        return dataframe
-    if filename.endswith(".xlsx"):
-        # Read the uploaded Excel file
-        excel_data = file.read()
+    return dataframe
 
-        # Verwende pandas, um die Excel-Datei einzulesen
-        dataframe = pd.read_excel(io.BytesIO(excel_data), engine='openpyxl')
-        return dataframe
-    return {"error": "Die hochgeladene Datei ist keine json, xlsx oder csv Datei."}
 
-def check_parameter(centroids, number_runs, dataframe, k_min, k_max, init, algorithm, normalization):
+def check_parameter(centroids, number_runs, dataframe, k_min, k_max, init, algorithm, normalization, search="full"):
     """
         checking the params for kmeans
+
+        dataframe can also be the number of rows of the data, search is the search mode of the elbow sweep
     """
 
+    rows = dataframe if isinstance(dataframe, int) else len(dataframe)
     error_message = ""
     if (not isinstance(number_runs, int) or number_runs < 1) and number_runs != 'auto':
         error_message += "The number of kmeans-runs has to be an integer > 0 or ""auto"""
-    if k_min > len(dataframe) or k_max > len(dataframe) or k_min < 0 or k_max < 0:
+    if k_min > rows or k_max > rows or k_min < 0 or k_max < 0:
         error_message += ("The k-value has to be an integer > 0"
                           " and smaller than the number of datapoints. ")
     if k_min > k_max:
         error_message += ("k_min has to be smaller than k_max")
-    if (init not in ("k-means++","random", "centroids") or
+    if (init not in INITS + ("centroids",) or
         (init == "centroids" and centroids is None)):
-        error_message += ("The parameter init has to be k-means++, random or centroids"
-                          " in combination with a specification"
+        error_message += ("The parameter init has to be k-means++, random, k-means||, subsample, coreset"
+                          " or centroids in combination with a specification"
                           " of the initial centroid positions. ")
-    if algorithm not in ("elkan","auto", "lloyd", "full"):
+    if algorithm not in ("elkan","auto", "lloyd", "full", "minibatch"):
         error_message += ("The 'algorithm' parameter of KMeans must be a str among"
-                         " ('elkan', 'auto' (deprecated), 'lloyd', 'full' (deprecated)).")
+                         " ('elkan', 'auto' (deprecated), 'lloyd', 'full' (deprecated), 'minibatch').")
     if normalization is not None and normalization not in("min-max", "z"):
         error_message += ("The 'normalization' parameter must be None or a string among"
                          " ('min-max' or 'z').")
+    if search not in SEARCH_MODES:
+        error_message += ("The 'search' parameter must be a string among"
+                         " ('full', 'early-stop', 'coarse-to-fine').")
 
     return error_message
 
-def elbow_to_json(k_min, k_max, elbow):
+def elbow_to_json(inertias):
     """
         function to store elbow data in json string
-    """
-    # Erstelle ein leeres Dictionary, um die Daten zu speichern
-    data = {}
 
-    for k in range(k_min, k_max + 1):
-        data[k] = elbow[k - k_min]
-
-    # Konvertiere das Dictionary in einen  JSON-String
-    json_string = json.dumps(data, indent=4)
-
-    return json_string
+        inertias is a dict with the inertia (or the scores) of each fitted k, not necessarily contiguous
+    """
+    # Konvertiere das nach k sortierte Dictionary in einen JSON-String
+    return json.dumps(dict(sorted(inertias.items())), indent=4)
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+"""
+Worker processes running the clustering jobs of the redis queue
+
+Workers can run next to the API (KMEANS_WORKERS) or standalone, on as many
+hosts as needed; they only share redis and the UPLOAD_DIR/DATASET_DIR
+directories with the API.
+
+    python -m app.worker --processes 4
+"""
+import os
+import uuid
+import signal
+import resource
+import socket
+import argparse
+import threading
+import multiprocessing
+from importlib import import_module
+import redis
+from app.job_queue import JobQueue, QUEUE_PREFIX, KMEANS_HEARTBEAT_INTERVAL
+from app.task_store import TaskStore
+from app.result_cache import ResultCache
+from app.job_control import JobControl, JobStopped, KMEANS_JOB_TIMEOUT, KMEANS_JOB_MAX_MEMORY, KMEANS_JOB_GRACE
+
+KMEANS_WORKERS = int(os.environ.get('KMEANS_WORKERS', str(os.cpu_count() or 1)))
+KMEANS_WORKER_THREADS = int(os.environ.get('KMEANS_WORKER_THREADS', '1'))
+
+REDIS_HOST = os.environ.get('REDIS_HOST', 'localhost')
+REDIS_PORT = os.environ.get('REDIS_PORT', '6379')
+
+# Environment variables read by the BLAS/OpenMP runtimes when they are loaded
+THREAD_LIMIT_VARIABLES = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS",
+                          "BLIS_NUM_THREADS", "VECLIB_MAXIMUM_THREADS", "NUMEXPR_NUM_THREADS")
+
+# Functions of app.kmeans_methods a job may run
+TARGETS = ("run_kmeans_one_k", "run_kmeans_elbow", "run_kmeans_minibatch")
+
+
+class Worker:
+    """
+    Pulls jobs from the queue and runs them one after another
+    """
+
+    def __init__(self, redis_client, prefix=QUEUE_PREFIX, threads=KMEANS_WORKER_THREADS, timeout=KMEANS_JOB_TIMEOUT):
+        self.redis_client = redis_client
+        self.task_store = TaskStore(redis_client)
+        self.job_queue = JobQueue(redis_client, prefix)
+        self.threads = threads
+        self.timeout = timeout
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        # (task_id, job, control) of the running job
+        self._current = None
+
+    def run(self, stop_event):
+        """
+        Runs jobs until stop_event is set, the current job is always finished
+        """
+        stopped = threading.Event()
+        self.job_queue.heartbeat(self.worker_id)
+        heartbeat = threading.Thread(target=self._beat, args=(stopped,), daemon=True)
+        heartbeat.start()
+        try:
+            while not stop_event.is_set():
+                self.job_queue.requeue_orphans()
+                task_id = self.job_queue.claim(self.worker_id, KMEANS_HEARTBEAT_INTERVAL)
+                if task_id is not None:
+                    self.run_job(task_id)
+        finally:
+            stopped.set()
+            heartbeat.join()
+            self.job_queue.unregister(self.worker_id)
+
+    def _beat(self, stopped):
+        """
+        Renews the heartbeat and watches the running job until stopped is set
+        """
+        while not stopped.wait(KMEANS_HEARTBEAT_INTERVAL):
+            current = self._current
+            self.job_queue.heartbeat(self.worker_id, None if current is None else current[0])
+            self._watch_job()
+
+    def _watch_job(self):
+        """
+        Passes a cancel request to the running job. A job which does not reach
+        a checkpoint within KMEANS_JOB_GRACE seconds after its cancel request or
+        the end of its budget is stopped by replacing the worker process.
+        """
+        current = self._current
+        if current is None:
+            return
+        task_id, job, control = current
+        if self.task_store.field(task_id, "cancel_requested"):
+            control.cancel()
+        if control.overrun() <= KMEANS_JOB_GRACE:
+            return
+        try:
+            control.check()
+        except JobStopped as stopped:
+            self.task_store.append_message(task_id, f"{stopped} The worker was restarted. ", status=stopped.status)
+        remove_job_data(job)
+        self.job_queue.ack(self.worker_id, task_id)
+        self.job_queue.unregister(self.worker_id)
+        # Die Fits lassen sich nicht von außen abbrechen, der Pool startet einen neuen Prozess
+        os._exit(1)
+
+    def run_job(self, task_id):
+        """
+        Runs one claimed job and writes its result to the task store
+        """
+        # pylint: disable=import-outside-toplevel
+        from threadpoolctl import threadpool_limits
+
+        job, attempts = self.job_queue.job(task_id)
+        try:
+            if job is None or self.task_store.get(task_id) is None:
+                # Die Task ist inzwischen abgelaufen, ihre Daten werden trotzdem gelöscht
+                return
+            if attempts > self.job_queue.retries:
+                self.task_store.fail(task_id, f"Job failed: the worker died {attempts} times while running it.")
+                return
+            if job["target"] not in TARGETS:
+                raise ValueError("Unknown job " + job["target"])
+
+            control = JobControl(self.timeout)
+            self._current = (task_id, job, control)
+            if self.task_store.field(task_id, "cancel_requested"):
+                control.cancel()
+            control.check()
+
+            self.task_store.update(task_id, status="processing", worker=self.worker_id)
+            target = getattr(import_module("app.kmeans_methods"), job["target"])
+            with threadpool_limits(limits=self.threads):
+                target(self.task_store, load_job_data(job), task_id, *job["args"], control=control)
+
+            # Ergebnis für identische Anfragen zwischenspeichern
+            fields = self.task_store.get(task_id) or {}
+            if fields.get("status") == "completed" and fields.get("cache_key"):
+                ResultCache(self.redis_client).store(fields["cache_key"], fields)
+        except JobStopped as stopped:
+            self.task_store.append_message(task_id, f"{stopped} ", status=stopped.status)
+        except MemoryError:
+            self.task_store.append_message(task_id, f"The task exceeded the memory limit of "
+                                                    f"{KMEANS_JOB_MAX_MEMORY} bytes. ", status="out of memory")
+        except Exception as exception:  # pylint: disable=broad-exception-caught
+            self.task_store.fail(task_id, "Job failed: " + str(exception))
+        finally:
+            self._current = None
+            remove_job_data(job)
+            self.job_queue.ack(self.worker_id, task_id)
+
+
+def load_job_data(job):
+    """
+    Returns the data of a job: the pickled upload, the spooled file of a
+    streaming job, or None if the data is taken from the dataset store
+    """
+    if job.get("frame"):
+        import pandas as pd  # pylint: disable=import-outside-toplevel
+        return pd.read_pickle(job["frame"])
+    return job.get("source")
+
+
+def remove_job_data(job):
+    """
+    Removes the files of a finished job
+    """
+    paths = [] if job is None else [job.get("frame"), (job.get("source") or {}).get("path")]
+    for path in paths:
+        if path:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def elbow_jobs(processes):
+    """
+    Returns the number of k values an elbow sweep of a worker fits in parallel
+    unless KMEANS_ELBOW_JOBS is set: the CPU cores shared among the worker processes
+    """
+    return max(1, (os.cpu_count() or 1) // max(processes, 1))
+
+
+def _worker_process(redis_host, redis_port, prefix, threads, parallel_fits, stop_event):
+    """
+    Entry point of a worker process: limits the BLAS/OpenMP threads before
+    numpy is loaded, the parallel fits of an elbow sweep to parallel_fits and
+    the memory to KMEANS_JOB_MAX_MEMORY, and runs jobs until stop_event is set
+    """
+    for variable in THREAD_LIMIT_VARIABLES:
+        os.environ[variable] = str(threads)
+    # Sonst startet jeder Worker so viele Fits wie es Kerne gibt
+    os.environ.setdefault("KMEANS_ELBOW_JOBS", str(parallel_fits))
+    # Strg+C beendet nur den Elternprozess, der die Worker geordnet stoppt
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if KMEANS_JOB_MAX_MEMORY > 0:
+        # Allokationen über dem Budget schlagen mit MemoryError fehl, statt den Rechner auszulasten
+        _, hard = resource.getrlimit(resource.RLIMIT_DATA)
+        limit = KMEANS_JOB_MAX_MEMORY if hard == resource.RLIM_INFINITY else min(KMEANS_JOB_MAX_MEMORY, hard)
+        resource.setrlimit(resource.RLIMIT_DATA, (limit, hard))
+    redis_client = redis.Redis(host=redis_host, port=redis_port, decode_responses=True)
+    Worker(redis_client, prefix, threads).run(stop_event)
+
+
+class WorkerPool:
+    """
+    A fixed number of worker processes, dead processes are replaced
+    """
+
+    def __init__(self, redis_host, redis_port, processes=KMEANS_WORKERS,
+                 threads=KMEANS_WORKER_THREADS, prefix=QUEUE_PREFIX):
+        self.processes = max(processes, 0)
+        self.args = (redis_host, redis_port, prefix, max(threads, 1), elbow_jobs(self.processes))
+        self._context = multiprocessing.get_context("spawn")
+        self._stop = self._context.Event()
+        self._lock = threading.Lock()
+        self._children = []
+
+    def start(self):
+        """
+        Starts the worker processes, does nothing if they are already running
+        """
+        with self._lock:
+            if self._children or self.processes == 0 or self._stop.is_set():
+                return
+            self._children = [self._spawn() for _ in range(self.processes)]
+        threading.Thread(target=self._watch, daemon=True).start()
+
+    def _spawn(self):
+        """
+        Starts one worker process
+        """
+        process = self._context.Process(target=_worker_process, args=(*self.args, self._stop), daemon=True)
+        process.start()
+        return process
+
+    def _watch(self):
+        """
+        Replaces crashed worker processes; their jobs are requeued by the other workers
+        """
+        while not self._stop.wait(KMEANS_HEARTBEAT_INTERVAL):
+            with self._lock:
+                self._children = [child if child.is_alive() or self._stop.is_set() else self._spawn()
+                                  for child in self._children]
+
+    def stop(self, timeout=None):
+        """
+        Lets the workers finish their current job and stops them
+        """
+        self._stop.set()
+        with self._lock:
+            children, self._children = self._children, []
+        for child in children:
+            child.join(timeout)
+            if child.is_alive():
+                child.terminate()
+
+
+def main():
+    """
+    Runs a standalone pool of workers until SIGINT or SIGTERM
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, default=KMEANS_WORKERS)
+    parser.add_argument("--threads", type=int, default=KMEANS_WORKER_THREADS)
+    args = parser.parse_args()
+
+    pool = WorkerPool(REDIS_HOST, REDIS_PORT, max(args.processes, 1), args.threads)
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    signal.signal(signal.SIGINT, lambda *_: stopping.set())
+    pool.start()
+    print(f"{pool.processes} workers started, waiting for jobs")
+    stopping.wait()
+    print("Stopping, the running jobs are finished first")
+    pool.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Cleaning benchmark: dropna and object dtype detection versus the typed cleaning
+
+The data looks like a German export of the autoscout data: the price has
+comma decimals and thousands separators, the first registration is a date
+string, there is a running ID and a few missing values. The old chain
+(dropna, every non-numeric column is categorical) is compared with
+clean_columns, both followed by the same encoding and z-transformation.
+Every variant runs in a fresh process, so the peak RSS is its own.
+
+    python -m benchmarks.bench_cleaning --rows 500000
+"""
+import time
+import argparse
+import multiprocessing
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import StandardScaler
+from app.datacheck import CategoricalEncoder, category_counts, clean_columns, combine_features, encoded_scaler
+from benchmarks.bench_engine import peak_rss
+
+VARIANTS = ("dropna + object dtypes (old)", "typed cleaning")
+
+
+def make_export(rows, seed=0):
+    """
+    Returns the data with numbers and dates as German formatted strings
+    """
+    rng = np.random.default_rng(seed)
+    price = pd.Series(rng.normal(20000, 5000, rows).round(2))
+    price = price.map(lambda value: f"{value:,.2f}").str.replace(",", "_").str.replace(".", ",").str.replace("_", ".")
+    mileage = rng.normal(80000, 20000, rows).round()
+    mileage[rng.random(rows) < 0.01] = np.nan
+    registered = pd.Timestamp("2010-01-01") + pd.to_timedelta(rng.integers(0, 3650, rows), unit="D")
+    return pd.DataFrame({
+        'id': np.arange(rows),
+        'price': price,
+        'mileage': mileage,
+        'registered': registered.strftime("%d.%m.%Y"),
+        'fuel': rng.choice(['Diesel', 'Gasoline', 'Electric'], rows),
+        'model': [f"model-{value}" for value in rng.zipf(1.3, rows) % 2000]})
+
+
+def encode(cleaned, categorical):
+    """
+    Encodes and z-transforms the cleaned data like prepare_data
+    """
+    encoder = CategoricalEncoder({column: category_counts(cleaned[column]) for column in categorical})
+    encoded, _ = encoder.transform(cleaned)
+    numeric = pd.concat([cleaned.drop(columns=categorical), encoder.frequency_columns(cleaned)], axis=1)
+    numeric = StandardScaler().fit_transform(numeric.to_numpy(dtype=float))
+    if encoded.shape[1] > 0:
+        encoded = encoded_scaler('z').fit_transform(encoded)
+    return combine_features(numeric, encoded)
+
+
+def measure(variant, rows):
+    """
+    Cleans and prepares the data with one variant
+
+    Returns:
+        tuple: (seconds, cleaned frame MB, feature columns, peak RSS above the raw data in MB)
+    """
+    data = make_export(rows)
+    baseline = peak_rss()
+
+    begin = time.perf_counter()
+    if variant.endswith("(old)"):
+        cleaned = data.dropna().reset_index(drop=True)
+        categorical = [column for column in cleaned.columns
+                       if not pd.api.types.is_numeric_dtype(cleaned[column].dtype)]
+    else:
+        cleaned, _ = clean_columns(data)
+        categorical = cleaned.select_dtypes(include=['category']).columns.tolist()
+    matrix = encode(cleaned, categorical)
+    wall = time.perf_counter() - begin
+    return wall, cleaned.memory_usage(deep=True).sum() / 2 ** 20, matrix.shape[1], peak_rss() - baseline
+
+
+def main():
+    """
+    Runs the benchmark
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=500000)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    print(f"{args.rows} rows")
+    print(f"{'variant':<30} {'time [s]':>9} {'cleaned [MB]':>13} {'columns':>8} {'peak RSS [MB]':>14}")
+    with context.Pool(1, maxtasksperchild=1) as pool:
+        for variant in VARIANTS:
+            wall, size, columns, rss = pool.apply(measure, (variant, args.rows))
+            print(f"{variant:<30} {wall:>9.2f} {size:>13.1f} {columns:>8} {rss:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar ingestion benchmark: read time and peak memory of the binary formats
+
+Writes the same generated data as csv, parquet, arrow (uncompressed Arrow
+IPC file), feather (lz4) and npy (numeric columns only) and reads each
+spooled file like the ingestion processes, once with all columns and once
+with two of them selected by columns=. The memory-mapped pages of arrow
+and npy files are not counted.
+
+    python -m benchmarks.bench_columnar --rows 1000000
+"""
+import gc
+import os
+import time
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+import pyarrow as pa
+import pyarrow.feather
+from app.utils import read_spooled
+from benchmarks.bench_ingestion import make_csv
+
+
+def measure(source, repeat):
+    """
+    Returns the best wall time of read_spooled(source) and its peak memory:
+    the peak traced by tracemalloc plus the Arrow memory pool, which tracemalloc does not see
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        read_spooled(source)
+        best = min(best, time.perf_counter() - begin)
+
+    # Frames der Zeitmessung freigeben, bevor der Arrow-Speicher gezählt wird
+    gc.collect()
+    arrow_before = pa.total_allocated_bytes()
+    tracemalloc.start()
+    dataframe = read_spooled(source)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    arrow = pa.total_allocated_bytes() - arrow_before
+    del dataframe
+    return best, peak + arrow
+
+
+def main():
+    """
+    Runs the benchmark
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = {name: os.path.join(directory, "data." + name)
+                 for name in ("csv", "parquet", "arrow", "feather", "npy")}
+        make_csv(paths["csv"], args.rows, delimiter=",", decimal=".")
+        dataframe = read_spooled({"path": paths["csv"], "filename": "data.csv"})
+        dataframe.to_parquet(paths["parquet"])
+        pyarrow.feather.write_feather(dataframe, paths["arrow"], compression="uncompressed")
+        pyarrow.feather.write_feather(dataframe, paths["feather"])
+        np.save(paths["npy"], dataframe.select_dtypes("number").to_numpy())
+
+        print(f"{args.rows} rows")
+        print(f"{'format':<10} {'columns':<8} {'MB':>8} {'time [s]':>10} {'peak [MB]':>10}")
+        for name, path in paths.items():
+            selected = ["0", "1"] if name == "npy" else ["mileage", "price"]
+            for label, columns in (("all", None), ("2", selected)):
+                source = {"path": path, "filename": os.path.basename(path), "columns": columns}
+                wall, peak = measure(source, args.repeat)
+                print(f"{name:<10} {label:<8} {os.path.getsize(path) / 1e6:>8.1f} {wall:>10.3f} {peak / 1e6:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Dataset benchmark: N parameter variants on one file
+
+Runs k-means for k = 2..N+1 on the same csv file through the API and
+reports the end-to-end latency (request until "completed") of
+    - re-uploading the file for every variant without the dataset store
+      (the dataset is deleted after every job, as before the store existed),
+    - re-uploading the file for every variant,
+    - uploading it once to /datasets/ and passing the dataset_id.
+Needs a running redis server (REDIS_HOST/REDIS_PORT).
+
+    python -m benchmarks.bench_datasets --rows 200000 --variants 6
+"""
+import os
+import time
+import random
+import argparse
+import tempfile
+import numpy as np
+
+# Eigenes Verzeichnis, damit der Speicher leer startet
+os.environ.setdefault('DATASET_DIR', tempfile.mkdtemp(prefix="bench-datasets-"))
+
+# pylint: disable=wrong-import-position
+from fastapi.testclient import TestClient
+from app.main import app
+from benchmarks.bench_ingestion import make_csv
+
+
+def wait_completed(client, task_id):
+    """
+    Polls the status endpoint until the task is finished
+    """
+    while True:
+        response = client.get(f"/kmeans/status/{task_id}")
+        if response.status_code != 200 or response.json()["status"] == "completed":
+            return
+        time.sleep(0.01)
+
+
+def run_variant(client, path, k, seed, dataset_id=None):
+    """
+    Starts one k-means job, by upload or by dataset_id, and waits for it
+
+    Returns:
+        tuple: (latency in seconds, dataset ID)
+    """
+    params = {"k": k, "number_kmeans_runs": 1, "seed": seed}
+    begin = time.perf_counter()
+    if dataset_id is None:
+        with open(path, "rb") as file:
+            response = client.post("/kmeans/", params=params, files={"file": ("data.csv", file)})
+    else:
+        response = client.post("/kmeans/", params={**params, "dataset_id": dataset_id})
+    wait_completed(client, response.json()["TaskID"])
+    return time.perf_counter() - begin, response.json()["DatasetID"]
+
+
+def main():
+    """
+    Runs the benchmark
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--variants", type=int, default=6)
+    args = parser.parse_args()
+
+    with tempfile.NamedTemporaryFile(suffix=".csv") as tmp, TestClient(app) as client:
+        make_csv(tmp.name, args.rows)
+        print(f"{args.rows} rows, {os.path.getsize(tmp.name) / 1e6:.1f} MB, {args.variants} variants")
+        print(f"{'mode':<28} {'total [s]':>10} {'mean [s]':>10}")
+        # Zufälliger seed, damit kein Ergebnis aus dem Cache kommt
+        seed = random.randrange(2 ** 31)
+
+        latencies = []
+        for k in range(2, args.variants + 2):
+            latency, dataset_id = run_variant(client, tmp.name, k, seed)
+            latencies.append(latency)
+            client.delete(f"/datasets/{dataset_id}")
+        print(f"{'re-upload, no dataset store':<28} {sum(latencies):>10.2f} {np.mean(latencies):>10.2f}")
+
+        latencies = [run_variant(client, tmp.name, k, seed + 1)[0] for k in range(2, args.variants + 2)]
+        print(f"{'re-upload':<28} {sum(latencies):>10.2f} {np.mean(latencies):>10.2f}")
+        client.delete(f"/datasets/{dataset_id}")
+
+        begin = time.perf_counter()
+        with open(tmp.name, "rb") as file:
+            dataset_id = client.post("/datasets/", files={"file": ("data.csv", file)}).json()["DatasetID"]
+        latencies = [time.perf_counter() - begin]
+        latencies += [run_variant(client, tmp.name, k, seed + 2, dataset_id)[0] for k in range(2, args.variants + 2)]
+        print(f"{'upload once + dataset_id':<28} {sum(latencies):>10.2f} {np.mean(latencies[1:]):>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Elbow search benchmark: every k versus early stopping and the coarse-to-fine search
+
+Runs run_kmeans_elbow on gaussian blobs with a known number of clusters
+in every search mode and reports the number of fitted k values, the wall
+time and the recommended k. Needs a running redis server (REDIS_HOST/REDIS_PORT).
+
+    python -m benchmarks.bench_elbow --rows 50000 --clusters 4 8 16 --k-max 40
+"""
+import os
+import json
+import time
+import uuid
+import argparse
+import redis
+import pandas as pd
+from sklearn.datasets import make_blobs
+from app.knee import SEARCH_MODES
+from app.kmeans_methods import run_kmeans_elbow
+from app.task_store import TaskStore
+
+REDIS_HOST = os.environ.get('REDIS_HOST', 'localhost')
+REDIS_PORT = os.environ.get('REDIS_PORT', '6379')
+
+
+def measure(task_store, dataframe, search, k_max, runs, warm_start):
+    """
+    Runs one elbow sweep from k=1 to k_max
+
+    Returns:
+        tuple: (seconds, number of fitted k values, recommended k)
+    """
+    task_id = str(uuid.uuid4())
+    task_store.create(task_id, "elbow", status="processing")
+    begin = time.perf_counter()
+    run_kmeans_elbow(task_store, dataframe, task_id, 1, k_max, runs, 300, 1e-4, "k-means++", "lloyd",
+                     warm_start=warm_start, random_state=0, search=search)
+    wall = time.perf_counter() - begin
+    fitted = len(json.loads(task_store.field(task_id, "inertia_values")))
+    recommended_k = task_store.field(task_id, "recommended_k")
+    task_store.delete(task_id)
+    return wall, fitted, recommended_k
+
+
+def main():
+    """
+    Runs the benchmark
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--columns", type=int, default=8)
+    parser.add_argument("--clusters", type=int, nargs="+", default=[4, 8, 16])
+    parser.add_argument("--k-max", type=int, default=40)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--warm-start", action="store_true")
+    args = parser.parse_args()
+
+    task_store = TaskStore(redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True))
+    print(f"{args.rows}x{args.columns}, k=1..{args.k_max}, n_init={args.runs}, warm_start={args.warm_start}")
+    print(f"{'clusters':>8} {'search':<15} {'fits':>5} {'time [s]':>9} {'recommended k':>14}")
+    for clusters in args.clusters:
+        matrix, _ = make_blobs(args.rows, n_features=args.columns, centers=clusters, cluster_std=2.0,
+                               random_state=0)
+        dataframe = pd.DataFrame(matrix, columns=[f"x{column}" for column in range(args.columns)])
+        for search in SEARCH_MODES:
+            wall, fitted, recommended_k = measure(task_store, dataframe, search, args.k_max, args.runs,
+                                                  args.warm_start)
+            print(f"{clusters:>8} {search:<15} {fitted:>5} {wall:>9.2f} {recommended_k:>14}")
+
+
+if __name__ == "__main__":
+    main()
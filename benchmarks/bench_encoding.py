@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Encoding benchmark: dense versus sparse One-Hot encoding of a wide categorical column
+
+The data has numeric columns, a small "fuel" column and a "model" column
+with many values, like the autoscout data. Compared are the old dense path
+(OneHotEncoder(sparse_output=False), concatenated frame, sklearn KMeans),
+the sparse CSR path and the frequency and hashing encodings of the
+high-cardinality column, each from the raw frame to the fitted k-means.
+Every variant runs in a fresh process, so the peak RSS is its own.
+
+    python -m benchmarks.bench_encoding --rows 200000 --models 5000
+"""
+import time
+import argparse
+import multiprocessing
+import numpy as np
+import pandas as pd
+from sklearn.cluster import KMeans
+from sklearn.preprocessing import OneHotEncoder, StandardScaler
+from sklearn.utils import check_random_state
+from app.datacheck import CategoricalEncoder, combine_features, encoded_scaler
+from app.kmeans_engine import KMeansEngine
+from benchmarks.bench_engine import peak_rss
+
+VARIANTS = ("dense one-hot (old)", "sparse one-hot", "frequency", "hashing")
+
+
+def make_cars(rows, models, seed=0):
+    """
+    Returns two numeric and two categorical columns, one with models values
+    """
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'price': rng.normal(20000, 5000, rows),
+        'mileage': rng.normal(80000, 20000, rows),
+        'fuel': rng.choice(['Diesel', 'Gasoline', 'Electric'], rows),
+        'model': [f"model-{value}" for value in rng.zipf(1.3, rows) % models]})
+
+
+def prepare_dense(data):
+    """
+    The old path: dense One-Hot frame, z-transformation of all float columns
+    """
+    categorical = ['fuel', 'model']
+    encoder = OneHotEncoder(sparse_output=False, drop='first')
+    encoded = pd.DataFrame(encoder.fit_transform(data[categorical]),
+                           columns=encoder.get_feature_names_out(categorical))
+    frame = pd.concat([data.drop(columns=categorical), encoded], axis=1)
+    frame[frame.columns] = StandardScaler().fit_transform(frame)
+    return frame.to_numpy(dtype=float)
+
+
+def prepare_encoded(data, encoding):
+    """
+    The new path with the given encoding of the high-cardinality column
+    """
+    categorical = ['fuel', 'model']
+    counts = {column: data[column].astype(str).value_counts().to_dict() for column in categorical}
+    encoder = CategoricalEncoder(counts, encoding=encoding, limit=1000)
+    encoded, _ = encoder.transform(data)
+    numeric = pd.concat([data.drop(columns=categorical), encoder.frequency_columns(data)], axis=1)
+    numeric = StandardScaler().fit_transform(numeric.to_numpy(dtype=float))
+    if encoded.shape[1] > 0:
+        encoded = encoded_scaler('z').fit_transform(encoded)
+    return combine_features(numeric, encoded)
+
+
+def measure(variant, rows, models, k_value, max_iterations):
+    """
+    Prepares and clusters the data with one variant
+
+    Returns:
+        tuple: (preparation s, fit s, columns, matrix MB, peak RSS above the raw data in MB)
+    """
+    data = make_cars(rows, models)
+    baseline = peak_rss()
+
+    begin = time.perf_counter()
+    if variant.startswith("dense"):
+        matrix = prepare_dense(data)
+    else:
+        matrix = prepare_encoded(data, {"sparse one-hot": "one-hot"}.get(variant, variant))
+    prepared = time.perf_counter()
+    if variant.startswith("dense"):
+        KMeans(n_clusters=k_value, n_init=1, max_iter=max_iterations, random_state=0).fit(matrix)
+    else:
+        engine = KMeansEngine(matrix, 1e-4)
+        engine.fit(engine.initial_centers(k_value, "k-means++", check_random_state(0)), max_iterations)
+    fitted = time.perf_counter()
+
+    size = matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes if hasattr(matrix, "indptr") \
+        else matrix.nbytes
+    return prepared - begin, fitted - prepared, matrix.shape[1], size / 2 ** 20, peak_rss() - baseline
+
+
+def main():
+    """
+    Runs the benchmark
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--models", type=int, default=5000)
+    parser.add_argument("--k", type=int, default=8)
+    parser.add_argument("--max-iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    print(f"{args.rows} rows, {args.models} models, k={args.k}, {args.max_iterations} iterations")
+    print(f"{'variant':<20} {'prepare [s]':>12} {'fit [s]':>9} {'columns':>8} {'matrix [MB]':>12} "
+          f"{'peak RSS [MB]':>14}")
+    with context.Pool(1, maxtasksperchild=1) as pool:
+        for variant in VARIANTS:
+            prepare, fit, columns, size, rss = pool.apply(
+                measure, (variant, args.rows, args.models, args.k, args.max_iterations))
+            print(f"{variant:<20} {prepare:>12.2f} {fit:>9.2f} {columns:>8} {size:>12.1f} {rss:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
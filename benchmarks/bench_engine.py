@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Engine benchmark: sklearn's KMeans versus the numpy engine of the project
+
+Fits one k-means run from the same initial centroids over a grid of rows
+(n), columns (d) and clusters (k), with sklearn (the float64 matrix as it
+was handed over by run_kmeans_one_k) and with the KMeansEngine in float64
+and float32. Every fit runs in a fresh process, so the reported peak RSS
+is the memory the fit needs on top of the data.
+
+    python -m benchmarks.bench_engine --rows 100000 1000000 --columns 8 32 --clusters 8 32
+"""
+import time
+import argparse
+import resource
+import itertools
+import multiprocessing
+import numpy as np
+from threadpoolctl import threadpool_limits
+from sklearn.cluster import KMeans
+from app.kmeans_engine import KMeansEngine
+
+VARIANTS = ("sklearn lloyd", "numpy lloyd float64", "numpy lloyd float32", "numpy elkan float32")
+
+
+def peak_rss():
+    """
+    Returns the peak resident set size of this process in MB
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(variant, rows, columns, k_value, max_iterations, threads):
+    """
+    Fits one variant on fresh data
+
+    Returns:
+        tuple: (wall time in seconds, iterations, inertia, peak RSS above the data in MB)
+    """
+    rng = np.random.default_rng(0)
+    matrix = rng.normal(size=(rows, columns))
+    matrix[:rows // 2] += 2
+    start = matrix[rng.choice(rows, k_value, replace=False)]
+    baseline = peak_rss()
+
+    with threadpool_limits(limits=threads):
+        begin = time.perf_counter()
+        if variant.startswith("sklearn"):
+            kmeans = KMeans(n_clusters=k_value, init=start, n_init=1, max_iter=max_iterations,
+                            tol=1e-4).fit(matrix)
+        else:
+            _, algorithm, dtype = variant.split()
+            engine = KMeansEngine(matrix, 1e-4, float32=dtype == "float32")
+            kmeans = engine.fit(start, max_iterations, algorithm)
+        wall = time.perf_counter() - begin
+    return wall, kmeans.n_iter_, kmeans.inertia_, peak_rss() - baseline
+
+
+def main():
+    """
+    Runs the benchmark
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, nargs="+", default=[100000, 1000000])
+    parser.add_argument("--columns", type=int, nargs="+", default=[8, 32])
+    parser.add_argument("--clusters", type=int, nargs="+", default=[8, 32])
+    parser.add_argument("--max-iterations", type=int, default=50)
+    parser.add_argument("--threads", type=int, default=1)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    print(f"{'n':>9} {'d':>4} {'k':>4} {'variant':<22} {'time [s]':>9} {'iter':>5} "
+          f"{'inertia':>14} {'peak RSS [MB]':>14}")
+    with context.Pool(1, maxtasksperchild=1) as pool:
+        for rows, columns, k_value in itertools.product(args.rows, args.columns, args.clusters):
+            for variant in VARIANTS:
+                wall, iterations, inertia, rss = pool.apply(
+                    measure, (variant, rows, columns, k_value, args.max_iterations, args.threads))
+                print(f"{rows:>9} {columns:>4} {k_value:>4} {variant:<22} {wall:>9.2f} {iterations:>5} "
+                      f"{inertia:>14.6g} {rss:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Excel benchmark: read time of a generated xlsx workbook
+
+Compares the old pd.read_excel path (openpyxl on the whole body in a
+BytesIO) with the streamed, columnar openpyxl reader, calamine (if
+python-calamine is installed) and loading the converted copy kept by the
+dataset store for a re-submitted workbook.
+
+    python -m benchmarks.bench_excel --rows 100000
+"""
+import io
+import os
+import time
+import argparse
+import tempfile
+from importlib.util import find_spec
+import numpy as np
+import pandas as pd
+from app import utils
+from app.datasets import DatasetStore
+from app.utils import read_xlsx, read_spooled
+
+
+def make_xlsx(path, rows, seed=0):
+    """
+    Writes a workbook with numeric and categorical columns
+    """
+    rng = np.random.default_rng(seed)
+    dataframe = pd.DataFrame({
+        "mileage": rng.integers(0, 300000, rows),
+        "price": rng.normal(15000, 5000, rows).round(2),
+        "hp": rng.integers(60, 400, rows),
+        "consumption": rng.normal(6, 1.5, rows).round(1),
+        "make": rng.choice(["BMW", "Audi", "Opel", "Ford", "Skoda"], rows),
+        "fuel": rng.choice(["Diesel", "Gasoline", "Electric"], rows),
+    })
+    dataframe.to_excel(path, index=False, engine="openpyxl")
+
+
+def read_excel_old(path):
+    """
+    The reader before the columnar path
+    """
+    with open(path, "rb") as file:
+        return pd.read_excel(io.BytesIO(file.read()), engine="openpyxl")
+
+
+def with_engine(engine, path):
+    """
+    Reads the workbook with read_xlsx and the given engine
+    """
+    utils.XLSX_ENGINE = engine
+    with open(path, "rb") as file:
+        return read_xlsx(file)
+
+
+def measure(function, repeat):
+    """
+    Returns the best wall time of function()
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - begin)
+    return best
+
+
+def main():
+    """
+    Runs the benchmark
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "data.xlsx")
+        make_xlsx(path, args.rows)
+        print(f"{args.rows} rows, {os.path.getsize(path) / 1e6:.1f} MB")
+
+        store = DatasetStore(os.path.join(directory, "datasets"))
+        source = {"path": path, "filename": "data.xlsx", "dataset_id": "bench"}
+        utils.XLSX_ENGINE = "openpyxl"
+        read_spooled(source, store)
+
+        readers = {
+            "pd.read_excel (old)": lambda: read_excel_old(path),
+            "columnar openpyxl": lambda: with_engine("openpyxl", path),
+        }
+        if find_spec("python_calamine") is not None:
+            readers["calamine"] = lambda: with_engine("calamine", path)
+        readers["converted copy"] = lambda: read_spooled(source, store)
+
+        print(f"{'reader':<22} {'time [s]':>10} {'rows/s':>12}")
+        for name, function in readers.items():
+            wall = measure(function, args.repeat)
+            print(f"{name:<22} {wall:>10.2f} {args.rows / wall:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Load benchmark: thread-per-request versus the redis worker queue
+
+Starts a burst of k-means jobs with both models and reports the throughput
+and the latency percentiles from submission to completion.
+Needs a running redis server (REDIS_HOST/REDIS_PORT).
+
+    python -m benchmarks.bench_executor --jobs 32 --rows 20000
+"""
+import os
+import time
+import uuid
+import argparse
+import threading
+import numpy as np
+import pandas as pd
+import redis
+from app.executor import JobExecutor
+from app.kmeans_methods import run_kmeans_one_k
+from app.task_store import TaskStore
+
+REDIS_HOST = os.environ.get('REDIS_HOST', 'localhost')
+REDIS_PORT = os.environ.get('REDIS_PORT', '6379')
+
+
+def make_data(rows, columns, seed=0):
+    """
+    Creates a random numeric dataframe
+    """
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(rng.normal(size=(rows, columns)), columns=[f"c{i}" for i in range(columns)])
+
+
+def wait_for(redis_client, task_ids, started):
+    """
+    Polls redis until all tasks are finished and returns their latencies
+    """
+    latencies = {}
+    while len(latencies) < len(task_ids):
+        for task_id in task_ids:
+            if task_id not in latencies and redis_client.hget(task_id, 'status') in ("completed", "Bad Request"):
+                latencies[task_id] = time.perf_counter() - started[task_id]
+        time.sleep(0.005)
+    return list(latencies.values())
+
+
+def run_threads(task_store, dataframe, jobs, k):
+    """
+    The old model: one thread per request
+    """
+    started = {}
+    for _ in range(jobs):
+        task_id = "bench-" + str(uuid.uuid4())
+        task_store.create(task_id, "one_k", status="processing")
+        started[task_id] = time.perf_counter()
+        threading.Thread(target=run_kmeans_one_k, args=(
+            task_store, dataframe, task_id, k, 10, 300, 1e-4, "k-means++", "lloyd")).start()
+    return started
+
+
+def run_pool(executor, task_store, dataframe, jobs, k):
+    """
+    The new model: redis queue with worker processes
+    """
+    started = {}
+    for _ in range(jobs):
+        task_id = "bench-" + str(uuid.uuid4())
+        task_store.create(task_id, "one_k")
+        started[task_id] = time.perf_counter()
+        executor.submit(task_id, run_kmeans_one_k, dataframe, k, 10, 300, 1e-4, "k-means++", "lloyd")
+    return started
+
+
+def report(name, latencies, wall):
+    """
+    Prints one line of the result table
+    """
+    latencies = np.array(latencies)
+    print(f"{name:<20} {len(latencies) / wall:>10.2f} {np.percentile(latencies, 50):>10.2f}"
+          f" {np.percentile(latencies, 99):>10.2f} {wall:>10.2f}")
+
+
+def main():
+    """
+    Runs the benchmark
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--jobs", type=int, default=32)
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--columns", type=int, default=8)
+    parser.add_argument("--k", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+    task_store = TaskStore(redis_client)
+    dataframe = make_data(args.rows, args.columns)
+
+    print(f"{args.jobs} jobs, {args.rows}x{args.columns}, k={args.k}")
+    print(f"{'model':<20} {'jobs/s':>10} {'p50 [s]':>10} {'p99 [s]':>10} {'wall [s]':>10}")
+
+    begin = time.perf_counter()
+    started = run_threads(task_store, dataframe, args.jobs, args.k)
+    latencies = wait_for(redis_client, list(started), started)
+    report("thread-per-request", latencies, time.perf_counter() - begin)
+
+    executor = JobExecutor(redis_client, REDIS_HOST, REDIS_PORT,
+                           workers=args.workers, queue_size=args.jobs, prefix="bench:")
+    # Start the worker processes before measuring
+    warmup = run_pool(executor, task_store, dataframe, args.workers, args.k)
+    wait_for(redis_client, list(warmup), warmup)
+
+    begin = time.perf_counter()
+    started = run_pool(executor, task_store, dataframe, args.jobs, args.k)
+    latencies = wait_for(redis_client, list(started), started)
+    report("worker queue", latencies, time.perf_counter() - begin)
+    executor.shutdown()
+
+    for task_id in redis_client.scan_iter("bench-*"):
+        redis_client.delete(task_id)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Ingestion benchmark: parse throughput and peak memory of read_file
+
+Compares the current reader with the old whole-body decode and
+python-engine parser on a generated csv file.
+
+    python -m benchmarks.bench_ingestion --rows 1000000
+"""
+import os
+import time
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+import pandas as pd
+from app.utils import read_file, read_csv_fallback
+
+
+def make_csv(path, rows, delimiter=";", decimal=",", seed=0):
+    """
+    Writes a csv file with numeric and categorical columns
+    """
+    rng = np.random.default_rng(seed)
+    dataframe = pd.DataFrame({
+        "mileage": rng.integers(0, 300000, rows),
+        "price": rng.normal(15000, 5000, rows).round(2),
+        "hp": rng.integers(60, 400, rows),
+        "consumption": rng.normal(6, 1.5, rows).round(1),
+        "make": rng.choice(["BMW", "Audi", "Opel", "Ford", "Skoda"], rows),
+        "fuel": rng.choice(["Diesel", "Gasoline", "Electric"], rows),
+    })
+    dataframe.to_csv(path, sep=delimiter, decimal=decimal, index=False)
+
+
+def measure(function, path, repeat):
+    """
+    Returns the best wall time and the peak traced memory of function(file)
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        with open(path, "rb") as file:
+            begin = time.perf_counter()
+            function(file)
+            best = min(best, time.perf_counter() - begin)
+
+    with open(path, "rb") as file:
+        tracemalloc.start()
+        function(file)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return best, peak
+
+
+def main():
+    """
+    Runs the benchmark
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.NamedTemporaryFile(suffix=".csv") as tmp:
+        make_csv(tmp.name, args.rows)
+        size = os.path.getsize(tmp.name)
+        print(f"{args.rows} rows, {size / 1e6:.1f} MB")
+        print(f"{'reader':<22} {'time [s]':>10} {'MB/s':>10} {'peak [MB]':>10}")
+
+        readers = {
+            "python engine (old)": read_csv_fallback,
+            "chunked C engine": lambda file: read_file(file, "data.csv"),
+        }
+        for name, function in readers.items():
+            wall, peak = measure(function, tmp.name, args.repeat)
+            print(f"{name:<22} {wall:>10.2f} {size / 1e6 / wall:>10.1f} {peak / 1e6:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
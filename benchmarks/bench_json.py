@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+JSON ingestion benchmark: parse throughput and peak memory of json uploads
+
+Compares the old path (json.load of the whole upload, then
+pd.DataFrame(data_points)) with the streamed parser, on a generated
+data_points file and the same points as NDJSON.
+
+    python -m benchmarks.bench_json --points 1000000
+"""
+import os
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+import pandas as pd
+from app.utils import read_file
+
+
+def make_json(path, ndjson_path, points, dimensions, seed=0):
+    """
+    Writes points as {"data_points": [[...], ...]} and as one json array per line
+    """
+    rng = np.random.default_rng(seed)
+    values = rng.normal(0, 100, (points, dimensions)).round(3).tolist()
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump({"data_points": values}, file)
+    with open(ndjson_path, "w", encoding="utf-8") as file:
+        file.writelines(json.dumps(value) + "\n" for value in values)
+
+
+def read_json_old(file):
+    """
+    The reader before the streamed parser
+    """
+    with file as json_file:
+        data = json.load(json_file)
+    return pd.DataFrame(data.get("data_points", []))
+
+
+def measure(function, path, repeat):
+    """
+    Returns the best wall time and the peak traced memory of function(file)
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        with open(path, "rb") as file:
+            begin = time.perf_counter()
+            function(file)
+            best = min(best, time.perf_counter() - begin)
+
+    with open(path, "rb") as file:
+        tracemalloc.start()
+        function(file)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return best, peak
+
+
+def main():
+    """
+    Runs the benchmark
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--points", type=int, default=1000000)
+    parser.add_argument("--dimensions", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "data.json")
+        ndjson_path = os.path.join(directory, "data.ndjson")
+        make_json(path, ndjson_path, args.points, args.dimensions)
+        size = os.path.getsize(path)
+        print(f"{args.points} points, {size / 1e6:.1f} MB")
+        print(f"{'reader':<22} {'time [s]':>10} {'MB/s':>10} {'peak [MB]':>10}")
+
+        readers = {
+            "json.load (old)": (read_json_old, path),
+            "streamed data_points": (lambda file: read_file(file, "data.json"), path),
+            "streamed ndjson": (lambda file: read_file(file, "data.ndjson"), ndjson_path),
+        }
+        for name, (function, file_path) in readers.items():
+            wall, peak = measure(function, file_path, args.repeat)
+            print(f"{name:<22} {wall:>10.2f} {size / 1e6 / wall:>10.1f} {peak / 1e6:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
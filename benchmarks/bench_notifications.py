@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Status benchmark: polling versus long polling of /kmeans/status
+
+N jobs run concurrently, each is followed by one client until it is
+completed. The jobs are simulated by a thread which writes status and
+progress updates to the task store, so only the cost of following them
+is measured. Reported are the HTTP requests/s the API has to serve, the
+redis commands/s issued by the API and the delay between the completion
+of a job and the client seeing it.
+Needs a running redis server (REDIS_HOST/REDIS_PORT).
+
+    python -m benchmarks.bench_notifications --jobs 50 --duration 5
+"""
+import time
+import uuid
+import asyncio
+import argparse
+import threading
+import httpx
+import numpy as np
+import redis
+from app import main as api
+from app.task_store import TaskStore
+
+# Eigene Verbindung der simulierten Jobs, ihre Schreibzugriffe zählen nicht zur API
+writer = TaskStore(redis.Redis(host=api.REDIS_HOST, port=api.REDIS_PORT, decode_responses=True))
+
+
+class CountingConnection(redis.connection.Connection):
+    """
+    Redis connection counting the commands sent by the API
+    """
+    commands = 0
+
+    def send_command(self, *args, **kwargs):
+        CountingConnection.commands += 1
+        return super().send_command(*args, **kwargs)
+
+    def pack_commands(self, commands):
+        commands = list(commands)
+        CountingConnection.commands += len(commands)
+        return super().pack_commands(commands)
+
+
+def simulate_jobs(task_ids, duration, updates, completed):
+    """
+    Runs the fake jobs: processing, a progress update every 1/updates seconds, completed
+    """
+    for task_id in task_ids:
+        writer.update(task_id, status="processing")
+    begin = time.perf_counter()
+    iteration = 0
+    while time.perf_counter() - begin < duration:
+        time.sleep(1 / updates)
+        iteration += 1
+        for task_id in task_ids:
+            writer.update(task_id, progress=f'{{"iteration": {iteration}}}')
+    for task_id in task_ids:
+        completed[task_id] = time.perf_counter()
+        writer.update(task_id, status="completed")
+
+
+async def follow(client, task_id, poll_interval, wait, seen):
+    """
+    Requests the status of a task until it is completed
+
+    Returns:
+        int: The number of requests
+    """
+    requests = 0
+    while True:
+        params = {"wait": wait} if wait else {}
+        response = await client.get(f"/kmeans/status/{task_id}", params=params)
+        requests += 1
+        if response.json()["status"] == "completed":
+            seen[task_id] = time.perf_counter()
+            return requests
+        if not wait:
+            await asyncio.sleep(poll_interval)
+
+
+async def run_model(args, wait):
+    """
+    Runs the jobs once and follows them by polling (wait=0) or long polling
+
+    Returns:
+        tuple: (HTTP requests/s, redis commands/s, p50 and p99 notification delay in seconds)
+    """
+    task_ids = [f"bench-{uuid.uuid4()}" for _ in range(args.jobs)]
+    for task_id in task_ids:
+        writer.create(task_id, "one_k")
+    completed, seen = {}, {}
+
+    transport = httpx.ASGITransport(app=api.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+        commands = CountingConnection.commands
+        begin = time.perf_counter()
+        simulator = threading.Thread(target=simulate_jobs,
+                                     args=(task_ids, args.duration, args.updates, completed))
+        simulator.start()
+        requests = await asyncio.gather(*(follow(client, task_id, args.poll_interval, wait, seen)
+                                          for task_id in task_ids))
+        wall = time.perf_counter() - begin
+        simulator.join()
+        commands = CountingConnection.commands - commands
+
+    for task_id in task_ids:
+        writer.delete(task_id)
+    delays = np.array([seen[task_id] - completed[task_id] for task_id in task_ids])
+    return sum(requests) / wall, commands / wall, np.percentile(delays, 50), np.percentile(delays, 99)
+
+
+def main():
+    """
+    Runs the benchmark
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--jobs", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--updates", type=float, default=2, help="progress writes per job and second")
+    parser.add_argument("--poll-interval", type=float, default=0.25)
+    args = parser.parse_args()
+
+    api.redis_client.connection_pool.connection_class = CountingConnection
+    api.redis_client.connection_pool.reset()
+
+    print(f"{args.jobs} jobs of {args.duration} s, {args.updates} progress writes per job and second")
+    print(f"{'model':<28} {'requests/s':>12} {'redis cmds/s':>14} {'p50 delay [s]':>14} {'p99 delay [s]':>14}")
+    for name, wait in ((f"polling every {args.poll_interval} s", 0), ("long poll ?wait=30", 30)):
+        requests, commands, p50, p99 = asyncio.run(run_model(args, wait))
+        print(f"{name:<28} {requests:>12.1f} {commands:>14.1f} {p50:>14.3f} {p99:>14.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Prediction benchmark: throughput of assigning new raw rows to a stored model
+
+Fits a model on generated car data (numeric, comma decimal, date and
+categorical columns), stores it in a model registry and measures the
+latency of loading it from disk and from the in-memory cache, the rows/s
+of model.predict on JSON-like rows for several batch sizes, and the
+nearest-centroid assignment alone against sklearn's pairwise_distances_argmin_min.
+
+    python -m benchmarks.bench_predict --rows 100000 --k 16
+"""
+import time
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+from sklearn.metrics import pairwise_distances_argmin_min
+from app.datacheck import StreamingPreparation
+from app.kmeans_methods import fit_kmeans
+from app.models import KMeansModel, ModelRegistry, nearest_centroids
+
+
+def make_rows(rows, seed=0):
+    """
+    Returns raw car rows as they arrive in a json upload
+    """
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'mileage': rng.integers(0, 300000, rows),
+        'price': [f"{value:.2f}".replace(".", ",") for value in rng.normal(15000, 5000, rows)],
+        'hp': rng.integers(60, 400, rows),
+        'registered': [f"{day:02d}.{month:02d}.{year}" for day, month, year in
+                       zip(rng.integers(1, 29, rows), rng.integers(1, 13, rows), rng.integers(2005, 2024, rows))],
+        'make': rng.choice(["BMW", "Audi", "Opel", "Ford", "Skoda", "Fiat", "Seat", "Kia"], rows),
+        'fuel': rng.choice(["Diesel", "Gasoline", "Electric"], rows),
+    })
+
+
+def fit_model(dataframe, k_value):
+    """
+    Prepares the data, fits k-means and returns the model
+    """
+    preparation = StreamingPreparation("z")
+    preparation.observe(dataframe)
+    preparation.count(dataframe)
+    preparation.build_encoder()
+    preparation.fit_scaler(dataframe)
+    _, matrix = preparation.transform(dataframe)
+    kmeans = fit_kmeans(matrix, k_value, 1, 100, 1e-4, "k-means++", "lloyd", 0)
+    return KMeansModel(kmeans.cluster_centers_, preparation), matrix
+
+
+def best_time(function, repeat):
+    """
+    Returns the best wall time of function()
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - begin)
+    return best
+
+
+def main():
+    """
+    Runs the benchmark
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--k", type=int, default=16)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    dataframe = make_rows(args.rows)
+    model, matrix = fit_model(dataframe, args.k)
+    records = dataframe.astype(object).to_dict("records")
+    print(f"{args.rows} rows, k={args.k}, {matrix.shape[1]} features")
+
+    with tempfile.TemporaryDirectory() as directory:
+        model_id = ModelRegistry(directory).save(model)
+        disk = best_time(lambda: ModelRegistry(directory).load(model_id), args.repeat)
+        registry = ModelRegistry(directory)
+        registry.load(model_id)
+        memory = best_time(lambda: registry.load(model_id), args.repeat)
+    print(f"load from disk {disk * 1e3:.2f} ms, from memory {memory * 1e6:.1f} us")
+
+    print(f"{'batch':>8} {'time [ms]':>10} {'rows/s':>12}")
+    for batch in (1, 100, 10000, args.rows):
+        rows = records[:batch]
+        wall = best_time(lambda rows=rows: model.predict(rows), args.repeat)
+        print(f"{batch:>8} {wall * 1e3:>10.2f} {batch / wall:>12.0f}")
+
+    print(f"{'assignment':<28} {'time [ms]':>10} {'rows/s':>12}")
+    for name, function in (("pairwise_distances_argmin_min", pairwise_distances_argmin_min),
+                           ("nearest_centroids", nearest_centroids)):
+        wall = best_time(lambda function=function: function(matrix, model.cluster_centers), args.repeat)
+        print(f"{name:<28} {wall * 1e3:>10.2f} {args.rows / wall:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Result format benchmark: build time and size of a k-means result
+
+Compares the old result path (one boolean mask per cluster, json with
+indent=2, parsed again and re-serialised by the result endpoint) with the
+single-pass grouping into compact json and with the npz payload of labels
+and centroids.
+
+    python -m benchmarks.bench_results --rows 1000000 --k 8
+"""
+import json
+import time
+import argparse
+import numpy as np
+from app.utils import dataframe_to_json_str, result_to_npz, npz_from_result
+from benchmarks.bench_executor import make_data
+
+
+def legacy_result(dataframe, cluster_labels, centroids):
+    """
+    The old path: mask per cluster, indented json, json.loads and dumps in the endpoint
+    """
+    data = [{"centroids": centroids[cluster].tolist(),
+             "data_points": dataframe[cluster_labels == cluster].values.tolist()}
+            for cluster in set(cluster_labels)]
+    stored = json.dumps({"Cluster": data}, indent=2)
+    return json.dumps(json.loads(stored)), len(stored)
+
+
+def measure(function, repeat):
+    """
+    Returns the best wall time of function() and its last return value
+    """
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - begin)
+    return best, result
+
+
+def main():
+    """
+    Runs the benchmark
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--columns", type=int, default=8)
+    parser.add_argument("--k", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    dataframe = make_data(args.rows, args.columns)
+    rng = np.random.default_rng(0)
+    labels = rng.integers(0, args.k, args.rows)
+    centroids = rng.normal(size=(args.k, args.columns))
+
+    print(f"{args.rows}x{args.columns}, k={args.k}")
+    print(f"{'format':<26} {'time [s]':>10} {'stored [MB]':>12}")
+
+    wall, (_, size) = measure(lambda: legacy_result(dataframe, labels, centroids), args.repeat)
+    print(f"{'json, mask per cluster':<26} {wall:>10.2f} {size / 1e6:>12.1f}")
+
+    wall, stored = measure(lambda: dataframe_to_json_str(dataframe, labels, centroids), args.repeat)
+    print(f"{'json, single pass':<26} {wall:>10.2f} {len(stored) / 1e6:>12.1f}")
+
+    wall, stored = measure(lambda: result_to_npz(labels, centroids), args.repeat)
+    print(f"{'npz (base64 in redis)':<26} {wall:>10.2f} {len(stored) / 1e6:>12.1f}")
+    print(f"{'npz response body':<26} {'':>10} {len(npz_from_result(stored)) / 1e6:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Scoring benchmark: sklearn's full silhouette, Davies-Bouldin and Calinski-Harabasz
+versus the sampled silhouette and the indices from labels and centroids
+
+The full silhouette needs the distances of all pairs of rows, the sampled
+one those of SILHOUETTE_SAMPLE stratified rows in chunks of
+SILHOUETTE_WORKING_MEMORY megabytes. Every variant runs in a fresh
+process, so the peak RSS is its own.
+
+    python -m benchmarks.bench_scoring --rows 20000 50000 --clusters 16
+"""
+import time
+import argparse
+import itertools
+import multiprocessing
+import numpy as np
+from threadpoolctl import threadpool_limits
+from sklearn.datasets import make_blobs
+from sklearn.metrics import calinski_harabasz_score, davies_bouldin_score, silhouette_score
+from app.scoring import score_clustering
+from benchmarks.bench_engine import peak_rss
+
+VARIANTS = ("sklearn, full", "sampled, O(n·k)")
+
+
+def measure(variant, rows, k_value):
+    """
+    Scores the true labels of fresh blobs with one variant
+
+    Returns:
+        tuple: (seconds, silhouette, Davies-Bouldin, Calinski-Harabasz, peak RSS above the data in MB)
+    """
+    matrix, labels = make_blobs(rows, n_features=16, centers=k_value, cluster_std=4.0, random_state=0)
+    centers = np.array([matrix[labels == cluster].mean(axis=0) for cluster in range(k_value)])
+    baseline = peak_rss()
+    with threadpool_limits(limits=1):
+        begin = time.perf_counter()
+        if variant == "sklearn, full":
+            scores = (silhouette_score(matrix, labels), davies_bouldin_score(matrix, labels),
+                      calinski_harabasz_score(matrix, labels))
+        else:
+            scores = tuple(score_clustering(matrix, labels, centers, 0).values())
+        wall = time.perf_counter() - begin
+    return (wall,) + scores + (peak_rss() - baseline,)
+
+
+def main():
+    """
+    Runs the benchmark
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, nargs="+", default=[20000, 50000])
+    parser.add_argument("--clusters", type=int, nargs="+", default=[16])
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    print("16 columns, one thread")
+    print(f"{'n':>7} {'k':>4} {'variant':<16} {'time [s]':>9} {'silhouette':>11} {'DB':>7} {'CH':>10} "
+          f"{'peak RSS [MB]':>14}")
+    with context.Pool(1, maxtasksperchild=1) as pool:
+        for rows, k_value in itertools.product(args.rows, args.clusters):
+            for variant in VARIANTS:
+                wall, silhouette, davies, calinski, rss = pool.apply(measure, (variant, rows, k_value))
+                print(f"{rows:>7} {k_value:>4} {variant:<16} {wall:>9.2f} {silhouette:>11.4f} {davies:>7.4f} "
+                      f"{calinski:>10.1f} {rss:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Seeding benchmark: full k-means++ versus k-means||, k-means++ on a subsample and the coreset mode
+
+Fits k-means with n_init runs through fit_kmeans (numpy engine, one thread)
+on gaussian blobs and reports the time of the seeding of all runs, the
+time of the whole fit and its inertia relative to full k-means++. The
+coreset mode has no separate seeding, its inertia is that of all rows.
+
+    python -m benchmarks.bench_seeding --rows 200000 1000000 --clusters 32 128
+"""
+import time
+import argparse
+import itertools
+import multiprocessing
+from threadpoolctl import threadpool_limits
+from sklearn.datasets import make_blobs
+from sklearn.utils import check_random_state
+from app.kmeans_engine import KMeansEngine
+from app.kmeans_methods import fit_kmeans
+from app.seeding import SUMMARY_INITS, summarize, seed_from_summary
+
+VARIANTS = ("k-means++", "k-means||", "subsample", "coreset")
+
+
+def seeding_time(matrix, k_value, init, runs):
+    """
+    Returns the seconds the seeding of all runs takes, None for the coreset mode
+    """
+    if init == "coreset":
+        return None
+    engine = KMeansEngine(matrix, 1e-4)
+    generator = check_random_state(0)
+    begin = time.perf_counter()
+    if init in SUMMARY_INITS:
+        summary = summarize(engine.data, k_value, init, generator)
+        for _ in range(runs):
+            seed_from_summary(summary, k_value, generator)
+    else:
+        for _ in range(runs):
+            engine.initial_centers(k_value, init, generator)
+    return time.perf_counter() - begin
+
+
+def measure(init, rows, k_value, runs, max_iterations):
+    """
+    Seeds and fits one variant on fresh data
+
+    Returns:
+        tuple: (seeding seconds or None, fit seconds, inertia, iterations of the best run)
+    """
+    matrix, _ = make_blobs(rows, n_features=16, centers=k_value, cluster_std=2.0, random_state=0)
+    with threadpool_limits(limits=1):
+        seeding = seeding_time(matrix, k_value, init, runs)
+        begin = time.perf_counter()
+        kmeans = fit_kmeans(matrix, k_value, runs, max_iterations, 1e-4, init, "lloyd", 0)
+        wall = time.perf_counter() - begin
+    return seeding, wall, kmeans.inertia_, kmeans.n_iter_
+
+
+def main():
+    """
+    Runs the benchmark
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, nargs="+", default=[200000, 1000000])
+    parser.add_argument("--clusters", type=int, nargs="+", default=[32, 128])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--max-iterations", type=int, default=100)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    print(f"n_init={args.runs}, 16 columns")
+    print(f"{'n':>9} {'k':>4} {'init':<10} {'seeding [s]':>12} {'fit [s]':>9} {'iter':>5} {'inertia / k-means++':>20}")
+    with context.Pool(1, maxtasksperchild=1) as pool:
+        for rows, k_value in itertools.product(args.rows, args.clusters):
+            reference = None
+            for init in VARIANTS:
+                seeding, wall, inertia, iterations = pool.apply(
+                    measure, (init, rows, k_value, args.runs, args.max_iterations))
+                reference = reference or inertia
+                seeding = "-" if seeding is None else f"{seeding:.2f}"
+                print(f"{rows:>9} {k_value:>4} {init:<10} {seeding:>12} {wall:>9.2f} {iterations:>5} "
+                      f"{inertia / reference:>20.4f}")
+
+
+if __name__ == "__main__":
+    main()
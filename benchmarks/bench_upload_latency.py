@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+Upload latency benchmark: latency of /kmeans/status while large uploads are parsed
+
+Clients upload xlsx files to /kmeans/ (every upload is a different file,
+so neither the result cache nor the dataset store answers it) while one
+client polls /kmeans/status of a running task. Compared are parsing on the
+event loop like before, parsing in the thread pool of the API process
+(INGEST_WORKERS=0) and parsing in the pool of processes. The clustering
+jobs only queue (KMEANS_WORKERS=0) and are removed afterwards.
+Needs a running redis server (REDIS_HOST/REDIS_PORT).
+
+    python -m benchmarks.bench_upload_latency --rows 20000 --uploads 4 --duration 20
+"""
+import io
+import os
+import time
+import uuid
+import asyncio
+import zipfile
+import argparse
+import httpx
+import numpy as np
+import pandas as pd
+
+os.environ.setdefault("KMEANS_WORKERS", "0")
+# pylint: disable=wrong-import-position
+from app import main as api
+from app.ingestion import IngestionPool
+
+
+class InlineIngestion(IngestionPool):
+    """
+    Parses on the event loop, as the endpoints did before the ingestion pool
+    """
+
+    async def run(self, function, *args):
+        return function(*args)
+
+
+def make_xlsx(rows, seed=0):
+    """
+    Returns an xlsx file with numeric and categorical columns
+    """
+    rng = np.random.default_rng(seed)
+    dataframe = pd.DataFrame({
+        "mileage": rng.integers(0, 300000, rows),
+        "price": rng.normal(15000, 5000, rows).round(2),
+        "hp": rng.integers(60, 400, rows),
+        "make": rng.choice(["BMW", "Audi", "Opel", "Ford", "Skoda"], rows),
+        "fuel": rng.choice(["Diesel", "Gasoline", "Electric"], rows),
+    })
+    buffer = io.BytesIO()
+    dataframe.to_excel(buffer, index=False, engine="openpyxl")
+    return buffer.getvalue()
+
+
+def unique_copy(content):
+    """
+    Returns the xlsx file with a new zip comment, the same data under a new hash
+    """
+    buffer = io.BytesIO(content)
+    with zipfile.ZipFile(buffer, "a") as archive:
+        archive.comment = uuid.uuid4().hex.encode()
+    return buffer.getvalue()
+
+
+async def upload_loop(client, content, deadline, latencies, task_ids):
+    """
+    Uploads unique copies of the file one after another until the deadline
+    """
+    while time.perf_counter() < deadline:
+        begin = time.perf_counter()
+        response = await client.post("/kmeans/", params={"k": 3, "number_kmeans_runs": 1},
+                                     files={"file": ("cars.xlsx", unique_copy(content))})
+        latencies.append(time.perf_counter() - begin)
+        if response.status_code == 200:
+            task_ids.append(response.json()["TaskID"])
+
+
+async def poll_loop(client, task_id, deadline, interval, latencies):
+    """
+    Requests the status of a task every interval seconds until the deadline.
+    The latency is measured from the time the poll was due, so a blocked
+    event loop, which also delays sending the poll, is counted.
+    """
+    due = time.perf_counter()
+    while due < deadline:
+        await asyncio.sleep(max(0.0, due - time.perf_counter()))
+        await client.get(f"/kmeans/status/{task_id}")
+        finished = time.perf_counter()
+        latencies.append(finished - due)
+        # Fällige, aber verpasste Abfragen zählen mit ihrer Wartezeit
+        while due + interval < finished:
+            due += interval
+            latencies.append(finished - due)
+        due += interval
+
+
+async def run_variant(ingestion, content, args):
+    """
+    Runs the uploads and the status polls with one ingestion
+
+    Returns:
+        tuple: (status latencies, upload latencies) in seconds
+    """
+    api.ingestion = ingestion
+    await asyncio.gather(*(asyncio.wrap_future(future) for future in ingestion.start()))
+    task_id = f"bench-{uuid.uuid4()}"
+    api.task_store.create(task_id, "one_k", status="processing")
+    status_latencies, upload_latencies, task_ids = [], [], []
+
+    transport = httpx.ASGITransport(app=api.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=600) as client:
+        deadline = time.perf_counter() + args.duration
+        await asyncio.gather(poll_loop(client, task_id, deadline, args.poll_interval, status_latencies),
+                             *(upload_loop(client, content, deadline, upload_latencies, task_ids)
+                               for _ in range(args.uploads)))
+    ingestion.shutdown()
+
+    # Die Jobs warten nur in der Warteschlange und werden wieder entfernt
+    for queued_id in task_ids + [task_id]:
+        api.executor.cancel(queued_id)
+        api.task_store.delete(queued_id)
+    return np.array(status_latencies), np.array(upload_latencies)
+
+
+def main():
+    """
+    Runs the benchmark
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--uploads", type=int, default=4, help="concurrent uploading clients")
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--poll-interval", type=float, default=0.05)
+    parser.add_argument("--workers", type=int, default=2, help="parsing processes")
+    args = parser.parse_args()
+
+    content = make_xlsx(args.rows)
+    variants = (("event loop (old)", InlineIngestion(workers=0)),
+                ("thread pool", IngestionPool(workers=0)),
+                (f"{args.workers} processes", IngestionPool(workers=args.workers)))
+    print(f"{args.uploads} concurrent xlsx uploads of {args.rows} rows ({len(content) / 1e6:.1f} MB), "
+          f"status polled every {args.poll_interval} s for {args.duration} s")
+    print(f"{'parsing':<18} {'polls':>6} {'p50 [ms]':>9} {'p99 [ms]':>9} {'max [ms]':>9} "
+          f"{'uploads':>8} {'upload p50 [s]':>15}")
+    for name, ingestion in variants:
+        status, uploads = asyncio.run(run_variant(ingestion, content, args))
+        print(f"{name:<18} {len(status):>6} {np.percentile(status, 50) * 1000:>9.1f} "
+              f"{np.percentile(status, 99) * 1000:>9.1f} {status.max() * 1000:>9.1f} "
+              f"{len(uploads):>8} {np.percentile(uploads, 50):>15.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+"""
+    Shared test setup: a local redis stand-in and an empty dataset store
+"""
+import os
+import socket
+import tempfile
+import threading
+from fakeredis import TcpFakeServer
+
+class NoDelayServer(TcpFakeServer):
+    """
+    Answers without Nagle's delay, otherwise every pipelined write waits for a delayed ACK
+    """
+    def get_request(self):
+        connection, address = super().get_request()
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return connection, address
+
+# Ohne REDIS_HOST laufen die Tests gegen einen lokalen Redis-Ersatz,
+# den auch die Worker-Prozesse über TCP erreichen
+if "REDIS_HOST" not in os.environ:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    server = NoDelayServer(("127.0.0.1", port), server_type="redis")
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ["REDIS_HOST"] = "127.0.0.1"
+    os.environ["REDIS_PORT"] = str(port)
+
+os.environ.setdefault("DATASET_DIR", tempfile.mkdtemp(prefix="test-datasets-"))
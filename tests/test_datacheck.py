@@ -0,0 +1,159 @@
+"""
+    Testing the encoding of categorical columns with pytest
+"""
+import os
+import uuid
+import redis
+import numpy as np
+import pandas as pd
+import scipy.sparse
+from app import datacheck
+from app.datacheck import CategoricalEncoder, StreamingPreparation, clean_columns, prepare_data
+from app.kmeans_methods import run_kmeans_one_k
+from app.task_store import TaskStore
+
+REDIS_HOST = os.environ.get('REDIS_HOST', 'localhost')
+REDIS_PORT = os.environ.get('REDIS_PORT', '6379')
+
+task_store = TaskStore(redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True))
+
+def make_cars(rows=3000, models=400, seed=0):
+    """
+    Returns numeric columns and a high-cardinality "model" column like in the autoscout data
+    """
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'mileage': rng.normal(80000, 20000, rows),
+        'price': rng.normal(20000, 5000, rows),
+        'fuel': rng.choice(['Diesel', 'Gasoline', 'Electric'], rows),
+        'model': [f"model-{value}" for value in rng.integers(0, models, rows)]})
+
+def test_one_hot_stays_sparse():
+    """
+    Test that a wide One-Hot encoding stays CSR, matches pandas' dummies and is clustered
+    """
+    data = make_cars()
+    task_id = str(uuid.uuid4())
+    task_store.create(task_id, "one_k", status="processing")
+    _, matrix = prepare_data(task_store, data, task_id, "z")
+    assert scipy.sparse.isspmatrix_csr(matrix)
+
+    dummies = pd.get_dummies(data[['fuel', 'model']], drop_first=True, dtype=float)
+    assert matrix.shape == (len(data), 2 + dummies.shape[1])
+    encoded = matrix[:, 2:].toarray()
+    np.testing.assert_allclose(encoded / encoded.max(axis=0), dummies.to_numpy())
+
+    run_kmeans_one_k(task_store, data, task_id, 4, 2, 100, 1e-4, "k-means++", "lloyd", normalization="z")
+    assert task_store.field(task_id, "status") == "completed"
+
+def test_dense_when_dense_is_cheaper(monkeypatch):
+    """
+    Test that a matrix with few categories is returned dense
+    """
+    monkeypatch.setattr(datacheck, "SPARSE_MAX_DENSITY", 0.1)
+    data = make_cars(models=3)
+    task_id = str(uuid.uuid4())
+    task_store.create(task_id, "one_k", status="processing")
+    _, matrix = prepare_data(task_store, data, task_id, None)
+    assert isinstance(matrix, np.ndarray)
+    assert matrix.shape == (len(data), 2 + 2 + 2)
+
+def test_high_cardinality_encodings():
+    """
+    Test the frequency and the hashing encoding of a column above the category limit
+    """
+    data = make_cars(rows=1000, models=400)
+    counts = {column: data[column].value_counts().to_dict() for column in ('fuel', 'model')}
+
+    encoder = CategoricalEncoder(counts, encoding="frequency", limit=100)
+    encoded, names = encoder.transform(data)
+    assert encoded.shape == (1000, 2) and names == ['fuel_Electric', 'fuel_Gasoline']
+    frequencies = encoder.frequency_columns(data)['model_frequency']
+    np.testing.assert_allclose(frequencies, data['model'].map(data['model'].value_counts(normalize=True)))
+    assert "frequency encoded" in encoder.message()
+
+    encoder = CategoricalEncoder(counts, encoding="hashing", limit=100)
+    encoded, names = encoder.transform(data)
+    assert encoded.shape == (1000, 2 + datacheck.HASH_FEATURES)
+    np.testing.assert_allclose(encoded.sum(axis=1), 2 - (data['fuel'] == 'Diesel').to_numpy()[:, None])
+    assert encoder.frequency_columns(data).shape == (1000, 0)
+
+def test_typed_cleaning():
+    """
+    Test that numbers and datetimes in text columns are parsed, IDs and constants dropped
+    """
+    rows = 60
+    data = pd.DataFrame({
+        'id': np.arange(1, rows + 1),
+        'price': ['1.234,5', '12,25', ' 3 ', ''] + ['7,5'] * (rows - 4),
+        'mileage': ['1,234', '12,345', 'n/a'] + ['1,000'] * (rows - 3),
+        'registered': ['13.01.2020', '01.02.2020'] + ['05.06.2021'] * (rows - 2),
+        'country': ['DE'] * rows,
+        'model': ['316', 'Golf', 316] + ['A3'] * (rows - 3)})
+    cleaned, report = clean_columns(data)
+
+    assert list(cleaned.columns) == ['price', 'mileage', 'registered', 'model']
+    assert report['id']['reason'] == "ID-like" and report['country']['reason'] == "constant"
+    assert report['price']['locale'] == "comma" and report['mileage']['invalid'] == 1
+    assert len(cleaned) == rows - 2
+    np.testing.assert_allclose(cleaned['price'][:2], [1234.5, 12.25])
+    np.testing.assert_allclose(cleaned['mileage'][:2], [1234.0, 12345.0])
+    assert pd.to_datetime(cleaned['registered'][0], unit='s') == pd.Timestamp('2020-01-13')
+    assert isinstance(cleaned['model'].dtype, pd.CategoricalDtype)
+    assert sorted(cleaned['model'].cat.categories) == ['316', 'A3', 'Golf']
+
+def test_numbers_as_text_are_not_one_hot_encoded():
+    """
+    Test that a column of comma decimals is scaled like a number and reported in the task message
+    """
+    data = make_cars(rows=200, models=3)
+    data['price'] = data['price'].map(lambda value: f"{value:.2f}".replace(".", ","))
+    task_id = str(uuid.uuid4())
+    task_store.create(task_id, "one_k", status="processing")
+    _, matrix = prepare_data(task_store, data, task_id, "z")
+    assert matrix.shape == (200, 2 + 2 + 2)
+    assert "price numeric (comma decimals)" in task_store.field(task_id, "message")
+
+def test_streaming_uses_types_of_first_chunk():
+    """
+    Test that all chunks are cleaned with the types inferred from the first one
+    """
+    data = make_cars(rows=400, models=3)
+    data['model'] = np.resize(['316', 'Golf', 'A3'], 400)
+    # Im zweiten Chunk liest pandas die Modelle als Zahlen
+    chunks = [data[:200].reset_index(drop=True), data[200:].assign(model=316).reset_index(drop=True)]
+    preparation = StreamingPreparation('z')
+    for chunk in chunks:
+        preparation.observe(chunk)
+    for chunk in chunks:
+        preparation.count(chunk)
+    preparation.build_encoder()
+    for chunk in chunks:
+        preparation.fit_scaler(chunk)
+    matrices = [preparation.transform(chunk)[1] for chunk in chunks]
+    assert [matrix.shape for matrix in matrices] == [(200, 6), (200, 6)]
+    assert "model categorical" in preparation.message()
+
+def test_streaming_drops_columns_of_the_whole_file():
+    """
+    Test that a column constant or counting up within the first chunk only is kept,
+    and that the drop rules of the whole file equal the ones of data_check
+    """
+    data = make_cars(rows=400, models=3)
+    data['fuel'] = np.where(np.arange(400) < 200, 'Diesel', np.resize(['Diesel', 'Gasoline'], 400))
+    data['position'] = np.concatenate([np.arange(200), np.arange(200)])
+    data['id'] = np.arange(400)
+    data['serial'] = [f"S{index}" for index in range(400)]
+    chunks = [data[:200].reset_index(drop=True), data[200:].reset_index(drop=True)]
+    preparation = StreamingPreparation('z')
+    for chunk in chunks:
+        preparation.observe(chunk)
+    for chunk in chunks:
+        preparation.count(chunk)
+    preparation.build_encoder()
+
+    types = {column: entry["type"] for column, entry in preparation.types.items()}
+    assert types['fuel'] == "categorical" and types['position'] == "numeric"
+    assert types['id'] == types['serial'] == "dropped"
+    assert types == {column: entry["type"] for column, entry in clean_columns(data)[1].items()}
+    assert preparation.counts['fuel'] == {'Diesel': 300, 'Gasoline': 100}
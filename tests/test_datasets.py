@@ -0,0 +1,93 @@
+"""
+    Testing the dataset store with pytest
+"""
+import os
+import time
+import redis
+import numpy as np
+import pandas as pd
+import scipy.sparse
+from app.datasets import DatasetStore
+from app.datacheck import prepare_data
+from app.task_store import TaskStore
+
+REDIS_HOST = os.environ.get('REDIS_HOST', 'localhost')
+REDIS_PORT = os.environ.get('REDIS_PORT', '6379')
+
+task_store = TaskStore(redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True))
+
+def test_prepare_data_is_stored(tmp_path):
+    """
+    Test that the prepared matrix is stored and loaded memory-mapped by a second job
+    """
+    store = DatasetStore(str(tmp_path))
+    data = pd.DataFrame({
+        'price': [1.5, 2.5, 3.5, 4.5],
+        'make': ['BMW', 'Audi', 'BMW', 'Opel']
+    })
+    task_store.create("prep", "one_k", status="processing")
+
+    cleaned_df, matrix = prepare_data(task_store, data, "prep", "z", "abc123", store)
+    assert store.exists("abc123")
+    assert store.info("abc123")["rows"] == 4
+    assert matrix.shape == (4, 3)
+
+    task_store.update("prep", message="")
+    cached_df, cached_matrix = prepare_data(task_store, None, "prep", "z", "abc123", store)
+    assert isinstance(cached_matrix, np.memmap)
+    np.testing.assert_allclose(cached_matrix, matrix)
+    pd.testing.assert_frame_equal(cached_df, cleaned_df)
+    assert "Loaded prepared data" in task_store.field("prep", "message")
+
+def test_unknown_dataset(tmp_path):
+    """
+    Test that a job without data and with an unknown dataset fails
+    """
+    task_store.create("prep", "one_k", status="processing")
+    assert prepare_data(task_store, None, "prep", None, "unknown", DatasetStore(str(tmp_path))) == (None, None)
+    assert task_store.field("prep", "status") == "Bad Request"
+
+def test_eviction(tmp_path):
+    """
+    Test that expired and least recently used datasets are removed
+    """
+    store = DatasetStore(str(tmp_path), max_bytes=10 ** 9, ttl=3600)
+    data = pd.DataFrame({'x': np.arange(1000.0)})
+    for dataset_id in ("old", "used", "new"):
+        store.save_cleaned(dataset_id, data)
+    os.utime(store.path("old"), (0, 0))
+    store.evict()
+    assert not store.exists("old")
+
+    os.utime(store.path("used"), (time.time() - 10, time.time() - 10))
+    store.max_bytes = store.size("new") + 1
+    store.evict(keep="used")
+    assert store.exists("used")
+    assert not store.exists("new")
+
+def test_sparse_prepared_matrix(tmp_path):
+    """
+    Test that a sparse prepared matrix is stored as CSR and loaded as CSR
+    """
+    store = DatasetStore(str(tmp_path))
+    matrix = scipy.sparse.random(100, 500, density=0.01, format="csr", random_state=0)
+    store.save_prepared("sparse1", "z", matrix, {"columns": []})
+    loaded, metadata = store.load_prepared("sparse1", "z")
+    assert metadata["sparse"]
+    assert scipy.sparse.isspmatrix_csr(loaded)
+    assert (loaded != matrix).nnz == 0
+
+def test_upload_stored_as_parquet(tmp_path):
+    """
+    Test that a parsed upload is stored as Parquet with its column names
+    and that an upload Parquet cannot represent is not stored
+    """
+    store = DatasetStore(str(tmp_path))
+    for columns in (["name", "price"], ["name", 2020]):
+        upload = pd.DataFrame({"name": ["a", None, "c"], "price": [1.5, 2.0, None]}).set_axis(columns, axis=1)
+        store.save_upload("parsed", upload)
+        assert os.path.exists(store.path("parsed", "upload.parquet"))
+        pd.testing.assert_frame_equal(store.load_upload("parsed"), upload)
+
+    store.save_upload("mixed", pd.DataFrame({"value": [1, "x"]}))
+    assert store.load_upload("mixed") is None
@@ -0,0 +1,65 @@
+"""
+    Testing the bounded job executor with pytest
+"""
+import os
+import uuid
+import redis
+import pytest
+import pandas as pd
+from app.executor import JobExecutor, QueueFullError
+from app.kmeans_methods import run_kmeans_one_k
+from app.task_store import TaskStore
+
+REDIS_HOST = os.environ.get('REDIS_HOST', 'localhost')
+REDIS_PORT = os.environ.get('REDIS_PORT', '6379')
+
+redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+
+data = pd.DataFrame({'x': [1, 2, 3, 4, 5], 'y': [5, 4, 3, 2, 1]})
+
+def submit(executor, task_id):
+    """
+    Creates a task and submits a small k-means job for it
+    """
+    TaskStore(redis_client).create(task_id, "one_k")
+    executor.submit(task_id, run_kmeans_one_k, data,
+                    2, 5, 100, 1e-4, "k-means++", "lloyd")
+
+def test_queue_full():
+    """
+    Test backpressure and the queue positions without workers
+    """
+    executor = JobExecutor(redis_client, REDIS_HOST, REDIS_PORT, workers=0, queue_size=2,
+                           prefix=f"test-{uuid.uuid4().hex}:")
+    submit(executor, "executor-1")
+    submit(executor, "executor-2")
+
+    assert executor.queue_position("executor-1") == 1
+    assert executor.queue_position("executor-2") == 2
+    assert executor.stats() == {"running": 0, "queued": 2}
+
+    with pytest.raises(QueueFullError):
+        submit(executor, "executor-3")
+
+    frame = executor.job_queue.job("executor-1")[0]["frame"]
+    assert executor.cancel("executor-1")
+    assert not executor.cancel("executor-1")
+    assert not os.path.exists(frame)
+    assert executor.queue_position("executor-2") == 1
+
+def test_drain():
+    """
+    Test that the embedded workers finish the queue on shutdown
+    """
+    executor = JobExecutor(redis_client, REDIS_HOST, REDIS_PORT, workers=1, queue_size=2,
+                           prefix=f"test-{uuid.uuid4().hex}:")
+    submit(executor, "executor-4")
+    submit(executor, "executor-5")
+
+    executor.shutdown()
+    assert executor.stats() == {"running": 0, "queued": 0}
+    assert redis_client.hget("executor-4", "status") == "completed"
+    assert redis_client.hget("executor-5", "status") == "completed"
+
+    with pytest.raises(QueueFullError):
+        submit(executor, "executor-6")
@@ -0,0 +1,85 @@
+"""
+    Testing the parsing of uploads in the ingestion pool with pytest
+"""
+import os
+import asyncio
+import threading
+import pytest
+import pandas as pd
+from app.executor import QueueFullError
+from app.ingestion import IngestionPool, check_first_chunk, parse_upload
+from app.utils import spool_upload
+
+CSVFILEPATH = "tests/autoscout24-100.csv"
+
+
+def spool(path, filename=None):
+    """
+    Spools a test file like an upload
+    """
+    with open(path, "rb") as file:
+        return spool_upload(file, filename or os.path.basename(path))
+
+def test_parse_upload_pickles_frame():
+    """
+    Test that the parsed upload is handed on as pickled frame and bad files as error
+    """
+    source = spool(CSVFILEPATH)
+    result = parse_upload(source)
+    frame = pd.read_pickle(result["frame"])
+    assert result["rows"] == len(frame) == len(pd.read_csv(CSVFILEPATH))
+    assert check_first_chunk(source) == {"rows": len(frame)}
+    os.remove(result["frame"])
+
+    assert "error" in parse_upload(spool("tests/kmeans_test.error"))
+    assert "error" in parse_upload(spool("tests/kmeans_test.error", "broken.json"))
+    os.remove(source["path"])
+
+def test_pool_parses_in_a_process():
+    """
+    Test that the pool runs the parsing in its processes and gives the result back
+    """
+    pool = IngestionPool(workers=1, queue_size=2)
+    source = spool(CSVFILEPATH)
+    try:
+        result = asyncio.run(pool.run(parse_upload, source))
+    finally:
+        pool.shutdown()
+    assert result["rows"] == len(pd.read_pickle(result["frame"]))
+    assert pool.stats() == {"admitted": 0}
+    os.remove(result["frame"])
+    os.remove(source["path"])
+
+def test_pool_restarts_after_a_crash():
+    """
+    Test that a died parsing process gives a retryable error and the next upload gets a new pool
+    """
+    pool = IngestionPool(workers=1, queue_size=2)
+    source = spool(CSVFILEPATH)
+    try:
+        with pytest.raises(QueueFullError) as error:
+            asyncio.run(pool.run(os._exit, 1))
+        assert error.value.retry_after > 0
+        result = asyncio.run(pool.run(parse_upload, source))
+    finally:
+        pool.shutdown()
+    assert result["rows"] == len(pd.read_pickle(result["frame"]))
+    os.remove(result["frame"])
+    os.remove(source["path"])
+
+def test_pool_is_bounded():
+    """
+    Test that uploads beyond queue_size are rejected instead of queued
+    """
+    async def admit(pool, gate):
+        running = [asyncio.create_task(pool.run(gate.wait, 5)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        assert pool.stats() == {"admitted": 2}
+        with pytest.raises(QueueFullError):
+            await pool.run(gate.wait, 5)
+        gate.set()
+        assert await asyncio.gather(*running) == [True, True]
+
+    pool = IngestionPool(workers=0, queue_size=2)
+    asyncio.run(admit(pool, threading.Event()))
+    assert pool.stats() == {"admitted": 0}
@@ -0,0 +1,99 @@
+"""
+    Testing the numpy k-means engine against sklearn
+"""
+import pytest
+import scipy.sparse
+import numpy as np
+from sklearn.cluster import KMeans
+from sklearn.utils import check_random_state
+from app.kmeans_engine import KMeansEngine
+
+
+def make_matrix(rows=3000, columns=5, seed=0):
+    """
+    Returns two shifted gaussian blobs far away from the origin
+    """
+    rng = np.random.default_rng(seed)
+    matrix = rng.normal(size=(rows, columns)) * 3 + 100
+    matrix[:rows // 2] += 4
+    return matrix
+
+@pytest.mark.parametrize("algorithm", ["lloyd", "elkan"])
+def test_engine_matches_sklearn(algorithm):
+    """
+    Test that the engine in float64 ends with the labels, centroids and iterations of sklearn
+    """
+    matrix = make_matrix()
+    start = matrix[:7].copy()
+    engine = KMeansEngine(matrix, 1e-4, float32=0)
+    result = engine.fit(start, 300, algorithm)
+    single = KMeans(n_clusters=7, init=start, n_init=1, max_iter=300, tol=1e-4).fit(matrix)
+
+    assert engine.dtype == np.float64
+    assert np.array_equal(result.labels_, single.labels_)
+    assert np.allclose(result.cluster_centers_, single.cluster_centers_)
+    assert np.isclose(result.inertia_, single.inertia_)
+    assert result.n_iter_ == single.n_iter_
+
+def test_float32_only_if_precise():
+    """
+    Test that float32 is used unless its rounding error exceeds the tolerance
+    """
+    matrix = make_matrix()
+    engine = KMeansEngine(matrix, 1e-4)
+    assert engine.dtype == np.float32
+    assert KMeansEngine(matrix, 0).dtype == np.float64
+
+    start = matrix[:4].copy()
+    result = engine.fit(start, 300)
+    single = KMeans(n_clusters=4, init=start, n_init=1, max_iter=300, tol=1e-4).fit(matrix)
+    assert result.cluster_centers_.dtype == np.float64
+    assert abs(result.inertia_ / single.inertia_ - 1) < 1e-3
+
+def test_callback_and_empty_clusters():
+    """
+    Test that the callback sees every iteration and can stop the fit,
+    and that an empty cluster takes the row farthest from its centroid
+    """
+    matrix = make_matrix(500, 2)
+    start = np.vstack([matrix[:2], [[1e4, 1e4]]])
+    engine = KMeansEngine(matrix, 1e-4)
+    iterations = []
+    result = engine.fit(start, 300, callback=lambda iteration, inertia, shift: iterations.append(iteration))
+    assert iterations == list(range(1, result.n_iter_ + 1))
+    assert np.bincount(result.labels_, minlength=3).min() > 0
+
+    def stop(iteration, inertia, shift):
+        raise RuntimeError(iteration)
+    with pytest.raises(RuntimeError):
+        engine.fit(start, 300, callback=stop)
+
+def test_invalid_input():
+    """
+    Test that invalid data and centroids raise ValueError like sklearn
+    """
+    with pytest.raises(ValueError):
+        KMeansEngine([[1.0, np.nan], [2.0, 3.0]], 1e-4)
+    engine = KMeansEngine(make_matrix(10, 2), 1e-4)
+    with pytest.raises(ValueError):
+        engine.fit(np.zeros((11, 2)), 10)
+    with pytest.raises(ValueError):
+        engine.fit(np.zeros((2, 3)), 10)
+
+@pytest.mark.parametrize("algorithm", ["lloyd", "elkan"])
+def test_sparse_matches_dense(algorithm):
+    """
+    Test that a CSR matrix stays sparse and gives the result of its dense version
+    """
+    rng = np.random.default_rng(5)
+    dense = np.hstack([rng.normal(size=(2000, 2)), np.eye(50)[rng.integers(0, 50, 2000)]])
+    start = dense[:5].copy()
+    engine = KMeansEngine(scipy.sparse.csr_matrix(dense), 1e-4, float32=0)
+    result = engine.fit(start, 300, algorithm)
+    single = KMeansEngine(dense, 1e-4, float32=0).fit(start, 300, algorithm)
+
+    assert scipy.sparse.issparse(engine.data)
+    assert np.array_equal(result.labels_, single.labels_)
+    assert np.allclose(result.cluster_centers_, single.cluster_centers_)
+    assert np.isclose(result.inertia_, single.inertia_)
+    assert engine.initial_centers(5, "k-means++", check_random_state(0)).shape == (5, 52)
@@ -2,14 +2,38 @@
     Testing kmeans methods with pylint
 """
 import os
+import json
+import uuid
 import redis
+import pytest
+import numpy as np
 import pandas as pd
-from app.kmeans_methods import run_kmeans_one_k
+from sklearn.cluster import KMeans
+from sklearn.datasets import make_blobs
+from sklearn.preprocessing import StandardScaler
+from app import kmeans_methods
+from app.kmeans_methods import run_kmeans_one_k, run_kmeans_minibatch, run_kmeans_elbow
+from app.progress import ProgressReporter
+from app.job_control import JobControl, JobStopped
+from app.models import ModelRegistry
+from app.datasets import DatasetStore
+from app.results import load_rows, result_page
+from app.utils import result_from_npz
+from app.task_store import TaskStore
 
 REDIS_HOST = os.environ.get('REDIS_HOST', 'localhost')
 REDIS_PORT = os.environ.get('REDIS_PORT', '6379')
 
 redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+task_store = TaskStore(redis_client)
+
+def create_task(method="one_k"):
+    """
+    Creates a task which is being processed and returns its ID
+    """
+    task_id = str(uuid.uuid4())
+    task_store.create(task_id, method, status="processing")
+    return task_id
 
 # pylint: disable=unused-variable
 def test_valid_input_kmeans_plusplus():
@@ -21,21 +45,12 @@ def test_valid_input_kmeans_plusplus():
         'y': [5, 4, 3, 2, 1]
     })
 
-    tasks = {}
-    tasks[1] = {
-        "status": "processing",
-        "method": "one_k",
-        "Datenpunkte": data,
-        "json_result": {},
-        "inertia_values": [],
-        "message": ""}
-
-    task_id = 1
-    result = run_kmeans_one_k(redis_client,data, task_id, tasks, k_value=2,
-                              number_runs=5, max_iterations=100, tolerance=1e-4,
-                              initialisation="k-means++", used_algorithm="auto")
-    assert tasks[task_id]["status"] == "completed"
-    assert "json_result" in tasks[task_id]
+    task_id = create_task()
+    run_kmeans_one_k(task_store, data, task_id, k_value=2,
+                     number_runs=5, max_iterations=100, tolerance=1e-4,
+                     initialisation="k-means++", used_algorithm="auto")
+    assert task_store.field(task_id, "status") == "completed"
+    assert task_store.field(task_id, "json_result") is not None
 
 # pylint: disable=unused-variable
 def test_valid_input_random_initialization():
@@ -47,21 +62,12 @@ def test_valid_input_random_initialization():
         'y': [5, 4, 3, 2, 1]
     })
 
-    tasks = {}
-    tasks[1] = {
-        "status": "processing",
-        "method": "one_k",
-        "Datenpunkte": data,
-        "json_result": {},
-        "inertia_values": [],
-        "message": ""}
-
-    task_id = 1
-    result = run_kmeans_one_k(redis_client,data, task_id, tasks, k_value=3,
-                              number_runs=5, max_iterations=100, tolerance=1e-4,
-                              initialisation="random", used_algorithm="full")
-    assert tasks[task_id]["status"] == "completed"
-    assert "json_result" in tasks[task_id]
+    task_id = create_task()
+    run_kmeans_one_k(task_store, data, task_id, k_value=3,
+                     number_runs=5, max_iterations=100, tolerance=1e-4,
+                     initialisation="random", used_algorithm="full")
+    assert task_store.field(task_id, "status") == "completed"
+    assert task_store.field(task_id, "json_result") is not None
 
 # pylint: disable=unused-variable
 def test_valid_input_centroids_initialization():
@@ -74,22 +80,13 @@ def test_valid_input_centroids_initialization():
     })
     centroids_start = [[1, 5], [5, 1]]
 
-    tasks = {}
-    tasks[1] = {
-        "status": "processing",
-        "method": "one_k",
-        "Datenpunkte": data,
-        "json_result": {},
-        "inertia_values": [],
-        "message": ""}
-
-    task_id = 1
-    result = run_kmeans_one_k(redis_client,data, task_id, tasks, k_value=2,
-                              number_runs=5, max_iterations=100, tolerance=1e-4,
-                              initialisation="centroids", used_algorithm="auto",
-                              centroids_start=centroids_start)
-    assert tasks[task_id]["status"] == "completed"
-    assert "json_result" in tasks[task_id]
+    task_id = create_task()
+    run_kmeans_one_k(task_store, data, task_id, k_value=2,
+                     number_runs=5, max_iterations=100, tolerance=1e-4,
+                     initialisation="centroids", used_algorithm="auto",
+                     centroids_start=centroids_start)
+    assert task_store.field(task_id, "status") == "completed"
+    assert task_store.field(task_id, "json_result") is not None
 
 # pylint: disable=unused-variable
 def test_invalid_initialization_method():
@@ -101,20 +98,11 @@ def test_invalid_initialization_method():
         'y': [5, 4, 3, 2, 1]
     })
 
-    tasks = {}
-    tasks[1] = {
-        "status": "processing",
-        "method": "one_k",
-        "Datenpunkte": data,
-        "json_result": {},
-        "inertia_values": [],
-        "message": ""}
-
-    task_id = 1
-    result = run_kmeans_one_k(redis_client,data, task_id, tasks, k_value=2,
-                              number_runs=5, max_iterations=100, tolerance=1e-4,
-                              initialisation="invalid_method", used_algorithm="full")
-    assert tasks[task_id]["status"] == "Bad Request"
+    task_id = create_task()
+    run_kmeans_one_k(task_store, data, task_id, k_value=2,
+                     number_runs=5, max_iterations=100, tolerance=1e-4,
+                     initialisation="invalid_method", used_algorithm="full")
+    assert task_store.field(task_id, "status") == "Bad Request"
 
 # pylint: disable=unused-variable
 def test_k_too_high():
@@ -126,20 +114,11 @@ def test_k_too_high():
         'y': [5, 4, 3, 2, 1]
     })
 
-    tasks = {}
-    tasks[1] = {
-        "status": "processing",
-        "method": "one_k",
-        "Datenpunkte": data,
-        "json_result": {},
-        "inertia_values": [],
-        "message": ""}
-
-    task_id = 1
-    result = run_kmeans_one_k(redis_client,data, task_id, tasks, k_value=8,
-                              number_runs=5, max_iterations=100, tolerance=1e-4,
-                              initialisation="random", used_algorithm="full")
-    assert tasks[task_id]["status"] == "Bad Request"
+    task_id = create_task()
+    run_kmeans_one_k(task_store, data, task_id, k_value=8,
+                     number_runs=5, max_iterations=100, tolerance=1e-4,
+                     initialisation="random", used_algorithm="full")
+    assert task_store.field(task_id, "status") == "Bad Request"
 
 # pylint: disable=unused-variable
 def test_invalid_number_runs():
@@ -151,20 +130,11 @@ def test_invalid_number_runs():
         'y': [5, 4, 3, 2, 1]
     })
 
-    tasks = {}
-    tasks[1] = {
-        "status": "processing",
-        "method": "one_k",
-        "Datenpunkte": data,
-        "json_result": {},
-        "inertia_values": [],
-        "message": ""}
-
-    task_id = 1
-    result = run_kmeans_one_k(redis_client,data, task_id, tasks, k_value=8,
-                              number_runs="a", max_iterations=100, tolerance=1e-4,
-                              initialisation="random", used_algorithm="full")
-    assert tasks[task_id]["status"] == "Bad Request"
+    task_id = create_task()
+    run_kmeans_one_k(task_store, data, task_id, k_value=8,
+                     number_runs="a", max_iterations=100, tolerance=1e-4,
+                     initialisation="random", used_algorithm="full")
+    assert task_store.field(task_id, "status") == "Bad Request"
 
 # pylint: disable=unused-variable
 def test_invalid_used_algorithm():
@@ -176,17 +146,217 @@ def test_invalid_used_algorithm():
         'y': [5, 4, 3, 2, 1]
     })
 
-    tasks = {}
-    tasks[1] = {
-        "status": "processing",
-        "method": "one_k",
-        "Datenpunkte": data,
-        "json_result": {},
-        "inertia_values": [],
-        "message": ""}
-
-    task_id = 1
-    result = run_kmeans_one_k(redis_client,data, task_id, tasks, k_value=2,
-                              number_runs=5, max_iterations=100, tolerance=1e-4,
-                              initialisation="k-means++", used_algorithm="false")
-    assert tasks[task_id]["status"] == "Bad Request"
+    task_id = create_task()
+    run_kmeans_one_k(task_store, data, task_id, k_value=2,
+                     number_runs=5, max_iterations=100, tolerance=1e-4,
+                     initialisation="k-means++", used_algorithm="false")
+    assert task_store.field(task_id, "status") == "Bad Request"
+
+def test_minibatch_inertia_close_to_lloyd(tmp_path):
+    """
+    Test streamed mini-batch k-means against full Lloyd on the same data
+    """
+    rng = np.random.default_rng(0)
+    centers = np.array([[0, 0], [10, 10], [0, 10], [10, 0]])
+    points = np.vstack([center + rng.normal(size=(500, 2)) for center in centers])
+    data = pd.DataFrame(points, columns=['x', 'y'])
+    data['group'] = np.where(data['x'] > 5, 'right', 'left')
+    path = tmp_path / "blobs.csv"
+    data.to_csv(path, index=False)
+
+    task_id = create_task()
+    run_kmeans_minibatch(task_store, {"path": str(path), "filename": "blobs.csv"},
+                         task_id, k_value=4, number_runs=3, max_iterations=100,
+                         tolerance=1e-4, initialisation="k-means++", normalization="z")
+    assert task_store.field(task_id, "status") == "completed"
+    assert task_store.field(task_id, "json_result") is None
+    assert not path.exists()
+
+    # Die Datenpunkte werden aus dem in den Dataset-Speicher verschobenen Upload gelesen
+    rows = load_rows(task_store.get(task_id), DatasetStore())
+    page = result_page(rows)
+    assert sum(len(cluster["data_points"]) for cluster in page["Cluster"]) == 2000
+    first = page["Cluster"][0]
+    assert first["data_points"][:3] == result_page(rows, first["cluster"], limit=3)["Cluster"][0]["data_points"]
+
+    lloyd = KMeans(n_clusters=4, n_init=3).fit(StandardScaler().fit_transform(pd.get_dummies(data, drop_first=True, dtype=float)))
+    assert float(task_store.field(task_id, "inertia")) <= 1.05 * lloyd.inertia_
+
+    # Das gespeicherte Modell ordnet die Zeilen wie der Job zu
+    labels, _ = result_from_npz(task_store.field(task_id, "result_npz"))
+    model = ModelRegistry().load(task_store.field(task_id, "model_id"))
+    np.testing.assert_array_equal(model.predict(data)[0], labels)
+
+def test_identical_request_stores_one_model():
+    """
+    Test that a rerun of an identical request with seed reuses the model of the first run
+    """
+    data = pd.DataFrame(make_blobs(n_samples=200, centers=3, random_state=0)[0], columns=['x', 'y'])
+    dataset_id = uuid.uuid4().hex
+    model_ids = []
+    for _ in range(2):
+        task_id = str(uuid.uuid4())
+        task_store.create(task_id, "one_k", status="processing", cache_key="a" * 64)
+        run_kmeans_one_k(task_store, data, task_id, 3, 1, 100, 1e-4, "k-means++", "lloyd",
+                         random_state=0, dataset_id=dataset_id)
+        model_ids.append(task_store.field(task_id, "model_id"))
+    assert model_ids[0] is not None and model_ids[0] == model_ids[1]
+
+def test_elbow_parallel_and_warm_start():
+    """
+    Test the parallel and the warm-started elbow sweep
+    """
+    rng = np.random.default_rng(1)
+    data = pd.DataFrame(rng.normal(size=(300, 3)), columns=['a', 'b', 'c'])
+
+    for warm_start in (False, True):
+        task_id = create_task("elbow")
+        run_kmeans_elbow(task_store, data, task_id, 1, 6, 3, 300, 1e-4,
+                         "k-means++", "lloyd", warm_start=warm_start)
+        assert task_store.field(task_id, "status") == "completed"
+        inertias = json.loads(task_store.field(task_id, "inertia_values"))
+        assert list(inertias) == ["1", "2", "3", "4", "5", "6"]
+        assert inertias["1"] > inertias["6"]
+
+@pytest.mark.parametrize("algorithm, engine", [("minibatch", "numpy"), ("lloyd", "sklearn")])
+def test_elbow_warm_start_with_sklearn(monkeypatch, algorithm, engine):
+    """
+    Test the warm-started elbow sweep whose fits take the previous centroids as init array
+    """
+    monkeypatch.setattr(kmeans_methods, "KMEANS_ENGINE", engine)
+    data = pd.DataFrame(make_blobs(n_samples=300, centers=4, random_state=0)[0], columns=['x', 'y'])
+    task_id = create_task("elbow")
+    run_kmeans_elbow(task_store, data, task_id, 1, 5, 1, 100, 1e-4,
+                     "k-means++", algorithm, warm_start=True)
+    assert task_store.field(task_id, "status") == "completed"
+    assert list(json.loads(task_store.field(task_id, "inertia_values"))) == ["1", "2", "3", "4", "5"]
+
+@pytest.mark.parametrize("warm_start", [False, True])
+def test_elbow_search_modes(warm_start):
+    """
+    Test that every search mode recommends the number of blobs and the fast modes fit fewer k values
+    """
+    matrix, _ = make_blobs(1500, n_features=4, centers=5, cluster_std=0.5, random_state=0)
+    data = pd.DataFrame(matrix, columns=['a', 'b', 'c', 'd'])
+
+    fitted = {}
+    for search in ("full", "early-stop", "coarse-to-fine"):
+        task_id = create_task("elbow")
+        run_kmeans_elbow(task_store, data, task_id, 1, 25, 3, 300, 1e-4, "k-means++", "lloyd",
+                         warm_start=warm_start, random_state=0, search=search)
+        assert task_store.field(task_id, "status") == "completed"
+        assert int(task_store.field(task_id, "recommended_k")) == 5
+        fitted[search] = [int(k_value) for k_value in json.loads(task_store.field(task_id, "inertia_values"))]
+    assert fitted["full"] == list(range(1, 26))
+    assert fitted["early-stop"][:10] == list(range(1, 11)) and len(fitted["early-stop"]) < 25
+    assert 5 in fitted["coarse-to-fine"] and len(fitted["coarse-to-fine"]) < 15
+
+def test_elbow_scores():
+    """
+    Test that the scores of every k are stored alongside the inertias and peak at the number of blobs
+    """
+    matrix, _ = make_blobs(1500, n_features=4, centers=5, cluster_std=0.5, random_state=0)
+    data = pd.DataFrame(matrix, columns=['a', 'b', 'c', 'd'])
+    task_id = create_task("elbow")
+    run_kmeans_elbow(task_store, data, task_id, 1, 8, 3, 300, 1e-4, "k-means++", "lloyd",
+                     random_state=0, scores=True)
+    scores = json.loads(task_store.field(task_id, "scores"))
+    assert list(scores) == list(json.loads(task_store.field(task_id, "inertia_values")))
+    assert scores["1"]["silhouette"] is None
+    assert max(scores, key=lambda k_value: scores[k_value]["silhouette"] or -1) == "5"
+    assert min(scores, key=lambda k_value: scores[k_value]["davies_bouldin"] or np.inf) == "5"
+
+def test_progress_segments_match_single_fit(monkeypatch):
+    """
+    Test that the segmented fit reports its progress and ends where one sklearn fit ends
+    """
+    monkeypatch.setattr(kmeans_methods, "KMEANS_ENGINE", "sklearn")
+    monkeypatch.setattr(kmeans_methods, "KMEANS_PROGRESS_ITERATIONS", 1)
+    rng = np.random.default_rng(2)
+    matrix = rng.normal(size=(2000, 4))
+    start = matrix[:6].copy()
+
+    task_id = create_task()
+    reporter = ProgressReporter(task_store, task_id, interval=0)
+    kmeans = kmeans_methods.fit_kmeans(matrix, 6, 1, 300, 1e-6, start, "lloyd", reporter=reporter)
+    single = KMeans(n_clusters=6, init=start, n_init=1, max_iter=300, tol=1e-6).fit(matrix)
+    assert np.isclose(kmeans.inertia_, single.inertia_)
+
+    progress = json.loads(task_store.field(task_id, "progress"))
+    assert progress["run"] == progress["runs"] == 1
+    assert progress["iteration"] > 1
+    assert progress["inertia"] == kmeans.inertia_
+
+def test_progress_of_engine_fit():
+    """
+    Test that the numpy engine reports every iteration and ends where sklearn ends
+    """
+    rng = np.random.default_rng(2)
+    matrix = rng.normal(size=(2000, 4))
+    start = matrix[:6].copy()
+
+    task_id = create_task()
+    reporter = ProgressReporter(task_store, task_id, interval=0)
+    kmeans = kmeans_methods.fit_kmeans(matrix, 6, 1, 300, 1e-6, start, "lloyd", reporter=reporter)
+    single = KMeans(n_clusters=6, init=start, n_init=1, max_iter=300, tol=1e-6).fit(matrix)
+    assert np.isclose(kmeans.inertia_, single.inertia_)
+
+    progress = json.loads(task_store.field(task_id, "progress"))
+    assert progress["iteration"] == kmeans.n_iter_
+    assert progress["best_inertia"] == kmeans.inertia_
+
+def test_progress_of_elbow():
+    """
+    Test that the elbow sweep reports the k values done
+    """
+    rng = np.random.default_rng(3)
+    data = pd.DataFrame(rng.normal(size=(100, 2)), columns=['a', 'b'])
+    task_id = create_task("elbow")
+    run_kmeans_elbow(task_store, data, task_id, 2, 4, 2, 300, 1e-4, "k-means++", "lloyd")
+    progress = json.loads(task_store.field(task_id, "progress"))
+    assert progress["k_done"] == progress["k_total"] == 3
+
+def test_cancelled_fit_stops():
+    """
+    Test that the one-k fit and the elbow sweep stop at their checkpoints once cancelled
+    """
+    rng = np.random.default_rng(4)
+    data = pd.DataFrame(rng.normal(size=(200, 2)), columns=['a', 'b'])
+    control = JobControl()
+    control.cancel()
+
+    task_id = create_task()
+    with pytest.raises(JobStopped):
+        run_kmeans_one_k(task_store, data, task_id, 3, 5, 300, 1e-4, "k-means++", "lloyd", control=control)
+    assert task_store.field(task_id, "status") != "completed"
+
+    task_id = create_task("elbow")
+    with pytest.raises(JobStopped):
+        run_kmeans_elbow(task_store, data, task_id, 1, 6, 2, 300, 1e-4, "k-means++", "lloyd", control=control)
+    assert task_store.field(task_id, "inertia_values") is None
+
+class CancelAfter(JobControl):
+    """
+    A job control which is cancelled after the given number of checks
+    """
+    def __init__(self, checks):
+        super().__init__()
+        self.checks = checks
+
+    def check(self):
+        self.checks -= 1
+        if self.checks < 0:
+            self.cancel()
+        super().check()
+
+def test_elbow_fit_stops_inside_k():
+    """
+    Test that a k of the elbow sweep stops at the checkpoints of its fit, not only before it
+    """
+    matrix, _ = make_blobs(500, centers=5, random_state=0)
+    with pytest.raises(JobStopped):
+        kmeans_methods.fit_inertia(matrix, 5, 3, 300, 1e-4, "k-means++", "lloyd", 0, CancelAfter(1))
+    generator = np.random.default_rng(0)
+    with pytest.raises(JobStopped):
+        kmeans_methods.fit_warm_started(matrix, 5, matrix[:4], 1, 300, 1e-4, "k-means++", "lloyd", generator,
+                                        CancelAfter(0))
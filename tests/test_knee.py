@@ -0,0 +1,65 @@
+"""
+    Testing the knee detection of the elbow curve with pytest
+"""
+from app.knee import KneeTracker, find_knee, geometric_grid, refinement
+
+
+def elbow_curve(true_k, k_max=30):
+    """
+    Returns an idealised elbow curve: the inertia halves up to true_k and then decreases slowly
+    """
+    k_values = list(range(1, k_max + 1))
+    inertias = [2.0 ** -min(k_value, true_k) * (1 - 0.01 * max(k_value - true_k, 0)) for k_value in k_values]
+    return k_values, inertias
+
+def test_find_knee():
+    """
+    Test that the knee of the curve is found and confirmed, also on a coarse grid
+    """
+    for true_k in (3, 8, 15):
+        k_values, inertias = elbow_curve(true_k)
+        assert find_knee(k_values, inertias) == (true_k, True)
+    assert find_knee([1, 2], [2.0, 1.0]) == (None, False)
+    assert find_knee([1, 2, 3], [1.0, 1.0, 1.0]) == (None, False)
+
+def test_tracker_stops_after_the_knee():
+    """
+    Test that the tracker stops soon after the knee, even if the inertias arrive out of order
+    """
+    k_values, inertias = elbow_curve(8)
+    tracker = KneeTracker(1, patience=3)
+    # Paarweise vertauscht, wie bei parallelen Fits
+    arrived = [k_value + 1 - 2 * ((k_value - 1) % 2) for k_value in k_values]
+    stopped_at = None
+    for k_value in arrived:
+        if tracker.add(k_value, inertias[k_value - 1]):
+            stopped_at = k_value
+            break
+    assert tracker.knee == 8
+    assert stopped_at is not None and stopped_at < 16
+
+    tracker = KneeTracker(1)
+    for k_value in (3, 2):
+        assert not tracker.add(k_value, inertias[k_value - 1])
+    assert tracker.contiguous == 0
+
+def test_tracker_waits_for_a_flat_curve():
+    """
+    Test that a premature knee followed by a further steep fall does not stop the sweep
+    """
+    k_values = list(range(1, 16))
+    inertias = [100, 50, 25, 12, 11, 10, 9, 8, 7, 6, 5, 4, 3, 2.9, 2.8]
+    tracker = KneeTracker(1, patience=2)
+    stops = [tracker.add(k_value, inertia) for k_value, inertia in zip(k_values[:11], inertias)]
+    assert not any(stops)
+
+def test_geometric_grid_and_refinement():
+    """
+    Test the coarse grid and the k values refined around its knee
+    """
+    grid = geometric_grid(2, 50)
+    assert grid[0] == 2 and grid[-1] == 50
+    assert all(later > earlier for earlier, later in zip(grid, grid[1:]))
+    assert len(grid) < 12
+    assert refinement([2, 3, 5, 8, 12], 8, 2, 50) == [6, 7, 9, 10, 11]
+    assert refinement([2, 3, 5, 8, 12], 12, 2, 14) == [9, 10, 11, 13]
@@ -1,8 +1,17 @@
 """Module Testing with pytest"""
+import io
 import os
+import json
+import time
+import random
+import threading
 import pytest
+import numpy as np
+import pandas as pd
 from fastapi.testclient import TestClient
-from app.main import app
+from app import main
+from app.main import app, redis_client, task_store
+from app.result_cache import CACHE_PREFIX
 
 # Create a TestClient instance to interact with your FastAPI app
 client = TestClient(app)
@@ -152,5 +161,267 @@ def test_get_task_result():
     # Add your assertions for the task result here
     # assert response_data["result"] == expected_result
 
+def test_minibatch_upload():
+    """Test streamed mini-batch k-means through the API"""
+    with open(CSVFILEPATH, "rb") as file:
+        response = client.post("/kmeans/", params={**test_params, "algorithm": "minibatch"}, files={"file": file})
+    assert response.status_code == 200
+    task_id = response.json()["TaskID"]
+    dataset_id = response.json()["DatasetID"]
+
+    while True:
+        response_data = client.get(f"/kmeans/status/{task_id}").json()
+        if response_data["status"] == "completed":
+            break
+
+    response = client.get(f"/kmeans/result/{task_id}")
+    assert response.status_code == 200
+    assert sum(len(cluster["data_points"]) for cluster in response.json()["Cluster"]) == 99
+
+    # Der gespeicherte Upload wird ohne Datei wiederverwendet
+    for algorithm in ("minibatch", "lloyd"):
+        params = {**test_params, "algorithm": algorithm, "dataset_id": dataset_id}
+        response = client.post("/kmeans/", params=params)
+        assert response.status_code == 200
+        task_id = response.json()["TaskID"]
+        while client.get(f"/kmeans/status/{task_id}").json()["status"] != "completed":
+            pass
+        response = client.get(f"/kmeans/result/{task_id}")
+        assert sum(len(cluster["data_points"]) for cluster in response.json()["Cluster"]) == 99
+
+def test_result_cache_hit():
+    """Test that a repeated upload with the same parameters is answered from the cache"""
+    params = {**test_params, "seed": random.randrange(2 ** 31)}
+    with open(TESTFILEPATH, "rb") as file:
+        task_id = client.post("/kmeans/", params=params, files={"file": file}).json()["TaskID"]
+    while client.get(f"/kmeans/status/{task_id}").json()["status"] != "completed":
+        pass
+    first_result = client.get(f"/kmeans/result/{task_id}").json()
+    # The worker stores the result in the cache right after completing the task
+    while not redis_client.exists(CACHE_PREFIX + redis_client.hget(task_id, "cache_key")):
+        pass
+    hits = client.get("/cache/stats").json()["hits"]
+
+    with open(TESTFILEPATH, "rb") as file:
+        cached_task_id = client.post("/kmeans/", params=params, files={"file": file}).json()["TaskID"]
+    assert cached_task_id != task_id
+    assert client.get(f"/kmeans/status/{cached_task_id}").json()["status"] == "completed"
+    assert client.get(f"/kmeans/result/{cached_task_id}").json() == first_result
+    assert client.get("/cache/stats").json()["hits"] == hits + 1
+
+def test_dataset_id_reuse():
+    """Test a second job on an uploaded dataset given only its dataset_id"""
+    params = {**test_params, "seed": random.randrange(2 ** 31)}
+    with open(CSVFILEPATH, "rb") as file:
+        response_data = client.post("/kmeans/", params=params, files={"file": file}).json()
+    dataset_id = response_data["DatasetID"]
+    while client.get(f"/kmeans/status/{response_data['TaskID']}").json()["status"] != "completed":
+        pass
+
+    response = client.post("/elbow/", params={"k_min": 1, "k_max": 3, "normalization": "min-max",
+                                              "seed": params["seed"], "dataset_id": dataset_id})
+    assert response.status_code == 200
+    assert response.json()["DatasetID"] == dataset_id
+    task_id = response.json()["TaskID"]
+    while client.get(f"/kmeans/status/{task_id}").json()["status"] != "completed":
+        pass
+    assert "Loaded prepared data" in redis_client.hget(task_id, "message")
+
+def test_upload_rejected_while_ingestion_is_full(monkeypatch):
+    """Test that an upload is answered with 503 and Retry-After if the ingestion pool is full"""
+    monkeypatch.setattr(main.ingestion, "queue_size", 0)
+    # Eine neue Datei, sonst liegt der Datensatz schon im Dataset-Speicher
+    upload = io.BytesIO(f"a,b\n{random.random()},1\n2,3\n4,5\n".encode())
+    response = client.post("/kmeans/", params={**test_params, "k": 2}, files={"file": ("new.csv", upload)})
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) > 0
+
+def test_missing_dataset():
+    """Test that a request without file and with an unknown dataset_id is rejected"""
+    assert client.post("/kmeans/", params={"k": 2}).status_code == 400
+    assert client.post("/kmeans/", params={"k": 2, "dataset_id": "0" * 64}).status_code == 404
+
+def test_dataset_resource():
+    """Test uploading a dataset once, clustering it by ID and deleting it"""
+    with open(TESTFILEPATH, "rb") as file:
+        response = client.post("/datasets/", files={"file": file})
+    assert response.status_code == 200
+    summary = response.json()
+    assert client.get(f"/datasets/{summary['DatasetID']}").json() == summary
+    assert summary["shape"][1] == len(summary["columns"]) == len(summary["dtypes"])
+
+    params = {"k": 2, "number_kmeans_runs": 1, "seed": random.randrange(2 ** 31)}
+    task_id = client.post("/kmeans/", params={**params, "dataset_id": summary["DatasetID"]}).json()["TaskID"]
+    while client.get(f"/kmeans/status/{task_id}").json()["status"] != "completed":
+        pass
+    clusters = client.get(f"/kmeans/result/{task_id}").json()["Cluster"]
+    assert sum(len(cluster["data_points"]) for cluster in clusters) == summary["shape"][0]
+
+    assert client.delete(f"/datasets/{summary['DatasetID']}").status_code == 200
+    assert client.get(f"/datasets/{summary['DatasetID']}").status_code == 404
+
+def test_parquet_upload_with_columns():
+    """Test clustering selected columns of a parquet upload"""
+    dataframe = pd.read_csv(CSVFILEPATH)
+    dataframe["price"] += random.random()
+    upload = io.BytesIO()
+    dataframe.to_parquet(upload)
+
+    upload.seek(0)
+    response = client.post("/datasets/", params={"columns": "price,hp"}, files={"file": ("cars.parquet", upload)})
+    assert response.status_code == 200
+    assert response.json()["columns"] == ["price", "hp"]
+
+    upload.seek(0)
+    response = client.post("/kmeans/", params={**test_params, "k": 2, "columns": "price,hp"},
+                           files={"file": ("cars.parquet", upload)})
+    assert response.status_code == 200
+    task_id = response.json()["TaskID"]
+    while client.get(f"/kmeans/status/{task_id}").json()["status"] != "completed":
+        pass
+    clusters = client.get(f"/kmeans/result/{task_id}").json()["Cluster"]
+    assert {len(point) for cluster in clusters for point in cluster["data_points"]} == {2}
+
+    upload.seek(0)
+    response = client.post("/kmeans/", params={**test_params, "k": 2, "columns": "unknown"},
+                           files={"file": ("cars.parquet", upload)})
+    assert response.status_code == 400
+
+def test_npz_result():
+    """Test the content negotiation of the k-means result"""
+    params = {**test_params, "seed": random.randrange(2 ** 31)}
+    with open(CSVFILEPATH, "rb") as file:
+        task_id = client.post("/kmeans/", params=params, files={"file": file}).json()["TaskID"]
+    while client.get(f"/kmeans/status/{task_id}").json()["status"] != "completed":
+        pass
+
+    response = client.get(f"/kmeans/result/{task_id}", headers={"Accept": "application/x-npz"})
+    assert response.headers["content-type"] == "application/x-npz"
+    with np.load(io.BytesIO(response.content)) as arrays:
+        labels, centroids = np.asarray(arrays["labels"]), np.asarray(arrays["centroids"])
+    assert labels.dtype == np.int32
+    labels, centroids = labels.tolist(), centroids.tolist()
+    assert len(centroids) == test_params["k"]
+
+    clusters = client.get(f"/kmeans/result/{task_id}").json()["Cluster"]
+    assert [len(cluster["data_points"]) for cluster in clusters] == [labels.count(cluster) for cluster in range(3)]
+    assert np.allclose([cluster["centroids"] for cluster in clusters], centroids)
+
+def test_predict_with_model_of_task():
+    """Test that the rows of a fitted file get their labels from /predict/ and the model resource"""
+    params = {**test_params, "seed": random.randrange(2 ** 31)}
+    with open(CSVFILEPATH, "rb") as file:
+        task_id = client.post("/kmeans/", params=params, files={"file": file}).json()["TaskID"]
+    while client.get(f"/kmeans/status/{task_id}").json()["status"] != "completed":
+        pass
+    model_id = client.get(f"/kmeans/result/{task_id}", params={"view": "summary"}).json()["model_id"]
+    response = client.get(f"/kmeans/result/{task_id}", headers={"Accept": "application/x-npz"})
+    with np.load(io.BytesIO(response.content)) as arrays:
+        labels = np.asarray(arrays["labels"])
+
+    rows = json.loads(pd.read_csv(CSVFILEPATH).to_json(orient="records"))
+    response = client.post(f"/predict/{model_id}", json=rows)
+    assert response.status_code == 200
+    predicted = np.array(response.json()["labels"])
+    assert predicted[predicted >= 0].tolist() == labels.tolist()
+    assert len(response.json()["distances"]) == len(rows)
+
+    lists = client.post(f"/predict/{model_id}", json={"data_points": [list(row.values()) for row in rows[:5]]})
+    assert lists.json()["labels"] == predicted[:5].tolist()
+    info = client.get(f"/models/{model_id}").json()
+    assert info["k"] == test_params["k"] and info["normalization"] == "min-max"
+    assert client.post(f"/predict/{model_id}", json=[{"mileage": 1}]).status_code == 400
+    assert client.post(f"/predict/{model_id}", content=b"[{").status_code == 400
+    assert client.post("/predict/unknown", json=rows).status_code == 404
+
+def test_result_views():
+    """Test the summary, the pagination and the streamed result"""
+    params = {**test_params, "seed": random.randrange(2 ** 31)}
+    with open(CSVFILEPATH, "rb") as file:
+        task_id = client.post("/kmeans/", params=params, files={"file": file}).json()["TaskID"]
+    while client.get(f"/kmeans/status/{task_id}").json()["status"] != "completed":
+        pass
+    clusters = client.get(f"/kmeans/result/{task_id}").json()["Cluster"]
+
+    summary = client.get(f"/kmeans/result/{task_id}", params={"view": "summary"}).json()
+    assert summary["cluster_sizes"] == [len(cluster["data_points"]) for cluster in clusters]
+    assert summary["inertia"] > 0
+
+    page = client.get(f"/kmeans/result/{task_id}", params={"cluster": 0, "offset": 2, "limit": 5}).json()
+    assert page["Cluster"][0]["size"] == summary["cluster_sizes"][0]
+    assert page["Cluster"][0]["data_points"] == clusters[0]["data_points"][2:7]
+
+    response = client.get(f"/kmeans/result/{task_id}", headers={"Accept": "application/x-ndjson"})
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert len(lines) == len(clusters) + sum(summary["cluster_sizes"])
+    assert lines[1] == {"cluster": 0, "data_point": clusters[0]["data_points"][0]}
+
+def test_elbow_search_and_recommended_k():
+    """Test the coarse-to-fine elbow search and its recommended k in the status and the summary"""
+    params = {**test_params_elbow, "k_max": 12, "search": "coarse-to-fine", "scores": True,
+              "seed": random.randrange(2 ** 31)}
+    with open(CSVFILEPATH, "rb") as file:
+        assert client.post("/elbow/", params={**params, "search": "binary"}, files={"file": file}).status_code == 400
+        file.seek(0)
+        task_id = client.post("/elbow/", params=params, files={"file": file}).json()["TaskID"]
+    while (status := client.get(f"/kmeans/status/{task_id}").json())["status"] != "completed":
+        pass
+
+    inertias = client.get(f"/kmeans/result/{task_id}").json()
+    assert {"1", "2", "3", "5", "8", "12"} <= set(inertias)
+    summary = client.get(f"/kmeans/result/{task_id}", params={"view": "summary"}).json()
+    assert summary["inertia_values"] == inertias and summary["recommended_k"] == status["recommended_k"]
+    assert list(summary["scores"]) == list(inertias)
+    assert str(summary["recommended_k"]) in inertias
+
+def test_task_events():
+    """Test the Server-Sent Events of a task until it is completed"""
+    params = {**test_params, "seed": random.randrange(2 ** 31)}
+    with open(TESTFILEPATH, "rb") as file:
+        task_id = client.post("/kmeans/", params=params, files={"file": file}).json()["TaskID"]
+
+    events = []
+    with client.stream("GET", f"/kmeans/events/{task_id}") as response:
+        assert response.headers["content-type"].startswith("text/event-stream")
+        for line in response.iter_lines():
+            if line.startswith("data: "):
+                events.append(json.loads(line[len("data: "):]))
+    assert events[-1] == {"status": "completed"}
+    assert client.get("/kmeans/events/unknown").status_code == 404
+
+def test_long_poll():
+    """Test that ?wait= answers on a status change and otherwise after the timeout"""
+    task_id = "long-poll-" + str(random.randrange(2 ** 31))
+    task_store.create(task_id, "one_k")
+
+    begin = time.perf_counter()
+    assert client.get(f"/kmeans/status/{task_id}", params={"wait": 0.3}).json() == {"status": "queued"}
+    assert time.perf_counter() - begin >= 0.3
+
+    timer = threading.Timer(0.2, lambda: task_store.update(task_id, status="processing"))
+    timer.start()
+    begin = time.perf_counter()
+    response = client.get(f"/kmeans/status/{task_id}", params={"wait": 10})
+    assert response.json()["status"] == "processing"
+    assert time.perf_counter() - begin < 5
+    timer.join()
+
+    task_store.delete(task_id)
+    assert client.get(f"/kmeans/status/{task_id}", params={"wait": 1}).status_code == 404
+
+def test_cancel_task():
+    """Test DELETE /kmeans/{task_id} for running, finished and unknown tasks"""
+    task_id = "cancel-" + str(random.randrange(2 ** 31))
+    task_store.create(task_id, "one_k", status="processing")
+    assert client.delete(f"/kmeans/{task_id}").json() == {"TaskID": task_id, "status": "cancelling"}
+    assert redis_client.hget(task_id, "cancel_requested") == "1"
+
+    task_store.update(task_id, status="cancelled", message="The task was cancelled. ")
+    assert client.get(f"/kmeans/status/{task_id}").json() == {"status": "cancelled",
+                                                              "message": "The task was cancelled. "}
+    assert client.delete(f"/kmeans/{task_id}").status_code == 409
+    assert client.get(f"/kmeans/result/{task_id}").status_code == 400
+    assert client.delete("/kmeans/unknown").status_code == 404
+
 if __name__ == "__main__":
     pytest.main()
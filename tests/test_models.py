@@ -0,0 +1,131 @@
+"""
+    Testing the model registry and the prediction of new rows with pytest
+"""
+import os
+import time
+import uuid
+import redis
+import numpy as np
+import pandas as pd
+import scipy.sparse
+from sklearn.metrics import pairwise_distances_argmin_min
+from app.datacheck import prepare_data
+from app.datasets import DatasetStore
+from app.kmeans_methods import fit_kmeans
+from app.models import KMeansModel, ModelRegistry, nearest_centroids
+from app.task_store import TaskStore
+
+REDIS_HOST = os.environ.get('REDIS_HOST', 'localhost')
+REDIS_PORT = os.environ.get('REDIS_PORT', '6379')
+
+task_store = TaskStore(redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True))
+
+def make_rows(rows=600, seed=0):
+    """
+    Returns raw rows with comma decimals, dates, a categorical and an ID column
+    """
+    rng = np.random.default_rng(seed)
+    group = rng.integers(0, 3, rows)
+    return pd.DataFrame({
+        'id': np.arange(rows),
+        'price': [f"{value:.2f}".replace(".", ",") for value in rng.normal(10000 * (group + 1), 500)],
+        'registered': [f"{day:02d}.0{month}.2020" for day, month in zip(rng.integers(1, 29, rows), group + 1)],
+        'fuel': np.array(['Diesel', 'Gasoline', 'Electric'])[group]})
+
+def fit_model(data, tmp_path, normalization="z", k_value=3):
+    """
+    Prepares the data like a k-means task, fits it and returns the model and the labels of the fit
+    """
+    store = DatasetStore(str(tmp_path))
+    task_id = str(uuid.uuid4())
+    task_store.create(task_id, "one_k", status="processing")
+    _, matrix = prepare_data(task_store, data, task_id, normalization, "abc123", store)
+    kmeans = fit_kmeans(matrix, k_value, 3, 100, 1e-4, "k-means++", "lloyd", 0)
+    return KMeansModel(kmeans.cluster_centers_, store.load_preparation("abc123", normalization)), kmeans.labels_
+
+def test_nearest_centroids_equals_sklearn():
+    """
+    Test the blocked assignment against pairwise_distances_argmin_min, dense and sparse
+    """
+    rng = np.random.default_rng(0)
+    matrix = rng.normal(size=(1000, 5))
+    centers = rng.normal(size=(7, 5))
+    for data in (matrix, scipy.sparse.random(1000, 5, density=0.3, format="csr", random_state=0)):
+        labels, distances = nearest_centroids(data, centers, block_bytes=1024)
+        expected_labels, expected_distances = pairwise_distances_argmin_min(data, centers)
+        np.testing.assert_array_equal(labels, expected_labels)
+        np.testing.assert_allclose(distances, expected_distances)
+
+def test_predict_raw_rows_like_the_fit(tmp_path):
+    """
+    Test that the raw rows of the fit get the labels of the fit, as objects, lists and dataframe
+    """
+    data = make_rows()
+    model, labels = fit_model(data, tmp_path)
+    assert model.used_columns == ['price', 'registered', 'fuel']
+
+    predicted, distances = model.predict(data)
+    np.testing.assert_array_equal(predicted, labels)
+    assert np.all(distances >= 0)
+    records = data.astype(object).to_dict("records")
+    np.testing.assert_array_equal(model.predict(records[:50])[0], labels[:50])
+    np.testing.assert_array_equal(model.predict(data.values.tolist()[:50])[0], labels[:50])
+
+def test_predict_marks_unpreparable_rows(tmp_path):
+    """
+    Test that rows with missing or invalid values or unknown categories get -1
+    """
+    model, labels = fit_model(make_rows(), tmp_path, normalization="min-max")
+    rows = make_rows(3).drop(columns='id').to_dict("records")
+    rows[0]['price'] = None
+    rows[1]['registered'] = "no date"
+    rows[2]['fuel'] = "Hydrogen"
+    predicted, distances = model.predict(rows)
+    assert predicted.tolist() == [-1, -1, -1] and np.isnan(distances).all()
+    assert len(labels) == 600
+    # Nur die Zeilen mit bekannten Kategorien werden zugeordnet
+    rows = make_rows(4).drop(columns='id').to_dict("records")
+    rows[1]['fuel'] = "Hydrogen"
+    predicted, _ = model.predict(rows)
+    assert predicted[1] == -1 and (predicted[[0, 2, 3]] >= 0).all()
+
+    try:
+        model.predict([{'price': "1,5"}])
+        assert False, "missing columns are rejected"
+    except ValueError as exception:
+        assert "registered" in str(exception)
+
+def test_registry_cache_and_disk(tmp_path):
+    """
+    Test the in-memory LRU, the reload from disk by another process and the TTL
+    """
+    model, _ = fit_model(make_rows(), tmp_path / "datasets")
+    registry = ModelRegistry(str(tmp_path / "models"), cache_size=1)
+    first = registry.save(model)
+    second = registry.save(model)
+    assert list(registry.cache) == [second]
+    assert registry.load(second) is model
+
+    other = ModelRegistry(str(tmp_path / "models"))
+    loaded = other.load(first)
+    np.testing.assert_array_equal(loaded.predict(make_rows(20))[0], model.predict(make_rows(20))[0])
+    assert other.stats()["misses"] == 1 and other.load(first) is loaded and other.stats()["hits"] == 1
+
+    # Ein Modell, das ein anderer Prozess gelöscht hat, fällt aus dem Cache
+    assert registry.delete(second)
+    assert other.load(second) is None and registry.load("0" * 32) is None
+
+    os.utime(registry.path(first), (time.time() - 100, time.time() - 100))
+    registry.ttl = 10
+    third = registry.save(model)
+    assert not registry.exists(first) and registry.exists(third)
+
+    # Unter derselben ID wird ein Modell nur einmal geschrieben
+    os.utime(registry.path(third), (time.time() - 5, time.time() - 5))
+    assert registry.save(model, third) == third and time.time() - os.path.getmtime(registry.path(third)) < 5
+    assert len(os.listdir(tmp_path / "models")) == 1
+
+    # Über max_bytes fallen die am längsten nicht genutzten Modelle weg
+    registry.max_bytes = os.path.getsize(registry.path(third))
+    fourth = registry.save(model)
+    assert not registry.exists(third) and registry.exists(fourth)
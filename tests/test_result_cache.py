@@ -0,0 +1,35 @@
+"""
+    Testing the result cache with pytest
+"""
+import os
+import uuid
+import redis
+from app.result_cache import ResultCache, cache_key
+
+REDIS_HOST = os.environ.get('REDIS_HOST', 'localhost')
+REDIS_PORT = os.environ.get('REDIS_PORT', '6379')
+
+redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+
+def test_cache_key_is_canonical():
+    """
+    Test that the key does not depend on the order of the parameters
+    """
+    assert cache_key("abc", "one_k", {"k": 3, "seed": 0}) == cache_key("abc", "one_k", {"seed": 0, "k": 3})
+    assert cache_key("abc", "one_k", {"k": 3}) != cache_key("abc", "one_k", {"k": 4})
+    assert cache_key("abc", "one_k", {"k": 3}) != cache_key("abd", "one_k", {"k": 3})
+
+def test_lru_eviction():
+    """
+    Test that the least recently used entries are evicted when the cache is full
+    """
+    cache = ResultCache(redis_client, max_bytes=3000, ttl=60, prefix=f"test-cache-{uuid.uuid4()}:")
+    keys = [str(uuid.uuid4()) for _ in range(3)]
+    cache.store(keys[0], {"method": "one_k", "json_result": "a" * 1000})
+    cache.store(keys[1], {"method": "one_k", "json_result": "b" * 1000})
+    assert cache.lookup(keys[0])["json_result"] == "a" * 1000
+
+    cache.store(keys[2], {"method": "one_k", "json_result": "c" * 1000})
+    assert cache.lookup(keys[1]) is None
+    assert cache.lookup(keys[0]) is not None
+    assert cache.lookup(keys[2]) is not None
@@ -0,0 +1,63 @@
+"""
+    Testing the partial reading of results with pytest
+"""
+import json
+import numpy as np
+import pandas as pd
+from app.datasets import DatasetStore
+from app import results
+from app.results import ResultRows, load_rows, result_page, iter_ndjson
+from app.utils import result_to_npz
+
+labels = np.array([0, 2, 2, 0, 2])
+centroids = np.array([[1.0], [5.0], [3.0]])
+
+def test_clusters_from_json_result():
+    """
+    Test that results without a dataset are paged from their stored json
+    """
+    result = {
+        "result_npz": result_to_npz(labels, centroids),
+        "json_result": json.dumps({"Cluster": [
+            {"centroids": [1.0], "data_points": [[1], [4]]},
+            {"centroids": [3.0], "data_points": [[2], [3], [5]]}]}),
+    }
+
+    rows = load_rows(result, store=None)
+    assert rows.clusters() == [0, 2]
+    page = result_page(rows, cluster=2, offset=1, limit=1)
+    assert page["Cluster"] == [{"cluster": 2, "centroids": [3.0], "size": 3, "data_points": [[3]]}]
+    assert [entry["data_points"] for entry in result_page(rows, offset=1)["Cluster"]] == [[[4]], [[3], [5]]]
+    assert "".join(iter_ndjson(rows)).count("\n") == 2 + 5
+
+def test_clusters_from_dataset(tmp_path):
+    """
+    Test that only the rows of a page are taken from the dataset and that the stream goes cluster by cluster
+    """
+    store = DatasetStore(str(tmp_path))
+    store.save_cleaned("abc123", pd.DataFrame({'x': [1, 2, 3, 4, 5], 'name': list("abcde")}))
+    rows = load_rows({"result_npz": result_to_npz(labels, centroids), "dataset_id": "abc123"}, store)
+
+    page = result_page(rows, offset=1, limit=1)
+    assert [entry["data_points"] for entry in page["Cluster"]] == [[[4, "d"]], [[3, "c"]]]
+    assert result_page(rows, cluster=0, offset=5)["Cluster"][0]["data_points"] == []
+
+    lines = [json.loads(line) for line in "".join(iter_ndjson(rows)).splitlines()]
+    assert [line.get("data_point") for line in lines] == [None, [1, "a"], [4, "d"], None, [2, "b"], [3, "c"], [5, "e"]]
+    assert lines[3] == {"cluster": 2, "centroids": [3.0], "size": 3}
+
+    store.delete("abc123")
+    assert load_rows({"result_npz": result_to_npz(labels, centroids), "dataset_id": "abc123"}, store) is None
+
+def test_clusters_from_chunks(monkeypatch):
+    """
+    Test that the rows of a mini-batch result are picked from the cleaned chunks, also over several passes
+    """
+    cleaned = pd.DataFrame({'x': [1, 2, 3, 4, 5], 'name': list("abcde")})
+    expected = [entry["data_points"] for entry in result_page(ResultRows(labels, centroids, cleaned_df=cleaned))["Cluster"]]
+    for pass_rows in (100, 1):
+        monkeypatch.setattr(results, "RESULT_PASS_ROWS", pass_rows)
+        rows = ResultRows(labels, centroids, chunks=lambda: iter([cleaned.iloc[:2], cleaned.iloc[2:]]))
+        assert [entry["data_points"] for entry in result_page(rows)["Cluster"]] == expected
+        assert result_page(rows, cluster=2, offset=1, limit=1)["Cluster"][0]["data_points"] == [[3, "c"]]
+        assert "".join(iter_ndjson(rows)).count("\n") == 2 + 5
@@ -0,0 +1,59 @@
+"""
+    Testing the scores of a clustering with pytest
+"""
+import numpy as np
+import scipy.sparse
+from sklearn.datasets import make_blobs
+from sklearn.metrics import calinski_harabasz_score, davies_bouldin_score, silhouette_score
+from app.scoring import sampled_silhouette, score_clustering, stratified_sample
+
+
+def make_clustering(rows=4000, centers=5):
+    """
+    Returns blobs with their true labels and the means of the clusters as centroids
+    """
+    matrix, labels = make_blobs(rows, n_features=4, centers=centers, random_state=0)
+    means = np.array([matrix[labels == cluster].mean(axis=0) for cluster in range(centers)])
+    return matrix, labels, means
+
+def test_indices_match_sklearn():
+    """
+    Test Davies-Bouldin and Calinski-Harabasz against sklearn, dense and sparse
+    """
+    matrix, labels, means = make_clustering()
+    scores = score_clustering(matrix, labels, means, 0)
+    assert np.isclose(scores["davies_bouldin"], davies_bouldin_score(matrix, labels))
+    assert np.isclose(scores["calinski_harabasz"], calinski_harabasz_score(matrix, labels))
+
+    sparse = scipy.sparse.csr_matrix(np.where(matrix > 0, matrix, 0))
+    means = np.array([sparse[labels == cluster].mean(axis=0).A1 for cluster in range(5)])
+    scores = score_clustering(sparse, labels, means, 0)
+    assert np.isclose(scores["davies_bouldin"], davies_bouldin_score(sparse.toarray(), labels))
+    assert np.isclose(scores["calinski_harabasz"], calinski_harabasz_score(sparse.toarray(), labels))
+
+def test_sampled_silhouette():
+    """
+    Test that the silhouette of the sample approximates the full silhouette
+    """
+    matrix, labels, _ = make_clustering()
+    full = silhouette_score(matrix, labels)
+    generator = np.random.default_rng(0)
+    assert abs(sampled_silhouette(matrix, labels, generator, size=800, working_memory=1) - full) < 0.02
+    assert np.isclose(sampled_silhouette(matrix, labels, generator, size=len(matrix)), full)
+
+def test_stratified_sample_keeps_small_clusters():
+    """
+    Test that every cluster is in the sample, in proportion to its size
+    """
+    labels = np.repeat([0, 1, 2], [9000, 990, 10])
+    indices = stratified_sample(labels, 1000, np.random.default_rng(0))
+    assert len(np.unique(indices)) == len(indices)
+    assert np.bincount(labels[indices]).tolist() == [900, 99, 2]
+
+def test_scores_of_one_cluster():
+    """
+    Test that a single cluster has no scores
+    """
+    matrix, _, _ = make_clustering(rows=100)
+    scores = score_clustering(matrix, np.zeros(100, dtype=int), matrix.mean(axis=0, keepdims=True))
+    assert scores == {"silhouette": None, "davies_bouldin": None, "calinski_harabasz": None}
@@ -0,0 +1,88 @@
+"""
+    Testing the fast seedings and the coreset mode with pytest
+"""
+import pytest
+import numpy as np
+import scipy.sparse
+from sklearn.datasets import make_blobs
+from sklearn.utils import check_random_state
+from app import kmeans_methods
+from app.kmeans_methods import fit_kmeans
+from app.seeding import kmeans_parallel, lightweight_coreset, seed_from_summary, squared_distances_to_mean
+from app.utils import check_parameter
+
+
+def make_blob_matrix(rows=20000, centers=20, seed=0):
+    """
+    Returns well separated gaussian blobs
+    """
+    matrix, _ = make_blobs(rows, n_features=8, centers=centers, random_state=seed)
+    return matrix
+
+def test_kmeans_parallel_summary():
+    """
+    Test that the candidates of k-means|| stand for all rows and seed k distinct centroids
+    """
+    matrix = make_blob_matrix()
+    generator = check_random_state(0)
+    candidates, weights = kmeans_parallel(matrix, 20, generator)
+    assert 20 <= len(candidates) < len(matrix) // 10
+    assert weights.sum() == len(matrix)
+
+    centers = seed_from_summary((candidates, weights), 20, generator)
+    assert centers.shape == (20, 8)
+    assert len(np.unique(centers, axis=0)) == 20
+
+def test_kmeans_parallel_few_distinct_rows():
+    """
+    Test that k-means|| fills up the candidates if the rows are identical
+    """
+    candidates, _ = kmeans_parallel(np.ones((100, 2)), 5, check_random_state(0))
+    assert len(candidates) == 5
+
+def test_coreset_approximates_cost():
+    """
+    Test that the weighted cost of the coreset approximates the cost of the data
+    """
+    matrix = make_blob_matrix()
+    points, weights = lightweight_coreset(matrix, 2000, check_random_state(0))
+    assert len(points) <= 2000
+    np.testing.assert_allclose(weights.sum(), len(matrix), rtol=0.05)
+
+    centers = matrix[:20]
+    def cost(rows, row_weights):
+        distances = ((rows[:, None, :] - centers[None]) ** 2).sum(axis=2).min(axis=1)
+        return float(np.dot(row_weights, distances))
+    np.testing.assert_allclose(cost(points, weights), cost(matrix, np.ones(len(matrix))), rtol=0.1)
+
+def test_squared_distances_to_mean_sparse():
+    """
+    Test the distances to the mean of a CSR matrix against the dense computation
+    """
+    matrix = scipy.sparse.random(200, 30, density=0.1, format="csr", random_state=0)
+    dense = matrix.toarray()
+    np.testing.assert_allclose(squared_distances_to_mean(matrix), ((dense - dense.mean(axis=0)) ** 2).sum(axis=1))
+    np.testing.assert_allclose(squared_distances_to_mean(dense), ((dense - dense.mean(axis=0)) ** 2).sum(axis=1))
+
+@pytest.mark.parametrize("engine", ["numpy", "sklearn"])
+@pytest.mark.parametrize("init", ["k-means||", "subsample", "coreset"])
+def test_fast_inits_find_the_blobs(monkeypatch, engine, init):
+    """
+    Test that the fast seedings and the coreset mode reach the inertia of k-means++
+    """
+    monkeypatch.setattr(kmeans_methods, "KMEANS_ENGINE", engine)
+    matrix = make_blob_matrix()
+    reference = fit_kmeans(matrix, 20, 3, 100, 1e-4, "k-means++", "lloyd", 0)
+    kmeans = fit_kmeans(matrix, 20, 3, 100, 1e-4, init, "lloyd", 0)
+
+    assert kmeans.labels_.shape == (len(matrix),)
+    assert kmeans.cluster_centers_.shape == (20, 8)
+    assert kmeans.inertia_ <= reference.inertia_ * 1.02
+
+def test_fast_inits_are_valid_parameters():
+    """
+    Test that check_parameter accepts the new values of init
+    """
+    for init in ("k-means||", "subsample", "coreset"):
+        assert check_parameter(None, 10, 100, 2, 2, init, "lloyd", None) == ""
+    assert "init" in check_parameter(None, 10, 100, 2, 2, "k-means|", "lloyd", None)
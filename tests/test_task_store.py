@@ -0,0 +1,78 @@
+"""
+    Testing the task store with pytest
+"""
+import os
+import threading
+import uuid
+import redis
+from app.task_store import TaskStore
+
+REDIS_HOST = os.environ.get('REDIS_HOST', 'localhost')
+REDIS_PORT = os.environ.get('REDIS_PORT', '6379')
+
+redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+
+def test_lifecycle_and_ttl():
+    """
+    Test that every write renews the TTL and that messages are appended
+    """
+    task_store = TaskStore(redis_client, ttl=120)
+    task_id = str(uuid.uuid4())
+    task_store.create(task_id, "elbow", cache_key="abc")
+    task = task_store.get(task_id)
+    assert task["status"] == "queued"
+    assert task["method"] == "elbow"
+    assert 0 < redis_client.ttl(task_id) <= 120
+
+    redis_client.expire(task_id, 5)
+    task_store.append_message(task_id, "first. ", status="processing")
+    task_store.fail(task_id, "second.")
+    task = task_store.get(task_id)
+    assert task["status"] == "Bad Request"
+    assert task["message"] == "first. second."
+    assert float(task["updated_at"]) >= float(task["created_at"])
+    assert redis_client.ttl(task_id) > 5
+
+    task_store.delete(task_id)
+    assert task_store.get(task_id) is None
+
+def test_renew_and_expired_hash():
+    """
+    Test that renew keeps tasks alive without recreating expired ones
+    and that a hash recreated by a late write counts as missing
+    """
+    task_store = TaskStore(redis_client, ttl=120)
+    task_id = str(uuid.uuid4())
+    task_store.create(task_id, "one_k")
+    redis_client.expire(task_id, 5)
+    task_store.renew(task_id, "missing-" + task_id)
+    assert redis_client.ttl(task_id) > 5
+    assert not redis_client.exists("missing-" + task_id)
+
+    task_store.delete(task_id)
+    task_store.update(task_id, inertia=1.5)
+    assert task_store.get(task_id) is None
+    assert task_store.field(task_id, "status") is None
+    task_store.delete(task_id)
+
+def test_concurrent_appends():
+    """
+    Test that messages appended at the same time are all kept
+    """
+    task_store = TaskStore(redis_client, ttl=120)
+    task_id = str(uuid.uuid4())
+    task_store.create(task_id, "elbow")
+
+    def append(thread):
+        client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+        for number in range(20):
+            TaskStore(client, ttl=120).append_message(task_id, f"{thread}-{number};")
+
+    threads = [threading.Thread(target=append, args=(thread,)) for thread in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    messages = task_store.get(task_id)["message"].split(";")[:-1]
+    assert sorted(messages) == sorted(f"{thread}-{number}" for thread in range(4) for number in range(20))
+    task_store.delete(task_id)
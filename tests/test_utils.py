@@ -0,0 +1,187 @@
+"""
+    Testing the file ingestion and the result formats with pytest
+"""
+import io
+import os
+import json
+import numpy as np
+import pandas as pd
+import openpyxl
+import pyarrow.feather
+import pytest
+from app import utils
+from app.datasets import DatasetStore
+from app.utils import read_file, read_csv_chunked, sniff_csv_format, read_xlsx, read_spooled, spool_upload
+from app.utils import iter_file_chunks, iter_json_items, iter_ndjson_items, iter_json_chunks, concat_json_chunks
+from app.utils import dataframe_to_json_str, result_to_npz, result_from_npz
+
+CSVFILEPATH = "tests/autoscout24-100.csv"
+
+def test_sniff_csv_format():
+    """
+    Test detection of delimiter and decimal separator
+    """
+    assert sniff_csv_format("a,b\n1.5,2\n") == (",", ".")
+    assert sniff_csv_format("a;b\n1,5;2\n3,5;4\n") == (";", ",")
+    assert sniff_csv_format("a;b\n1.5;2\n3.5;4\n") == (";", ".")
+    assert sniff_csv_format("a\tb\n1.5\t2\n") == ("\t", ".")
+
+def test_read_csv_decimal_comma():
+    """
+    Test csv with semicolon and decimal comma
+    """
+    file = io.BytesIO("a;b;c\n1,5;2;x\n3,25;4;y\n".encode("utf-8"))
+    dataframe = read_file(file, "data.csv")
+    assert list(dataframe.columns) == ["a", "b", "c"]
+    assert dataframe["a"].tolist() == [1.5, 3.25]
+
+def test_read_csv_chunks_equal_whole_file():
+    """
+    Test that reading in chunks gives the same dataframe
+    """
+    with open(CSVFILEPATH, "rb") as file:
+        whole = read_file(file, "autoscout.csv")
+    with open(CSVFILEPATH, "rb") as file:
+        chunked = read_csv_chunked(file, chunk_rows=7)
+    assert whole.shape == (99, 9)
+    pd.testing.assert_frame_equal(whole, chunked)
+
+def make_workbook():
+    """
+    Returns a xlsx file with empty cells, an empty row, repeated and missing names
+    """
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    for row in (["a", "b", None, "a", 5, None], [1, "x", 2.5, 1.0, None], [None] * 5,
+                [2, "y", 3, 2, "z"], [3, None, 4, 3.5, None], [None] * 3):
+        sheet.append(row)
+    file = io.BytesIO()
+    workbook.save(file)
+    file.seek(0)
+    return file
+
+def test_read_xlsx_equals_read_excel(monkeypatch):
+    """
+    Test that the streamed, columnar workbook reader gives the frame of pd.read_excel
+    """
+    monkeypatch.setattr(utils, "XLSX_ENGINE", "openpyxl")
+    expected = pd.read_excel(make_workbook(), engine="openpyxl")
+    for block_rows in (1, 2, 1000):
+        pd.testing.assert_frame_equal(read_xlsx(make_workbook(), block_rows), expected)
+    pd.testing.assert_frame_equal(read_file(make_workbook(), "data.xlsx"), expected)
+
+def test_converted_workbook_is_reused(tmp_path, monkeypatch):
+    """
+    Test that a workbook is converted once per dataset ID
+    """
+    monkeypatch.setattr(utils, "XLSX_ENGINE", "openpyxl")
+    store = DatasetStore(str(tmp_path / "datasets"))
+    source = spool_upload(make_workbook(), "data.xlsx", str(tmp_path))
+    source["dataset_id"] = "abc123"
+    first = read_spooled(source, store)
+
+    # Ohne die Datei kann nur die konvertierte Kopie gelesen werden
+    os.remove(source["path"])
+    pd.testing.assert_frame_equal(read_spooled(source, store), first)
+    assert not store.exists("abc123")
+
+def test_columnar_formats(tmp_path):
+    """
+    Test that parquet, arrow/feather and npy files are read with only the requested columns
+    """
+    dataframe = pd.read_csv(CSVFILEPATH)
+    dataframe.to_parquet(tmp_path / "data.parquet", row_group_size=10)
+    pyarrow.feather.write_feather(dataframe, str(tmp_path / "data.feather"))
+    pyarrow.feather.write_feather(dataframe, str(tmp_path / "data.arrow"), compression="uncompressed")
+    columns = ["price", "make"]
+    for name in ("data.parquet", "data.feather", "data.arrow"):
+        path = str(tmp_path / name)
+        with open(path, "rb") as file:
+            from_file = read_file(file, name, columns)
+        pd.testing.assert_frame_equal(read_file(path, name, columns), dataframe[columns], check_dtype=False)
+        pd.testing.assert_frame_equal(from_file, dataframe[columns], check_dtype=False)
+        with pytest.raises(ValueError):
+            read_file(path, name, ["unknown"])
+
+    np.save(tmp_path / "data.npy", dataframe[["mileage", "price"]].to_numpy())
+    projected = read_file(str(tmp_path / "data.npy"), "data.npy", ["1"])
+    assert projected["1"].tolist() == dataframe["price"].tolist()
+
+def test_parquet_chunks(tmp_path):
+    """
+    Test that a parquet upload of a streaming job is read in chunks of the requested columns
+    """
+    dataframe = pd.read_csv(CSVFILEPATH)
+    dataframe.to_parquet(tmp_path / "data.parquet", row_group_size=10)
+    source = {"path": str(tmp_path / "data.parquet"), "filename": "data.parquet", "columns": ["hp", "price"]}
+    chunks = list(iter_file_chunks(source, chunk_rows=40))
+    assert [len(chunk) for chunk in chunks] == [40, 40, 19]
+    pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), dataframe[["hp", "price"]],
+                                  check_dtype=False)
+
+def test_csv_column_projection():
+    """
+    Test that only the requested columns of a csv file are parsed, in the requested order
+    """
+    with open(CSVFILEPATH, "rb") as file:
+        dataframe = read_file(file, "autoscout.csv", ["price", "make"])
+    assert list(dataframe.columns) == ["price", "make"]
+    with open(CSVFILEPATH, "rb") as file, pytest.raises(ValueError):
+        read_file(file, "autoscout.csv", ["unknown"])
+
+def test_streamed_json_equals_json_load():
+    """
+    Test that the data points parsed one at a time give the frame of json.load,
+    also when values and numbers are split across blocks
+    """
+    documents = [{"centroids": [[4, 2]], "data_points": [[2, 3.5, 4], [5, 6, 7]], "meta": {"x": "]}"}},
+                 {"data_points": [{"a": 1, "b": "x"}, {"a": None, "b": "y"}, {"a": 1234567, "c": 0.25}]},
+                 {"data_points": []}]
+    for document in documents:
+        content = json.dumps(document, indent=4).encode("utf-8")
+        expected = pd.DataFrame(document["data_points"])
+        for block_bytes, chunk_rows in ((1, 1), (7, 2), (4096, 1000)):
+            items = iter_json_items(io.BytesIO(content), block_bytes=block_bytes)
+            dataframe = concat_json_chunks(iter_json_chunks(items, chunk_rows))
+            if len(expected):
+                pd.testing.assert_frame_equal(dataframe, expected)
+
+    with open("tests/kmeans_test.json", "rb") as file:
+        expected = pd.DataFrame(json.load(file)["data_points"])
+    with open("tests/kmeans_test.json", "rb") as file:
+        pd.testing.assert_frame_equal(read_file(file, "kmeans_test.json"), expected)
+
+    with pytest.raises(ValueError):
+        read_file(io.BytesIO(b'{"data_points": [[1, 2], [3'), "data.json")
+
+def test_ndjson():
+    """
+    Test reading line-delimited json
+    """
+    content = b'{"a": 1, "b": "x"}\n{"a": 2.5, "b": "y"}\n\n'
+    items = list(iter_ndjson_items(io.BytesIO(content), block_bytes=5))
+    assert items == [{"a": 1, "b": "x"}, {"a": 2.5, "b": "y"}]
+    dataframe = read_file(io.BytesIO(content), "data.ndjson")
+    assert dataframe["a"].tolist() == [1.0, 2.5]
+
+def test_json_result_grouping():
+    """
+    Test that the single-pass grouping gives the clusters and data points of per-cluster masks
+    """
+    dataframe = pd.DataFrame({"x": [1.0, 2.0, 3.0, 4.0, 5.0], "make": ["a", "b", "c", "d", "e"]})
+    labels = np.array([2, 0, 2, 0, 2])
+    centroids = np.array([[3.0], [0.0], [3.0]])
+
+    result = json.loads(dataframe_to_json_str(dataframe, labels, centroids))
+    expected = [{"centroids": centroids[cluster].tolist(),
+                 "data_points": dataframe[labels == cluster].values.tolist()} for cluster in (0, 2)]
+    assert result == {"Cluster": expected}
+
+def test_npz_result_roundtrip():
+    """
+    Test packing and unpacking of the binary result
+    """
+    labels, centroids = result_from_npz(result_to_npz([1, 0, 1], [[0.5, 1.5], [2.0, 3.0]]))
+    assert np.asarray(labels).dtype == np.int32
+    np.testing.assert_array_equal(labels, [1, 0, 1])
+    np.testing.assert_array_equal(centroids, [[0.5, 1.5], [2.0, 3.0]])
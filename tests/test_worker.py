@@ -0,0 +1,124 @@
+"""
+    Testing the queue workers with pytest
+"""
+import os
+import uuid
+import redis
+import pandas as pd
+from app.job_queue import JobQueue
+from app.task_store import TaskStore
+from app.utils import spool_dataframe
+from app.worker import Worker, WorkerPool, elbow_jobs
+
+REDIS_HOST = os.environ.get('REDIS_HOST', 'localhost')
+REDIS_PORT = os.environ.get('REDIS_PORT', '6379')
+
+redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+
+data = pd.DataFrame({'x': [1, 2, 3, 4, 5], 'y': [5, 4, 3, 2, 1]})
+
+def enqueue(job_queue):
+    """
+    Creates a task and pushes a small k-means job for it
+    """
+    task_id = str(uuid.uuid4())
+    TaskStore(redis_client).create(task_id, "one_k")
+    job_queue.push(task_id, {"target": "run_kmeans_one_k", "frame": spool_dataframe(data),
+                             "args": [2, 5, 100, 1e-4, "k-means++", "lloyd"]})
+    return task_id
+
+def test_run_job():
+    """
+    Test that a worker runs a claimed job and removes it from its processing list
+    """
+    prefix = f"test-{uuid.uuid4().hex}:"
+    worker = Worker(redis_client, prefix)
+    task_id = enqueue(worker.job_queue)
+    frame = worker.job_queue.job(task_id)[0]["frame"]
+
+    assert worker.job_queue.claim(worker.worker_id, 1) == task_id
+    worker.run_job(task_id)
+
+    assert redis_client.hget(task_id, "status") == "completed"
+    assert redis_client.llen(worker.job_queue.processing_key(worker.worker_id)) == 0
+    assert not os.path.exists(frame)
+
+def test_ttl_of_waiting_and_running_tasks():
+    """
+    Test that the queue renews the TTL of waiting and running tasks
+    and that the data of an expired task is removed
+    """
+    job_queue = JobQueue(redis_client, f"test-{uuid.uuid4().hex}:")
+    running = enqueue(job_queue)
+    waiting = enqueue(job_queue)
+    assert job_queue.claim("busy-worker", 1) == running
+
+    for task_id in (running, waiting):
+        redis_client.expire(task_id, 5)
+    job_queue.heartbeat("busy-worker", running)
+    assert redis_client.ttl(running) > 5 and redis_client.ttl(waiting) > 5
+
+    worker = Worker(redis_client, job_queue.prefix)
+    frame = job_queue.job(waiting)[0]["frame"]
+    redis_client.delete(waiting)
+    assert worker.job_queue.claim(worker.worker_id, 1) == waiting
+    worker.run_job(waiting)
+    assert not os.path.exists(frame)
+    assert job_queue.job(waiting)[0] is None
+    assert not redis_client.exists(waiting)
+
+def test_elbow_jobs_share_the_cores():
+    """
+    Test that the worker processes share the CPU cores among the parallel fits of their elbow sweeps
+    """
+    cores = os.cpu_count() or 1
+    assert elbow_jobs(1) == cores
+    assert elbow_jobs(cores) == elbow_jobs(2 * cores) == 1
+    assert WorkerPool("localhost", 6379, processes=cores).args[-1] == 1
+
+def test_orphan_requeue():
+    """
+    Test that the job of a dead worker is moved back to the front of the queue
+    and fails once it killed too many workers
+    """
+    job_queue = JobQueue(redis_client, f"test-{uuid.uuid4().hex}:", retries=0)
+    task_id = enqueue(job_queue)
+    enqueue(job_queue)
+
+    # Ein Worker nimmt den Job an und stirbt, ohne seinen Heartbeat zu erneuern
+    job_queue.heartbeat("dead-worker")
+    assert job_queue.claim("dead-worker", 1) == task_id
+    assert not job_queue.requeue_orphans()
+    redis_client.delete(job_queue.heartbeat_key("dead-worker"))
+
+    assert job_queue.requeue_orphans() == [task_id]
+    assert job_queue.position(task_id) == 1
+    assert job_queue.job(task_id)[1] == 1
+    assert "dead-worker" not in redis_client.smembers(job_queue.workers_key)
+
+    worker = Worker(redis_client, job_queue.prefix)
+    worker.job_queue.retries = 0
+    assert worker.job_queue.claim(worker.worker_id, 1) == task_id
+    worker.run_job(task_id)
+    assert redis_client.hget(task_id, "status") == "Bad Request"
+    assert "died 1 times" in redis_client.hget(task_id, "message")
+
+def test_cancel_and_timeout():
+    """
+    Test that a cancelled job does not start and that a job over its budget stops with "timeout"
+    """
+    worker = Worker(redis_client, f"test-{uuid.uuid4().hex}:")
+    task_id = enqueue(worker.job_queue)
+    frame = worker.job_queue.job(task_id)[0]["frame"]
+    TaskStore(redis_client).update(task_id, cancel_requested=1)
+    assert worker.job_queue.claim(worker.worker_id, 1) == task_id
+    worker.run_job(task_id)
+    assert redis_client.hget(task_id, "status") == "cancelled"
+    assert not os.path.exists(frame)
+
+    worker.timeout = 1e-9
+    task_id = enqueue(worker.job_queue)
+    assert worker.job_queue.claim(worker.worker_id, 1) == task_id
+    worker.run_job(task_id)
+    assert redis_client.hget(task_id, "status") == "timeout"
+    assert "time limit" in redis_client.hget(task_id, "message")